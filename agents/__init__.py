@@ -1,4 +1 @@
-from os.path import dirname, basename, isfile, join
-import glob
-modules = glob.glob(join(dirname(__file__), "*.py"))
-__all__ = [ basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
\ No newline at end of file
+__all__ = ['backtesting_agent', 'base_agent', 'broker_agent', 'ceo_agent', 'checkpoint_agent', 'dao_agent', 'decider_agent', 'fill_tracker_agent', 'macroecon_agent', 'pnl_agent', 'powerbi_agent', 'process_agent', 'simulate_agent', 'tick_driver_agent', 'var_agent']
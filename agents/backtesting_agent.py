@@ -1,48 +1,83 @@
 from .base_agent import BaseAgent
 import time
+import queue
 import logging
 from config import constants
-import pandas as pd
-import numpy as np
-from sklearn.linear_model import LogisticRegression
 from utils.io_utils import Type
+from utils import cbr_utils
 
-"""BackTestingAgent to update agent weights and CBR model at the end of every trade cycle"""
+"""
+BackTestingAgent to update agent weights and CBR model at the end of every trade cycle
+Runs as a background trainer: retrain requests are queued and coalesced, so callers never wait for a fit
+"""
 class BackTestingAgent(BaseAgent):
 
     def __init__(self, signal_agents, dao_agent):
         super().__init__()
         self.dao_agent = dao_agent
         self.signal_agents = signal_agents
-        self.cbr_columns = ['Action', 'Quantity', 'Price', 'Balance']+sorted([x.__str__() for x in self.signal_agents])+['MACRO_0', 'MACRO_1', 'MACRO_2', 'VaR']
+        self.cbr_columns = cbr_utils.cbr_columns([x.__str__() for x in self.signal_agents])
 
-    """Update parameters on each trade cycle"""
+        # At most one pending job, further requests are merged into it
+        self.jobs = queue.Queue(maxsize=1)
+        self.coalesced_requests = 0
+        self.last_duration = None
+
+        # CBR training cases, loaded from disk on the first retrain and appended to afterwards
+        self.training_set = None
+
+    """Retrain whenever a job is queued"""
     def run(self):
         while True:
-            self.calculate()
-            time.sleep(constants.CYCLE)
+            self.jobs.get()
+            start = time.perf_counter()
+            try:
+                self.calculate()
+            except Exception as e:
+                logging.error(f'Retraining failed: {e}')
+            self.last_duration = time.perf_counter() - start
 
-    """Calculate and update agent weights and CBR model"""
+    """
+    Request a retrain without waiting for it
+    Returns False if a retrain is already pending, in which case the request is merged into it
+    """
+    def request_retrain(self):
+        try:
+            self.jobs.put_nowait(True)
+            return True
+        except queue.Full:
+            self.coalesced_requests += 1
+            return False
+
+    """
+    Calculate and update agent weights and CBR model
+    Completed trades are put back into the account book if training fails, so they are used and saved next time
+    """
     def calculate(self):
-        self.lock.acquire()
+        with self.lock:
 
-        # Check if completed trades (Buy and sell) in account book
-        account_book = self.dao_agent.account_book
-        if(account_book is not None and 'PNL' in account_book.columns and account_book['PNL'].notna().any()):
-            weights = self.dao_agent.agent_weights.iloc[-1].to_dict()
-            done_trades = account_book[~account_book['PNL'].isnull()]
+            # Take completed trades (Buy and sell) out of the account book
+            done_trades = self.dao_agent.take_completed_trades()
+            if(done_trades is None):
+                logging.info('No completed trades to update')
+                return
+            try:
+                weights = self.dao_agent.snapshot.weights_dict()
+                new_weights = self._update_weights(weights, done_trades)
 
-            # Update weights and save to database
-            new_weights = self._update_weights(weights, done_trades)
-            self._save_weights(new_weights)
+                #Update CBR Model
+                cbr = self._update_cbr(done_trades)
+            except Exception:
+                self.dao_agent.return_completed_trades(done_trades)
+                raise
 
-            #Update CBR Model
-            self._update_cbr(done_trades)
-            self.dao_agent.save_all_data()
+            # Save weights, then publish weights and model together so the decider never sees a mix of versions
+            # The trades are used from here on, if they can't be saved the DAO keeps them to retry rather than returning them
+            self._save_weights(new_weights)
+            snapshot = self.dao_agent.publish_snapshot(weights=new_weights, cbr_model=cbr)
+            self.dao_agent.save_all_data(done_trades)
+            logging.info(f'Published model version {snapshot.version}')
             logging.info('Recalculated weights and CBR')
-        else:
-            logging.info('No completed trades to update')
-        self.lock.release()
 
     """
     Update agent weights based on profit and loss from completed trades
@@ -72,20 +107,38 @@ class BackTestingAgent(BaseAgent):
     def _save_weights(self, weights):
         self.dao_agent.add_data(weights, Type.AGENT_WEIGHTS)
 
-    """Update CBR model with latest completed trades"""
+    """
+    Load the CBR training cases saved before this run (historic tradebook and previous account books)
+    Stored trades that are still open have no outcome yet and are left out
+    Rows are encoded in the same feature order the decider predicts with
+    """
+    def _load_training_set(self):
+        training_set = cbr_utils.TrainingSet(len(self.cbr_columns))
+        stored_trades = self.dao_agent.load_all_data(Type.ACCOUNT_BOOK)
+        open_trades = self.dao_agent.open_trades()
+        if(stored_trades is not None and open_trades is not None):
+            stored_trades = stored_trades[~stored_trades['Client_order_id'].isin(open_trades['Client_order_id'])]
+        for trades in [self.dao_agent.get_historic_tradebook(), stored_trades]:
+            if(trades is not None and len(trades) > 0):
+                training_set.append(cbr_utils.feature_matrix(trades, self.cbr_columns), cbr_utils.pnl_labels(trades['PNL']))
+        logging.info(f'Loaded {training_set.size} CBR training cases')
+        return training_set
+
+    """Retrain CBR model with latest completed trades"""
     def _update_cbr(self, account_book):
-        
-        # Collect historic trades, trades from previous cycles (old_trades) as well as trades in current cycle (new_trades)
-        historic_trades = self.dao_agent.get_historic_tradebook()
-        old_account_book = self.dao_agent.load_all_data(Type.ACCOUNT_BOOK)
-        old_trades = None if old_account_book is None else old_account_book[self.cbr_columns+['PNL']]
-        new_trades = account_book[self.cbr_columns+['PNL']]
-        updated_trades = pd.concat([historic_trades, old_trades, new_trades], axis=0)
-
-        # Retrain CBR Model and save to database
+
+        # Append trades completed in this cycle to the cached training set instead of re-reading the csv files
+        if(self.training_set is None):
+            self.training_set = self._load_training_set()
+        size = self.training_set.size
+        self.training_set.append(cbr_utils.feature_matrix(account_book, self.cbr_columns), cbr_utils.pnl_labels(account_book['PNL']))
+
+        # Retrain CBR Model, dropping the new cases again if it fails as their trades are retried
+        from sklearn.linear_model import LogisticRegression
         cbr = LogisticRegression(solver='liblinear')
-        X, y = updated_trades.loc[:, updated_trades.columns != 'PNL'].copy(), updated_trades.loc[:, 'PNL'].copy()
-        X.loc[:, 'Action'] = X['Action'].apply(lambda x: 1 if 'buy' else -1)
-        y = np.where(y > 0, 1, -1)
-        cbr.fit(X, y)
-        self.dao_agent.cbr_model = cbr
\ No newline at end of file
+        try:
+            cbr.fit(self.training_set.X, self.training_set.y)
+        except Exception:
+            self.training_set.size = size
+            raise
+        return cbr
@@ -1,17 +1,35 @@
 from abc import ABC, abstractmethod
 from threading import Thread, Lock
+import time
+from config import constants
+from utils.clock_utils import TickClock
 import logging
 
 """Base Agent to provide common functionality for all agents"""
 class BaseAgent(ABC):
 
+    # Number of recent values kept in checkpoints for warm restarts
+    checkpoint_history = 100
+
+    # Seconds between runs of a periodic agent, TICK if not set
+    tick_period = None
+
     def __init__(self):
         self.lock = Lock()
 
+        # Runs are scheduled on shared absolute tick boundaries so agents don't drift apart
+        self.clock = TickClock(self.tick_period if self.tick_period is not None else constants.TICK)
+
         # Generate threads to run in the background
         self.thread = Thread(name = self.__str__(), target = self.run)
         self.thread.daemon = True
         self.updated = False
+
+        # Monotonic time the latest value was produced, None until the first one
+        self.updated_at = None
+
+        # Bumped whenever the checkpointed state changes, so unchanged state is not serialised again
+        self.state_version = 0
         logging.info(f'Created {self.__str__()}')
 
     @abstractmethod
@@ -26,6 +44,28 @@ class BaseAgent(ABC):
     """Stop running the thread for clean exit"""
     def stop(self):
         logging.info(f'Stopping {self.__str__()}')
+        if(self.clock.ticks > 0):
+            logging.info('%s clock: %s', self.__str__(), self.clock.stats())
+
+    """Flag a new value as available and record when it was produced"""
+    def mark_updated(self):
+        self.updated_at = time.monotonic()
+        self.updated = True
+        self.state_version += 1
+
+    """Seconds since the latest value was produced, None if none was produced yet"""
+    def age(self, now=None):
+        if(self.updated_at is None):
+            return None
+        return (now if now is not None else time.monotonic()) - self.updated_at
+
+    """Get state to checkpoint for a warm restart, None if the agent has no state worth keeping"""
+    def get_state(self):
+        return None
+
+    """Restore state saved by get_state"""
+    def set_state(self, state):
+        pass
 
     """Get the name of the agent"""
     def __str__(self):
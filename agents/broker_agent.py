@@ -1,15 +1,50 @@
-from alpaca_trade_api.rest import REST, TimeFrame, TimeFrameUnit, APIError
-from alpaca_trade_api.common import URL
 from config import alpaca, constants
-from utils import datetime_utils
+from utils import datetime_utils, call_utils
+from utils.bar_utils import BarStore
+from utils.rate_utils import PriorityRateLimiter, Coalescer
+import pandas as pd
 import logging
-
-"""Broker Agent to interact with the Alpaca Trade and Market APIs for Paper Trading"""
+from threading import local
+
+"""
+Broker Agent to interact with the Alpaca Trade and Market APIs for Paper Trading
+With a bar store, every bar received is persisted and only bars newer than the stored ones are fetched
+Every API call goes through a resilient caller with timeouts and circuit breakers per endpoint.
+Reads are retried and serve their last good value while Alpaca is down, orders are never retried.
+Calls are rate limited client-side by priority, so orders go out before account, quote and bar requests,
+and identical reads in flight at the same time share one response.
+"""
 class BrokerAgent():
 
-    def __init__(self):
+    # Rate limit priority of each endpoint, lower first
+    priorities = {'alpaca.submit': 0, 'alpaca.cancel': 0, 'alpaca.account': 1, 'alpaca.position': 1, 'alpaca.orders': 1,
+        'alpaca.latest': 2, 'alpaca.bars': 3}
+
+    # Endpoints whose identical concurrent requests are coalesced
+    coalesced_endpoints = ('alpaca.account', 'alpaca.position', 'alpaca.orders', 'alpaca.latest', 'alpaca.bars')
+
+    def __init__(self, bar_store=None, caller=None, rate=200/60, burst=10):
+        from alpaca_trade_api.rest import REST, APIError
+        from alpaca_trade_api.common import URL
         self.url = URL('https://paper-api.alpaca.markets')
 
+        # Endpoint policies, a missing position is an expected API error
+        self.caller = caller if caller is not None else call_utils.shared_caller()
+        self.caller.endpoint('alpaca.account', timeout=5.0)
+        self.caller.endpoint('alpaca.position', timeout=5.0, passthrough=(APIError,))
+        self.caller.endpoint('alpaca.bars', timeout=10.0)
+        self.caller.endpoint('alpaca.latest', timeout=5.0)
+        self.caller.endpoint('alpaca.orders', timeout=5.0)
+        self.caller.endpoint('alpaca.submit', timeout=10.0, retries=0, fallback=False)
+        self.caller.endpoint('alpaca.cancel', timeout=5.0, retries=0, fallback=False)
+
+        # Alpaca allows 200 requests per minute
+        self.rate_limiter = PriorityRateLimiter(rate, burst)
+        self.coalescer = Coalescer()
+
+        # Whether the last call of each thread was answered by Alpaca, shared with coalesced callers
+        self.local = local()
+
         # Alpaca API credentials taken from alpaca config
         self.api = REST(key_id=alpaca.CLIENT_ID,
                 secret_key=alpaca.CLIENT_SECRET,
@@ -24,6 +59,36 @@ class BrokerAgent():
         self.error_flag = False
         self.account = None
         self.position = None
+        self.bar_store = bar_store
+
+    """
+    Call the Alpaca API through the rate limiter and the resilient caller
+    Every attempt, retries included, waits for its own token before it is sent, and the wait counts towards the attempt timeout.
+    An attempt that gets no token in time fails with a timeout without being sent, so a timed out order is never placed later.
+    Reads are coalesced with identical requests in flight.
+    Requests are identified by the function name and arguments unless a key is given
+    """
+    def _call(self, endpoint, function, *args, key=None):
+        key = key if key is not None else repr((function.__name__, args))
+        def acquire(timeout):
+            self.rate_limiter.acquire(self.priorities[endpoint], timeout)
+        def call():
+            value = self.caller.call(endpoint, function, *args, key=key, before=acquire)
+            return value, self.caller.last_call_fresh()
+        self.local.fresh = False
+        if(endpoint in self.coalesced_endpoints):
+            value, self.local.fresh = self.coalescer.call((endpoint, key), call)
+        else:
+            value, self.local.fresh = call()
+        return value
+
+    """Check whether the last Alpaca call of the calling thread returned new data rather than a last good value"""
+    def last_call_fresh(self):
+        return getattr(self.local, 'fresh', False)
+
+    """Rate limiter queue depth and throttle waits, and coalesced requests"""
+    def rate_stats(self):
+        return {'rate_limiter': self.rate_limiter.stats(), 'coalescer': self.coalescer.stats()}
 
     """
     Get current balance from Alpaca account
@@ -32,11 +97,12 @@ class BrokerAgent():
     Passing symbol of the asset returns position balance
     """
     def get_balance(self, symbol):
-        self.account = self.api.get_account()._raw
+        from alpaca_trade_api.rest import APIError
+        self.account = self._call('alpaca.account', self.api.get_account)._raw
 
         # Alpaca throws error if position is empty for asset
         try:
-            self.position = self.api.get_position('BTCUSD')._raw
+            self.position = self._call('alpaca.position', self.api.get_position, 'BTCUSD')._raw
         except APIError:
             self.position = {'qty': 0}
         if(symbol == 'cash' or symbol == 'equity'):
@@ -49,8 +115,15 @@ class BrokerAgent():
     Timeframe is passed to specify the frequency at which bars are returned
     """
     def ohlcv_data(self, symbol, timeframe=constants.TIMEFRAME):
-        ohlcv = self.api.get_crypto_bars(symbol, TimeFrame(timeframe, TimeFrameUnit.Minute), None, None, None, [alpaca.EXCHANGE]).df
-        
+        if(self.bar_store is None):
+            ohlcv = self._fetch_bars(symbol, timeframe)
+        else:
+            # Fetch bars after the last stored bar and serve the window from the store
+            series = BarStore.series(symbol, timeframe)
+            last = self.bar_store.last_timestamp(series)
+            self.bar_store.append(series, self._fetch_bars(symbol, timeframe, None if last is None else last.isoformat()))
+            ohlcv = self.bar_store.window(series, constants.LIMIT+1)
+
         # Timezone converted from GMT to local time
         ohlcv.index = datetime_utils.convert_gmt_to_local(ohlcv.index)
 
@@ -61,15 +134,35 @@ class BrokerAgent():
             self.error_flag = True
         
         # If we have more than the desired number of bars, we drop the excess
-        ohlcv = ohlcv.iloc[-(constants.LIMIT+1):]
-        ohlcv.drop(['exchange', 'trade_count', 'vwap'], axis=1, inplace=True)
-        ohlcv.columns=['Open', 'High', 'Low', 'Close', 'Volume']
+        return(ohlcv.iloc[-(constants.LIMIT+1):])
+
+    """Fetch OHLCV bars in GMT from Alpaca, optionally limited to a time range"""
+    def _fetch_bars(self, symbol, timeframe, start=None, end=None):
+        from alpaca_trade_api.rest import TimeFrame, TimeFrameUnit
+        ohlcv = self._call('alpaca.bars', self.api.get_crypto_bars, symbol, TimeFrame(timeframe, TimeFrameUnit.Minute), start, end, None, [alpaca.EXCHANGE],
+            key=repr(('get_crypto_bars', symbol, timeframe, start, end))).df
+        ohlcv = ohlcv.rename(columns=str.title).reindex(columns=BarStore.columns)
         ohlcv.index.rename('Timestamp', inplace=True)
         return(ohlcv)
 
+    """
+    Fetch the bars missing from the bar store for the latest window
+    Gaps are fetched in a single request from the first to the last missing bar, returns the number of gaps
+    """
+    def backfill(self, symbol, timeframe=constants.TIMEFRAME, rows=constants.LIMIT+1):
+        if(self.bar_store is None):
+            return 0
+        series = BarStore.series(symbol, timeframe)
+        end = pd.Timestamp.now(tz='UTC')
+        gaps = self.bar_store.gaps(series, end - pd.Timedelta(minutes=timeframe*rows), end, timeframe)
+        if(len(gaps) > 0):
+            self.bar_store.append(series, self._fetch_bars(symbol, timeframe, gaps[0][0].isoformat(), gaps[-1][1].isoformat()))
+        logging.info(f'Backfilled {len(gaps)} gaps in {series} bars')
+        return len(gaps)
+
     """Get the latest OHLCV bar from Alpaca"""
     def latest_ohlcv(self, symbol):
-        latest = self.api.get_latest_crypto_bar(symbol, alpaca.EXCHANGE)._raw
+        latest = dict(self._call('alpaca.latest', self.api.get_latest_crypto_bar, symbol, alpaca.EXCHANGE)._raw)
         latest_ret = {}
 
         # Filter the relevant fields
@@ -79,43 +172,43 @@ class BrokerAgent():
 
     """Get the latest traded price of the asset by averaging the best ask and best bid"""
     def ticker_price(self, symbol):
-        quote = self.api.get_latest_crypto_quote(symbol, alpaca.EXCHANGE)._raw
+        quote = self._call('alpaca.latest', self.api.get_latest_crypto_quote, symbol, alpaca.EXCHANGE)._raw
         ticker = (float(quote['ap']) + float(quote['bp']))/2
         return(ticker)
         
     """Place a market buy order for the specified asset and amount"""
     def market_buy_order(self, symbol, amount):
-        res = self.api.submit_order(symbol, amount, 'buy')._raw
+        res = self._call('alpaca.submit', self.api.submit_order, symbol, amount, 'buy')._raw
         return res
 
     """Place a market sell order for the specified asset and amount"""
     def market_sell_order(self, symbol, amount):
-        res = self.api.submit_order(symbol, amount, 'sell')._raw
+        res = self._call('alpaca.submit', self.api.submit_order, symbol, amount, 'sell')._raw
         return res
 
     """Place a limit buy order for the specified asset, amount and price"""
     def limit_buy_order(self, symbol, amount, price):
-        res = self.api.submit_order(symbol, amount, 'buy', 'limit', 'day', price)._raw
+        res = self._call('alpaca.submit', self.api.submit_order, symbol, amount, 'buy', 'limit', 'day', price)._raw
         return res
 
     """Place a limit sell order for the specified asset, amount and price"""
     def limit_sell_order(self, symbol, amount, price):
         # Place limit sell order
-        res = self.api.submit_order(symbol, amount, 'sell', 'limit', 'day', price)._raw
+        res = self._call('alpaca.submit', self.api.submit_order, symbol, amount, 'sell', 'limit', 'day', price)._raw
         return res
 
     """Get all orders from the account at Alpaca depending of status (Default all)"""
     def orders(self, status='all'):
-        res = self.api.list_orders(status)
+        res = self._call('alpaca.orders', self.api.list_orders, status)
         return([] if res is None else res)
 
     """Get details of a single order from Alpaca by clientOrderID"""
     def order_single(self, orderId):
         # Get details for one order
-        res = self.api.get_order_by_client_order_id(orderId)
+        res = self._call('alpaca.orders', self.api.get_order_by_client_order_id, orderId)
         return res._raw
 
     """Cancel an onder posted to the Alpaca paper trading account"""
     def cancel_order(self, orderId):
         # Cancel single order
-        self.api.cancel_order(orderId)
+        self._call('alpaca.cancel', self.api.cancel_order, orderId)
@@ -4,13 +4,17 @@ from utils.io_utils import Type
 
 """
 CEOAgent to evaluate trades and execute by sending to Broker Agent
-Executed trades are also refetched and updated to populate the Account Book
+Accepted orders are booked straight away and, with a fill tracker, their fills are delivered to the Account Book later
+Without a fill tracker executed trades are refetched and updated to populate the Account Book
+Orders that are already filled are applied to the risk tracker here, later fills by the fill tracker
 """
 class CEOAgent():
 
-    def __init__(self, broker_agent, dao_agent):
+    def __init__(self, broker_agent, dao_agent, fill_tracker=None, risk_tracker=None):
         self.broker_agent = broker_agent
         self.dao_agent = dao_agent
+        self.fill_tracker = fill_tracker
+        self.risk_tracker = risk_tracker
         logging.info(f'Created {self.__class__.__name__}')
 
     """
@@ -42,7 +46,7 @@ class CEOAgent():
                 # Update trade with completed order details
                 trade = self._update_book(trade, order)
             else:
-                logging.info(f'Insufficient balance to buy {trade["Quantity"]} {constants.COIN} @ {trade_price}, available balance: {self.broker_agent.get_balance("cash")}')
+                logging.info('Insufficient balance to buy %s %s @ %s, available balance: %s', trade['Quantity'], constants.COIN, trade_price, self.broker_agent.get_balance('cash'))
         elif(trade['Action'] == 'sell'):
             if(trade['Quantity'] <= self.broker_agent.get_balance(constants.SYMBOL) and trade['Quantity'] > 0):
                 if(trade['Type'] == 'market'):
@@ -53,9 +57,9 @@ class CEOAgent():
                 # Update trade with completed order details
                 trade = self._update_book(trade, order)
             else:
-                logging.info(f'Insufficient balance to sell {trade["Quantity"]} {constants.COIN} @ {trade_price}, available balance: {self.broker_agent.get_balance(constants.SYMBOL)}')
+                logging.info('Insufficient balance to sell %s %s @ %s, available balance: %s', trade['Quantity'], constants.COIN, trade_price, self.broker_agent.get_balance(constants.SYMBOL))
         else:
-            logging.info(f'No trade action specified @ {latest_candle["Timestamp"]}')
+            logging.info('No trade action specified @ %s', latest_candle['Timestamp'])
         
         # Update trade balance
         trade['Balance'] = self.broker_agent.get_balance('cash')
@@ -63,18 +67,19 @@ class CEOAgent():
 
     """Update trade object with OHLCV from latest candlestick"""
     def _update_trade_candle(self, trade, candle):
-        for key in candle.keys():
-            trade[key] = candle[key]
-        del trade['Timestamp']
+        trade.set_candle(candle)
         return(trade)
 
     """Update trade object with fields from completed trade"""
     def _populate_trade_order(self, trade, order):
-        u_order = self.broker_agent.order_single(order['client_order_id'])
+        u_order = order if self.fill_tracker is not None else self.broker_agent.order_single(order['client_order_id'])
         trade['Client_order_id'] = u_order['client_order_id']
         trade['Action'] = u_order['side']
         trade['Type'] = u_order['type']
-        trade['Price'] = float(u_order['filled_avg_price'])
+
+        # Keep the decided price until the fill price is known
+        if(u_order.get('filled_avg_price') is not None):
+            trade['Price'] = float(u_order['filled_avg_price'])
         trade['Quantity'] = float(u_order['qty'])
         trade['Status'] = u_order['status']
         trade['Created_at'] = u_order['created_at']
@@ -87,6 +92,12 @@ class CEOAgent():
     def _update_book(self, trade, order):
         trade = self._populate_trade_order(trade, order)
         self.dao_agent.add_data(trade, Type.ACCOUNT_BOOK)
+        if(trade['Status'] == 'filled' and self.risk_tracker is not None and self.risk_tracker.synced):
+            self.risk_tracker.fill(trade['Action'], trade['Quantity'], trade['Price'], order_id=trade['Client_order_id'])
+
+        # Track the fill in the background instead of waiting for it
+        if(self.fill_tracker is not None and trade['Status'] not in self.fill_tracker.final_statuses):
+            self.fill_tracker.register(trade['Client_order_id'], trade['Status'])
         return(trade)
 
     """
@@ -95,8 +106,12 @@ class CEOAgent():
     """
     def _check_stop_loss_take_profit(self, trade, latest_candle):
 
-        # Get cash + asset balance
-        balance = self.broker_agent.get_balance('cash') + (self.broker_agent.get_balance(constants.SYMBOL)*latest_candle[constants.PRICE_COL])
+        # Get cash + asset balance, marked to the latest candle by the risk tracker once it holds the broker balances
+        if(self.risk_tracker is not None and self.risk_tracker.synced):
+            self.risk_tracker.mark(latest_candle[constants.PRICE_COL], latest_candle['Timestamp'])
+            balance = self.risk_tracker.equity()
+        else:
+            balance = self.broker_agent.get_balance('cash') + (self.broker_agent.get_balance(constants.SYMBOL)*latest_candle[constants.PRICE_COL])
         trade['Type'] = 'market'
 
         # Take Profit Criteria
@@ -0,0 +1,47 @@
+from .base_agent import BaseAgent
+import logging
+
+"""
+CheckpointAgent to persist in-flight state on every tick for warm restarts
+Open trades, weights, model version and agent histories are restored when the bot restarts
+"""
+class CheckpointAgent(BaseAgent):
+
+    def __init__(self, checkpoint, dao_agent, agents):
+        super().__init__()
+        self.checkpoint = checkpoint
+        self.dao_agent = dao_agent
+        self.agents = agents
+
+    """Save checkpoint on every tick"""
+    def run(self):
+        while True:
+            self.save()
+            self.clock.wait()
+
+    """
+    Write changed DAO and agent state to the checkpoint
+    Agent states are only collected when the state version of an agent changed since the last write
+    """
+    def save(self):
+        self.lock.acquire()
+        try:
+            self.dao_agent.save_checkpoint(self.checkpoint)
+            token = tuple([(agent.__str__(), agent.state_version) for agent in self.agents])
+            if(not self.checkpoint.is_current('agents', token)):
+                states = dict([(agent.__str__(), agent.get_state()) for agent in self.agents])
+                states = dict([(name, state) for name, state in states.items() if state is not None])
+                self.checkpoint.save_state('agents', states, token=token)
+        except Exception as e:
+            logging.error(f'Checkpoint failed: {e}')
+        self.lock.release()
+
+    """Restore agent state from the last checkpoint"""
+    def restore(self):
+        states = self.checkpoint.load_state('agents')
+        if(states is None):
+            return
+        for agent in self.agents:
+            if(agent.__str__() in states):
+                agent.set_state(states[agent.__str__()])
+        logging.info(f'Restored state for {", ".join(states.keys())} from checkpoint')
@@ -2,6 +2,10 @@ import os
 from config import constants
 from utils import io_utils
 from utils.io_utils import *
+from utils.snapshot_utils import ModelSnapshot
+from utils.storage_utils import CSVStorage
+from utils.trade_utils import TradeRecord
+from threading import Lock, RLock
 import logging
 import numpy as np
 import pandas as pd
@@ -10,45 +14,207 @@ from datetime import datetime
 """
 DAO Agent to manage locally stored files and dataframes through the course of the run of the model
 Tradebook, agent weights and CBR agent are managed.
+Completed trades, weights and model versions are persisted through a storage backend, CSV files by default.
 """
 class DAOAgent():
 
-    def __init__(self):
+    def __init__(self, checkpoint=None, storage=None):
+        self.storage = storage if storage is not None else CSVStorage(constants.DATA_DIR)
+
         # DataFrame consisting of order data
         # Rows order data
         # Column: Client_order_id, Action, Type, Price, Quantity, Status, Created_at, Updated_at, Symbol, Open, High, Low, Close, agent_weights, Balance, PNL
         # Index timestamp
-        self.account_book = None
+        # Version is bumped on every change so checkpoints are only rewritten when needed
+        # Trade records are appended as rows and only turned into a dataframe when the account book is read
+        # Guards the account book between the trading, PnL and background training threads
+        self.lock = RLock()
+        self._account_book = None
+        self.account_book_version = 0
+        self.pending_columns = None
+        self.pending_rows = []
 
-        # DataFrame consisting of the weights of the agents
-        # Rows weights
-        # Column agent name
-        # Index timestamp
-        self.agent_weights = self.load_all_data(Type.AGENT_WEIGHTS).tail(1)
+        # Completed trades taken out of the account book that could not be saved yet, retried on the next save
+        # Emptied rather than dropped once saved, so the checkpoint of them is emptied too
+        self.unsaved_trades = None
+        self.unsaved_version = 0
+
+        # Immutable snapshot of the latest agent weights and Logistic Regression CBR Model
+        # Replaced as a whole on publish, so the decision path reads it without locking
+        self.publish_lock = Lock()
+
+        # Warm restart from checkpoint if it is newer than the saved weights and model
+        checkpoint_state = self._load_checkpoint_state(checkpoint)
+        if(checkpoint_state is not None):
+            self.account_book = checkpoint.load_table('account_book')
+            self.unsaved_trades = checkpoint.load_table('unsaved_trades')
+            self.agent_weights = pd.DataFrame(checkpoint_state['weights'], index=[0])
+            self.snapshot = ModelSnapshot.build(checkpoint_state['version'], checkpoint_state['weights'], checkpoint.load_state('cbr'))
+            self.saved_weights = len(self.agent_weights)
+            self.saved_version = self._last_model_version()
+            logging.info(f'Restored open trades and model version {self.snapshot.version} from checkpoint')
+        else:
+            # DataFrame consisting of the weights of the agents
+            # Rows weights
+            # Column agent name
+            # Index timestamp
+            # A new store starts from the weights of the last simulation
+            self.agent_weights = self.storage.latest_weights()
+            if(self.agent_weights is None):
+                self.agent_weights = CSVStorage(constants.DATA_DIR).latest_weights()
+            self.saved_weights = len(self.agent_weights)
 
-        # Logistic Regression CBR Model
-        self.cbr_model = io_utils.load_pickle(os.path.join(constants.DATA_DIR, 'cbr.pkl'))
+            # Continue the version numbering of the last run, the saved weights and model are its last version
+            self.saved_version = self._last_model_version()
+            cbr_model = io_utils.load_pickle(os.path.join(constants.DATA_DIR, 'cbr.pkl'))
+            self.snapshot = ModelSnapshot.build(self.saved_version if self.saved_version is not None else 1, self.agent_weights.iloc[-1].to_dict(), cbr_model)
         logging.info(f'Created {self.__class__.__name__}')
 
+    """
+    Get the DAO checkpoint state if it can be used for a warm restart
+    The checkpoint is ignored when the weights or CBR model files were written after it, e.g. by a new simulation
+    """
+    def _load_checkpoint_state(self, checkpoint):
+        if(checkpoint is None):
+            return None
+        checkpoint_time = checkpoint.modified_time('dao')
+        if(checkpoint_time is None):
+            return None
+        for path in [os.path.join(constants.DATA_DIR, Type.AGENT_WEIGHTS.value), os.path.join(constants.DATA_DIR, 'cbr.pkl')]:
+            if(os.path.exists(path) and os.path.getmtime(path) > checkpoint_time):
+                return None
+        return checkpoint.load_state('dao')
+
+    """Get the latest recorded model version, None if none was recorded"""
+    def _last_model_version(self):
+        versions = self.model_versions()
+        return int(versions['Version'].max()) if versions is not None and len(versions) > 0 else None
+
+    """
+    Save open trades, trades still to be saved, latest weights and CBR model to the checkpoint
+    Each entry is only rewritten when its version changed
+    The DAO entry is also rewritten after a new cbr.pkl was saved, so it stays newer than the model file it is checked against
+    """
+    def save_checkpoint(self, checkpoint):
+        snapshot = self.snapshot
+        if(self.account_book is not None):
+            checkpoint.save_table('account_book', self.account_book, token=self.account_book_version)
+        if(self.unsaved_trades is not None):
+            checkpoint.save_table('unsaved_trades', self.unsaved_trades, token=self.unsaved_version)
+        checkpoint.save_state('cbr', snapshot.cbr_model, token=snapshot.version)
+        checkpoint.save_state('dao', {'version': snapshot.version, 'weights': snapshot.weights_dict()}, token=(snapshot.version, self.saved_version))
+
+    """
+    Publish new agent weights and/or CBR model as the next snapshot version
+    Components that are not passed are carried over from the current snapshot
+    """
+    def publish_snapshot(self, weights=None, cbr_model=None):
+        with self.publish_lock:
+            self.snapshot = self.snapshot.evolve(weights, cbr_model)
+        return self.snapshot
+
+    """Get the CBR model from the current snapshot"""
+    @property
+    def cbr_model(self):
+        return self.snapshot.cbr_model
+
+    """Publish a new CBR model"""
+    @cbr_model.setter
+    def cbr_model(self, model):
+        self.publish_snapshot(cbr_model=model)
+
+    """Get the account book, including trade records appended since it was last read"""
+    @property
+    def account_book(self):
+        with self.lock:
+            self._flush_pending_rows()
+            return self._account_book
+
+    @account_book.setter
+    def account_book(self, data):
+        with self.lock:
+            self._account_book = data
+
+    """Append buffered trade rows to the account book dataframe in one go"""
+    def _flush_pending_rows(self):
+        if(len(self.pending_rows) == 0):
+            return
+        start = 0 if self._account_book is None else len(self._account_book)
+        df = pd.DataFrame.from_records(self.pending_rows, columns=self.pending_columns, index=pd.RangeIndex(start, start+len(self.pending_rows)))
+        self._account_book = df if self._account_book is None else pd.concat([self._account_book, df], axis=0, copy=False)
+        self.pending_rows = []
+
+    """
+    Update the account book row of an order with fields reported by the broker
+    Returns False if the order is not in the in-memory account book
+    """
+    def update_order(self, client_order_id, fields):
+        with self.lock:
+            account_book = self.account_book
+            if(account_book is None):
+                return False
+            mask = account_book['Client_order_id'] == client_order_id
+            if(not mask.any()):
+                logging.warning(f'Order {client_order_id} not found in account book')
+                return False
+            for key, value in fields.items():
+                account_book.loc[mask, key] = value
+            self.account_book_version += 1
+            return True
+
     """Get tradebook from market simulation run from simulation agent"""
     def get_historic_tradebook(self):
         return io_utils.csv_to_df(os.path.join(constants.DATA_DIR, 'tradebook.csv'))
 
     """Replace the entire dataframe with updated values"""
     def add_full_df(self, data, type):
-        if(type == Type.ACCOUNT_BOOK):
-            self.account_book = data
-        else:
-            self.agent_weights = data
+        with self.lock:
+            if(type == Type.ACCOUNT_BOOK):
+                self.account_book = data
+                self.account_book_version += 1
+            else:
+                self.agent_weights = data
+
+    """
+    Remove completed trades (with PNL) from the in-memory account book and return them
+    Trades that aren't completed (buys without sells) are retained
+    """
+    def take_completed_trades(self):
+        with self.lock:
+            account_book = self.account_book
+            if(account_book is None or 'PNL' not in account_book.columns or not account_book['PNL'].notna().any()):
+                return None
+            self.account_book = account_book[account_book['PNL'].isnull()]
+            self.account_book_version += 1
+            return account_book[account_book['PNL'].notnull()]
+
+    """Put completed trades taken with take_completed_trades back into the account book, e.g. when they could not be used"""
+    def return_completed_trades(self, trades):
+        with self.lock:
+            account_book = self.account_book
+            self.account_book = trades if account_book is None else pd.concat([trades, account_book], axis=0, copy=False)
+            self.account_book_version += 1
 
     """
     Add one row of data to the dataframe
     Initialise new dataframe if doesn't exist, else append to existing dataframe
     """
     def add_data(self, data, type):
+        with self.lock:
+            self._add_data(data, type)
+
+    def _add_data(self, data, type):
         now = datetime.now()
         if(type == Type.ACCOUNT_BOOK):
-            if(self.account_book is None):
+            self.account_book_version += 1
+            if(isinstance(data, TradeRecord)):
+                # Rows are buffered as tuples, records with a different schema start a new batch
+                columns = data.columns()
+                if(columns != self.pending_columns):
+                    self._flush_pending_rows()
+                    self.pending_columns = columns
+                self.pending_rows.append(data.row())
+            elif(self.account_book is None):
                 self.account_book = pd.DataFrame(data, index=[now])
             else:
                 df = pd.DataFrame(data, index=[len(self.account_book)])
@@ -90,49 +256,71 @@ class DAOAgent():
         else:
             return self.agent_weights if self.agent_weights is not None else self.load_all_data(Type.AGENT_WEIGHTS)
 
-    """Save all managed data to CSV files"""
-    def save_all_data(self):
+    """
+    Save all managed data to CSV files
+    Completed trades already taken out with take_completed_trades can be passed in,
+    otherwise they are taken from the in-memory account book
+    """
+    def save_all_data(self, completed_trades=None):
+        with self.lock:
+            self._save_all_data(completed_trades)
 
-        # Save Account book to file if it exists
-        # Only save completed trades
-        if(self.account_book is not None):
-            account_book_path = os.path.join(constants.DATA_DIR, Type.ACCOUNT_BOOK.value)
-            updated_df = None
-            if(os.path.exists(account_book_path)):
-                old_df = csv_to_df(account_book_path)
-                updated_df = pd.concat([old_df, self.account_book[self.account_book['PNL'].notnull()]], axis=0, copy=False)
-            else:
-                updated_df = self.account_book
-            df_to_csv(updated_df, account_book_path)
+    def _save_all_data(self, completed_trades):
+        if(completed_trades is None):
+            completed_trades = self.take_completed_trades()
+
+        # Save completed trades to account book, with the ones a previous save failed on
+        # Trades that can't be saved are kept to be retried rather than put back in the account book, where they would be trained on again
+        if(self.unsaved_trades is not None and len(self.unsaved_trades) > 0):
+            completed_trades = self.unsaved_trades if completed_trades is None else pd.concat([self.unsaved_trades, completed_trades], axis=0, copy=False)
+        if(completed_trades is not None and len(completed_trades) > 0):
+            try:
+                self.storage.save_trades(completed_trades)
+            except Exception:
+                self.unsaved_trades = completed_trades
+                self.unsaved_version += 1
+                raise
+            if(self.unsaved_trades is not None and len(self.unsaved_trades) > 0):
+                self.unsaved_trades = completed_trades.iloc[0:0]
+                self.unsaved_version += 1
             logging.info(f'Saved {Type.ACCOUNT_BOOK}')
-            
-            # Retain trades that aren't completed (buys without sells)
-            self.account_book = self.account_book[self.account_book['PNL'].isnull()]
-
-        # Update agent weights if they exist
-        if(self.agent_weights is not None):
-            agent_weights_path = os.path.join(constants.DATA_DIR, Type.AGENT_WEIGHTS.value)
-            old_df = csv_to_df(agent_weights_path)
-            updated_df = pd.concat([old_df, self.agent_weights], axis=0, copy=False)
-            df_to_csv(updated_df, agent_weights_path)
+
+        # Append agent weights added since the last save
+        if(self.agent_weights is not None and len(self.agent_weights) > self.saved_weights):
+            self.storage.save_weights(self.agent_weights.iloc[self.saved_weights:])
+            self.saved_weights = len(self.agent_weights)
             logging.info(f'Saved {Type.AGENT_WEIGHTS}')
 
-        # Save CBR model to file
-        save_pickle(self.cbr_model, os.path.join(constants.DATA_DIR, 'cbr.pkl'))
-        logging.info(f'Saved CBR Model')
+        # Record the published model version and save its CBR model to file once
+        # An unchanged cbr.pkl keeps its modification time, so it doesn't make the checkpoint look outdated on a warm restart
+        snapshot = self.snapshot
+        if(self.saved_version is None or snapshot.version > self.saved_version):
+            self.storage.save_model_version(snapshot.version, snapshot.weights_dict())
+            save_pickle(snapshot.cbr_model, os.path.join(constants.DATA_DIR, 'cbr.pkl'))
+            self.saved_version = snapshot.version
+            logging.info(f'Saved CBR Model')
 
-    """Load last row of data from CSV file"""
+    """Load last row of data from storage"""
     def load_last_data(self, type):
-        path = os.path.join(constants.DATA_DIR, type.value)
-        if os.path.exists(path):
-            df = csv_to_df(path)
-            return df.iloc[-1]
-        return None
+        if(type == Type.ACCOUNT_BOOK):
+            return self.storage.last_trade()
+        weights = self.storage.latest_weights()
+        return weights.iloc[-1] if weights is not None else None
 
-    """Load all data from CSV file"""
+    """Load all data from storage"""
     def load_all_data(self, type):
-        path = os.path.join(constants.DATA_DIR, type.value)
-        if os.path.exists(path):
-            df = csv_to_df(path)
-            return df
-        return None
\ No newline at end of file
+        if(type == Type.ACCOUNT_BOOK):
+            return self.storage.load_trades()
+        return self.storage.load_weights()
+
+    """Load stored trades that have no PNL yet"""
+    def open_trades(self):
+        return self.storage.open_trades()
+
+    """Load stored trades updated at or after a timestamp"""
+    def trades_since(self, timestamp):
+        return self.storage.trades_since(timestamp)
+
+    """Load the recorded model versions"""
+    def model_versions(self):
+        return self.storage.model_versions()
@@ -1,18 +1,29 @@
 from .base_agent import BaseAgent
 from config import constants
-import time
 from datetime import datetime
+from collections import Counter
+import time
 import logging
-import pandas as pd
-from utils import io_utils
+import numpy as np
+from utils import cbr_utils
+from utils.trade_utils import TradeRecord
 
 """
 Decider Agent to combine results from signal agents to generate trade
 CBR is used to evaluate trade quantity and trade is sent to CEO
+
+Every tick the decider waits for new values from all inputs up to a deadline, half a tick by default so a missed
+deadline still leaves time to decide within the tick, then decides with what it has.
+An input is stale when its latest value is older than stale_ticks of its own agent's tick period.
+Stale signals are kept, decayed (halved every tick period past the limit) or dropped according to stale_policy,
+and stale inputs are recorded with the trade.
 """
 class DeciderAgent(BaseAgent):
 
-    def __init__(self, signal_agents, broker_agent, macroecon_agent, var_agent, dao_agent, ceo_agent):
+    stale_policies = ('keep', 'decay', 'drop')
+
+    def __init__(self, signal_agents, broker_agent, macroecon_agent, var_agent, dao_agent, ceo_agent, compiled_cbr=True, trade_log=None,
+        deadline=None, stale_policy='decay', stale_ticks=2):
         super().__init__()
         self.signal_agents = signal_agents
         self.broker_agent = broker_agent
@@ -21,79 +32,142 @@ class DeciderAgent(BaseAgent):
         self.dao_agent = dao_agent
         self.ceo_agent = ceo_agent
         self.trade = {}
-        self.cbr_columns = ['Action', 'Quantity', 'Price', 'Balance']+sorted([x.__str__() for x in self.signal_agents])+['MACRO_0', 'MACRO_1', 'MACRO_2', 'VaR']
-        
-    """Run on every tick once latest data is available from all signal agents"""
+        self.cbr_columns = cbr_utils.cbr_columns([x.__str__() for x in self.signal_agents])
+
+        # Use the CBR coefficients compiled at publish time instead of the sklearn model
+        self.compiled_cbr = compiled_cbr
+        self.trade_log = trade_log
+
+        # Decision deadline and handling of stale inputs
+        if(stale_policy not in self.stale_policies):
+            raise ValueError(f'Unknown stale signal policy {stale_policy}')
+        self.deadline = deadline if deadline is not None else 0.5*constants.TICK
+        self.stale_policy = stale_policy
+        self.stale_ticks = stale_ticks
+        self.stale_inputs = {}
+        self.stale_counts = Counter()
+        self.deadline_misses = 0
+
+    """Run on every tick once latest data is available from all signal agents, or once the deadline passes"""
     def run(self):
         while True:
 
             # Verify if all signal agents have generated a signal
-            updated_signals = all([agent.updated for agent in (self.signal_agents+[self.macroecon_agent, self.var_agent])])
-            if(updated_signals):
+            deadline = time.monotonic() + self.deadline
+            while(not all([agent.updated for agent in (self.signal_agents+[self.macroecon_agent, self.var_agent])])):
+                if(time.monotonic() >= deadline):
+                    self.deadline_misses += 1
+                    break
+                time.sleep(0.01)
+            try:
                 self.decide()
-                time.sleep(constants.TICK)
-            else:
-                continue
+            except Exception as e:
+                logging.error(f'Decision failed: {e}')
+            self.clock.wait()
+
+    """Find the inputs whose latest value is too old, as {agent name: age in seconds or None if never produced}"""
+    def _stale_inputs(self, now):
+        stale = {}
+        for agent in self.signal_agents+[self.macroecon_agent, self.var_agent]:
+            age = agent.age(now)
+            if(age is None or age > self.stale_ticks*agent.clock.period):
+                stale[agent.__str__()] = age
+        return stale
+
+    """Apply the stale policy to a signal value"""
+    def _stale_value(self, agent, value, age):
+        if(self.stale_policy == 'keep'):
+            return value
+        if(self.stale_policy == 'drop' or age is None):
+            return 0.0
+        return value*0.5**((age - self.stale_ticks*agent.clock.period)/agent.clock.period)
 
     """
     Use signal agents with agent weights to decide trade direction
     Use CBR to decide quantity
     Send order to CEO agent to evaluate
+    Signals collected by a tick driver can be passed in, other agents' latest signals are used otherwise
+    The lock is released when a broker or CEO call fails, so the next tick can decide again
     """
-    def decide(self):
-        self.lock.acquire()
-        self.trade = {}
+    def decide(self, signals=None):
+
+        # Trades are recorded with the macroeconomic values, so nothing can be decided before the first ones arrive
+        if(self.macroecon_agent.data is None):
+            logging.warning('No macroeconomic data yet, skipping decision')
+            return
+        with self.lock:
+            self._decide(signals)
+
+    def _decide(self, signals):
+
+        # Read the published weights and CBR model once so the whole decision uses a single version
+        snapshot = self.dao_agent.snapshot
 
         # Get previous balance before current tick
         prev_balance = self.broker_agent.get_balance('cash')
         
         # Compute Final Trade Direction based on agent signals and agent weights
-        weights = self.dao_agent.get_last_data(io_utils.Type.AGENT_WEIGHTS).to_dict()
-        latest_actions = dict([(agent.__str__(), agent.latest()) for agent in self.signal_agents])
-        action = sum([weights[agent_name] * latest_actions[agent_name] for agent_name in weights.keys()])
-        logging.info(f'Agent Signals: {latest_actions}')
-
-        # Populate signals, macroeconomic data and trade decision to object
-        for agent_action in latest_actions.keys():
-            self.trade[agent_action] = latest_actions[agent_action]
-        for macro_val in self.macroecon_agent.get_data_as_dict().keys():
-            self.trade[macro_val] = self.macroecon_agent.get_data_as_dict()[macro_val]
+        signals = {} if signals is None else signals
+        latest_actions = dict([(agent.__str__(), signals[agent.__str__()] if agent.__str__() in signals else agent.latest()) for agent in self.signal_agents])
+
+        # Record stale inputs and keep, decay or drop stale signals
+        self.stale_inputs = self._stale_inputs(time.monotonic())
+        if(len(self.stale_inputs) > 0):
+            self.stale_counts.update(self.stale_inputs.keys())
+            logging.warning('Stale inputs (age in seconds): %s, policy: %s', self.stale_inputs, self.stale_policy)
+            for agent in self.signal_agents:
+                if(agent.__str__() in self.stale_inputs):
+                    latest_actions[agent.__str__()] = self._stale_value(agent, latest_actions[agent.__str__()], self.stale_inputs[agent.__str__()])
+        action = float(np.dot(snapshot.weights, [latest_actions[agent_name] for agent_name in snapshot.agent_names]))
+        logging.info('Agent Signals: %s', latest_actions)
+
+        # Populate signals, macroeconomic data and trade decision to record
+        self.trade = TradeRecord(latest_actions, self.macroecon_agent.get_data_as_dict())
         self.trade['VaR'] = self.var_agent.get_latest_change()
         self.trade['Action'] = 'buy' if action > constants.TRADE_THRESHOLD else ('sell' if action < -constants.TRADE_THRESHOLD else 'none')
         self.trade['Price'] = self.broker_agent.latest_ohlcv(constants.SYMBOL)[constants.PRICE_COL]
         self.trade['Type'] = 'market'
         self.trade['Quantity'] = constants.QUANTITY
         self.trade['Balance'] = prev_balance + (1 if action > constants.TRADE_THRESHOLD else (-1 if action < -constants.TRADE_THRESHOLD else 0)) * self.trade['Quantity'] * self.trade['Price']
-        self.trade['Quantity'] = self._update_with_cbr(self.trade)
+        self.trade['Quantity'] = self._update_with_cbr(self.trade, snapshot)
+        self.trade['Model_version'] = snapshot.version
 
         str_price = 'market price' if self.trade['Type'] == 'market' else str(self.trade['Price'])
-        logging.info(f'{self.trade["Action"].title()} Trade Decided @ {str_price}')
+        logging.info('%s Trade Decided @ %s', self.trade['Action'].title(), str_price)
 
         # Send trade to CEO agent for evaluation and summarize metrics
         self.trade = self.ceo_agent.make_trade(self.trade)
         self.trade['Total_Balance'] = self.trade['Balance'] + (self.broker_agent.get_balance(constants.SYMBOL) * self.trade[constants.PRICE_COL])
         self.trade['Timestamp'] = datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S")
         self.trade['Crypto'] = self.broker_agent.get_balance(constants.SYMBOL)
-        logging.info(f'{self.trade}')
+
+        # Trade records go to the structured trade log, written off-thread
+        if(self.trade_log is not None):
+            self.trade_log.record(dict(self.trade, Stale_inputs=self.stale_inputs))
+        else:
+            logging.info('%s', dict(self.trade))
 
         # Reset signal agent flags
         for agent in (self.signal_agents+[self.var_agent]):
             agent.updated = False
-        self.updated = True
-        self.lock.release()
+        self.mark_updated()
+
+    """Log deadline misses and stale inputs before stopping"""
+    def stop(self):
+        super().stop()
+        logging.info('%s deadline misses: %s, stale inputs: %s', self.__str__(), self.deadline_misses, dict(self.stale_counts))
         
-    """Update trade quantity with CBR model"""
-    def _update_with_cbr(self, trade):
+    """Update trade quantity with CBR model from the snapshot"""
+    def _update_with_cbr(self, trade, snapshot):
 
         # Decide quantity on buy trades using CBR
+        # Trade price was already set from the latest candle in decide, so no extra broker call is needed
         if(trade['Action'] == 'buy'):
-            cbr_model = self.dao_agent.cbr_model
-            cbr_trade = pd.DataFrame(trade, index=[0])
-            cbr_trade.drop(['Type'], axis=1, inplace=True)
-            cbr_trade.loc[0, 'Price'] = self.broker_agent.latest_ohlcv(constants.SYMBOL)[constants.PRICE_COL]
-            cbr_trade.loc[:, 'Action'] = cbr_trade['Action'].apply(lambda x: 1 if 'buy' else (-1 if 'sell' else 0))
-            cbr_trade = cbr_trade[self.cbr_columns]
-            dir = cbr_model.predict(cbr_trade)[0]
+            features = cbr_utils.feature_vector(trade, snapshot.feature_order)
+            if(self.compiled_cbr and snapshot.compiled_cbr is not None):
+                dir = snapshot.compiled_cbr.predict(features)
+            else:
+                dir = snapshot.cbr_model.predict(features.reshape(1, -1))[0]
             return(1.0-(float(dir)*constants.LEARNING_RATE/2))*constants.QUANTITY
         
         # Liquidate position on sell trades
@@ -0,0 +1,109 @@
+from .base_agent import BaseAgent
+import time
+import logging
+from threading import Condition
+
+"""
+FillTrackerAgent to follow submitted orders until they are filled, cancelled, expired or rejected
+All pending orders are checked with a single order listing, polled with exponential backoff while nothing changes.
+Fills are delivered to the DAO and the risk tracker in the background, so placing an order never waits for its fill.
+"""
+class FillTrackerAgent(BaseAgent):
+
+    final_statuses = {'filled', 'canceled', 'cancelled', 'expired', 'rejected', 'done_for_day'}
+
+    def __init__(self, broker_agent, dao_agent, min_interval=1.0, max_interval=30.0, backoff=2.0, risk_tracker=None):
+        super().__init__()
+        self.broker_agent = broker_agent
+        self.dao_agent = dao_agent
+        self.risk_tracker = risk_tracker
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        # Pending orders by client order id with the last status seen
+        self.condition = Condition(self.lock)
+        self.pending = {}
+        self.interval = min_interval
+        self.next_poll = time.monotonic()
+
+    """Poll whenever orders are pending and the backoff interval has passed"""
+    def run(self):
+        while True:
+            self.condition.acquire()
+            while(len(self.pending) == 0):
+                self.condition.wait()
+            delay = self.next_poll - time.monotonic()
+            if(delay > 0):
+                # Woken early when a new order is registered
+                self.condition.wait(delay)
+                self.condition.release()
+                continue
+            self.condition.release()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f'Polling orders failed: {e}')
+                self._schedule(False)
+
+    """Start tracking a submitted order, polling again soon"""
+    def register(self, client_order_id, status=None):
+        self.condition.acquire()
+        self.pending[client_order_id] = status
+        self.interval = self.min_interval
+        self.next_poll = min(self.next_poll, time.monotonic() + self.min_interval)
+        self.condition.notify()
+        self.condition.release()
+
+    """Number of orders waiting for a fill"""
+    def pending_count(self):
+        return len(self.pending)
+
+    """Check whether an order is followed until its fill"""
+    def is_tracking(self, client_order_id):
+        with self.condition:
+            return client_order_id in self.pending
+
+    """
+    Fetch all orders once and deliver status changes of pending orders to the DAO
+    Orders in a final status are no longer tracked
+    """
+    def poll(self):
+        self.condition.acquire()
+        pending = dict(self.pending)
+        self.condition.release()
+
+        orders = dict([(order._raw['client_order_id'], order._raw) for order in self.broker_agent.orders()])
+        changed = False
+        for client_order_id, last_status in pending.items():
+            order = orders.get(client_order_id)
+            if(order is None or order['status'] == last_status):
+                continue
+            changed = True
+            self.dao_agent.update_order(client_order_id, self._order_fields(order))
+            if(order['status'] == 'filled' and self.risk_tracker is not None and self.risk_tracker.synced):
+                self.risk_tracker.fill(order['side'], float(order['filled_qty']), float(order['filled_avg_price']), order_id=client_order_id)
+            self.condition.acquire()
+            if(order['status'] in self.final_statuses):
+                self.pending.pop(client_order_id, None)
+            else:
+                self.pending[client_order_id] = order['status']
+            self.condition.release()
+            logging.info('Order %s %s', client_order_id, order['status'])
+        self._schedule(changed)
+
+    """Poll again soon after a change, otherwise back off"""
+    def _schedule(self, changed):
+        self.condition.acquire()
+        self.interval = self.min_interval if changed else min(self.interval*self.backoff, self.max_interval)
+        self.next_poll = time.monotonic() + self.interval
+        self.condition.release()
+
+    """Account book fields to update from an order"""
+    def _order_fields(self, order):
+        fields = {'Status': order['status'], 'Updated_at': order['updated_at']}
+        if(order.get('filled_avg_price') is not None):
+            fields['Price'] = float(order['filled_avg_price'])
+        if(order['status'] == 'filled' and order.get('filled_qty') is not None):
+            fields['Quantity'] = float(order['filled_qty'])
+        return fields
@@ -1,19 +1,24 @@
 import os
-import time
 import logging
 from .base_agent import BaseAgent
 from config import constants, fred
-from utils import io_utils
+from utils import io_utils, call_utils
 import pandas as pd
-from fredapi import Fred
 
 """MacroeconomicAgent to get MacroEconomic data from FRED API"""
 class MacroEconAgent(BaseAgent):
+
+    tick_period = constants.CYCLE
     
-    def __init__(self):
+    def __init__(self, caller=None):
         super().__init__()
 
+        # FRED series are retried and served from their last good values while FRED is down
+        self.caller = caller if caller is not None else call_utils.shared_caller()
+        self.caller.endpoint('fred', timeout=10.0)
+
         # Connect to FRED using API credentials from config
+        from fredapi import Fred
         self.fred = Fred(api_key=fred.FRED_API)
 
         # Load PCA model from simulation
@@ -28,26 +33,49 @@ class MacroEconAgent(BaseAgent):
     def run(self):
         while True:
             self.macro_data()
-            time.sleep(constants.CYCLE)
+            self.clock.wait()
 
     """
     Generate macro-economic signals
     Pass through PCA model
+    The previous signals are kept if a series can't be fetched
     """
     def macro_data(self):
         self.lock.acquire()
-        temp_df = pd.DataFrame(index=[0])
-        
-        # Get data from FRED API
-        for key in self.macro_series.keys():
-            df = self.fred.get_series(self.macro_series[key])
-            temp_df.at[0, key] = df.iloc[-1]
-
-        # Transform with PCA
-        self.data = pd.DataFrame(self.pca.transform(temp_df), columns = self.pca_cols, index=[0])
+        try:
+            temp_df = pd.DataFrame(index=[0])
+
+            # Get data from FRED API, noting series served from their last good value while FRED is unavailable
+            fresh = True
+            for key in self.macro_series.keys():
+                df = self.caller.call('fred', self.fred.get_series, self.macro_series[key])
+                fresh = fresh and self.caller.last_call_fresh()
+                temp_df.at[0, key] = df.iloc[-1]
+
+            # Transform with PCA, only new data counts as an update
+            self.data = pd.DataFrame(self.pca.transform(temp_df), columns = self.pca_cols, index=[0])
+            if(fresh):
+                self.mark_updated()
+                logging.info('Macro Data updated')
+            else:
+                logging.warning('Macro Data recomputed from last good FRED values')
+        except Exception as e:
+            logging.error('Macro Data not updated: %s', e)
+        finally:
+            self.lock.release()
+
+    """Keep the latest macro-economic vector across restarts"""
+    def get_state(self):
+        return self.get_data_as_dict() if self.data is not None else None
+
+    """
+    Restore the macro-economic vector and mark it as updated
+    Macro data only changes every cycle, so trading can resume without waiting for FRED.
+    It has no production time until the next fetch, so deciders record it as stale until then
+    """
+    def set_state(self, state):
+        self.data = pd.DataFrame(state, index=[0])
         self.updated = True
-        logging.info('Macro Data updated')
-        self.lock.release()
 
     """ Return latest macro-economic signals as dictionary instead of dataframe row"""
     def get_data_as_dict(self):
@@ -1,93 +1,172 @@
 from agents.base_agent import BaseAgent
-import time
 import os
 from config import constants
+from utils import log_utils
+from utils.ledger_utils import LotLedger
 from utils.io_utils import Type
+from datetime import datetime, timezone
 import logging
 
 """PNLAgent to evaluate PNL post trades and check for risk management"""
 class PNLAgent(BaseAgent):
 
-    def __init__(self, broker_agent, dao_agent, backtesting_agent, stop_function):
+    tick_period = constants.CYCLE
+
+    def __init__(self, broker_agent, dao_agent, backtesting_agent, stop_function, risk_tracker=None, fill_tracker=None):
         super().__init__()
         self.broker_agent = broker_agent
         self.dao_agent = dao_agent
         self.backtesting_agent = backtesting_agent
         self.stop_function = stop_function
 
+        # Orders the fill tracker follows are left to fill instead of being cancelled
+        self.fill_tracker = fill_tracker
+
+        # Equity and risk metrics, fills are usually applied when they are booked and only add their realised PnL here
+        # Balances are only fetched for the risk check without a tracker
+        self.risk_tracker = risk_tracker
+
+        # Open buys matched incrementally against sells, and the orders already applied to the ledger
+        self.ledger = LotLedger('average')
+        self.processed_orders = set()
+
+        # Start of the run, for the realised PnL of the trades saved since
+        self.started_at = datetime.now(timezone.utc)
+
     """
     Calculate PNL and update values after each trade cycle
-    Call backtesting function once complete to update model parameters
+    Request the background backtesting agent to update model parameters once complete,
+    so risk checks keep their cadence however long training takes
     """
     def run(self):
         while True:
-            self.calculate()
-            self.backtesting_agent.calculate()
-            time.sleep(constants.CYCLE)
+            try:
+                self.calculate()
+            except Exception as e:
+                logging.error(f'PNL calculation failed: {e}')
+            self.backtesting_agent.request_retrain()
+            self.clock.wait()
+
+    """Keep open lots and applied orders across restarts"""
+    def get_state(self):
+        return {'ledger': self.ledger.get_state(), 'processed_orders': list(self.processed_orders)}
+
+    def set_state(self, state):
+        self.ledger = LotLedger.from_state(state['ledger'])
+        self.processed_orders = set(state['processed_orders'])
 
     """Save all data to files, stop threads and exit function"""
     def stop_trade(self):
         self.dao_agent.save_all_data()
         self.stop_function()
+
+        # Exiting skips atexit handlers, so write out queued log records first
+        log_utils.stop_logging()
         os._exit(1)
 
     """
     Calculate PNL for trades
     Update trade details and save
     Check stop loss and take profit
+    Broker calls are made without holding the DAO lock, so a failing call can't block trading or checkpoints
     """
     def calculate(self):
-        self.lock.acquire()
-        buy_stack = []
-        pnl = 0.0
+        with self.lock:
+            self._calculate()
 
-        # Get trades from local account book
-        account_book = self.dao_agent.account_book
-        cur_order_ids = account_book['Client_order_id'].to_list() if(account_book is not None) else []
+    def _calculate(self):
 
         # Get Alpaca orders
         orders = sorted(self.broker_agent.orders(), key = lambda order: order._raw['updated_at'])
+        with self.dao_agent.lock:
+            account_book = self.dao_agent.account_book
+            cur_order_ids = set(account_book['Client_order_id']) if(account_book is not None) else set()
 
-        # Iterate through orders and update order details and PNL
+        # Cancel unfilled orders that nobody waits for
+        cancelled = set()
         for order in orders:
             order_raw = order._raw
-            if(order_raw['client_order_id'] in cur_order_ids):
-                logging.info(order_raw['updated_at'])
-
-                # Cancel unfilled orders
-                if(order_raw['status'] == 'accepted'):
+            if(order_raw['client_order_id'] in cur_order_ids and order_raw['status'] == 'accepted'):
+                if(self.fill_tracker is not None and self.fill_tracker.is_tracking(order_raw['client_order_id'])):
+                    continue
+                try:
                     self.broker_agent.cancel_order(order_raw['id'])
-                    account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Status'] = 'cancelled'
-                    account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Updated_at'] = order_raw['updated_at']
-                
-                # Update filled orders
-                elif(order_raw['status'] == 'filled'):
-                    account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Status'] = order_raw['status']
-                    account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Updated_at'] = order_raw['updated_at']
-                    account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Price'] = float(order_raw['filled_avg_price'])
-                    
-                    # Calculate PNL by averaging a set of buy and sell trades
-                    if(order_raw['side'] == 'buy'):
-                        pnl = pnl - float(order_raw['qty'])*float(order_raw['filled_avg_price'])
-                        buy_stack.append(order_raw['client_order_id'])
-                    else:
-                        pnl = pnl + float(order_raw['qty'])*float(order_raw['filled_avg_price'])
-                        for c in buy_stack:
-                            account_book.loc[account_book['Client_order_id']==c, 'PNL'] = pnl
-                        account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'PNL'] = pnl
-                        buy_stack = []
-                        pnl = 0.0
-                logging.info(f'Updated order {order_raw["client_order_id"]}')
-
-        # Update account book
-        self.dao_agent.add_full_df(account_book, Type.ACCOUNT_BOOK)
-
-        # Get cash + asset balance
-        final_balance = self.broker_agent.get_balance('cash') + (self.broker_agent.get_balance(constants.SYMBOL)*self.broker_agent.latest_ohlcv(constants.SYMBOL)[constants.PRICE_COL])
-        
+                    cancelled.add(order_raw['client_order_id'])
+                except Exception as e:
+                    logging.error('Cancelling order %s failed: %s', order_raw['client_order_id'], e)
+
+        # Get trades from local account book, held until the updated book is handed back to the DAO
+        with self.dao_agent.lock:
+            account_book = self.dao_agent.account_book
+            cur_order_ids = set(account_book['Client_order_id']) if(account_book is not None) else set()
+
+            # Iterate through orders and update order details and PNL
+            for order in orders:
+                order_raw = order._raw
+                if(order_raw['client_order_id'] in cur_order_ids):
+                    logging.info('%s', order_raw['updated_at'])
+
+                    # Mark cancelled orders
+                    if(order_raw['client_order_id'] in cancelled):
+                        account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Status'] = 'cancelled'
+                        account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Updated_at'] = order_raw['updated_at']
+
+                    # Update filled orders
+                    elif(order_raw['status'] == 'filled'):
+                        account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Status'] = order_raw['status']
+                        account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Updated_at'] = order_raw['updated_at']
+                        account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'Price'] = float(order_raw['filled_avg_price'])
+
+                        # Calculate PNL by matching each new fill once against the open buys at their average price
+                        if(order_raw['client_order_id'] not in self.processed_orders):
+                            self.processed_orders.add(order_raw['client_order_id'])
+                            self.state_version += 1
+                            if(order_raw['side'] == 'buy'):
+                                pnl = None
+                                self.ledger.buy(float(order_raw['qty']), float(order_raw['filled_avg_price']), order_raw['client_order_id'])
+                            else:
+                                pnl, lots = self.ledger.sell(float(order_raw['qty']), float(order_raw['filled_avg_price']))
+                                for lot, _ in lots:
+                                    account_book.loc[account_book['Client_order_id']==lot.key, 'PNL'] = pnl
+                                account_book.loc[account_book['Client_order_id']==order_raw['client_order_id'], 'PNL'] = pnl
+                            if(self.risk_tracker is not None and self.risk_tracker.synced):
+                                self.risk_tracker.fill(order_raw['side'], float(order_raw['qty']), float(order_raw['filled_avg_price']), pnl, order_raw['client_order_id'])
+                    logging.info('Updated order %s', order_raw['client_order_id'])
+
+            # Only orders the broker still lists can be seen again
+            listed_orders = set([order._raw['client_order_id'] for order in orders])
+            if(not self.processed_orders <= listed_orders):
+                self.processed_orders &= listed_orders
+                self.state_version += 1
+
+            # Update account book
+            if(account_book is not None):
+                self.dao_agent.add_full_df(account_book, Type.ACCOUNT_BOOK)
+
+        # Get cash + asset balance, from the risk tracker marked to the latest bar if there is one
+        latest_candle = self.broker_agent.latest_ohlcv(constants.SYMBOL)
+        if(self.risk_tracker is None):
+            final_balance = self.broker_agent.get_balance('cash') + (self.broker_agent.get_balance(constants.SYMBOL)*latest_candle[constants.PRICE_COL])
+        else:
+            # Fills from before the tracker was created are already in the broker balances
+            if(not self.risk_tracker.synced):
+                self.risk_tracker.sync(self.broker_agent.get_balance('cash'), self.broker_agent.get_balance(constants.SYMBOL))
+            self.risk_tracker.mark(latest_candle[constants.PRICE_COL], latest_candle['Timestamp'])
+            final_balance = self.risk_tracker.equity()
+            logging.info('Risk: %s', self.risk_tracker.report())
+        self._report_saved_trades()
+
         # Check stop loss and take profit and stop trading if conditions meet
         if((final_balance >= self.broker_agent.start_capital*constants.TAKE_PROFIT) or (final_balance <= self.broker_agent.start_capital*constants.STOP_LOSS)):
             logging.info(f'Stop trading at {final_balance}')
             self.stop_trade()
 
-        self.lock.release()
+    """Log the completed trades saved during this run and their realised PnL, queried from storage"""
+    def _report_saved_trades(self):
+        trades = self.dao_agent.trades_since(self.started_at)
+        if(trades is None or len(trades) == 0):
+            return
+
+        # Matched buys carry the PnL of their sell, so only sells are summed
+        sells = trades[trades['Action'] == 'sell']
+        logging.info('Saved %s completed trades this run, realised PNL: %s', len(sells), sells['PNL'].sum())
@@ -1,18 +1,24 @@
 from .base_agent import BaseAgent
-import time
 import requests
 import json
+from utils.trade_utils import json_default
+from utils import call_utils
 from config import powerbi, constants
 import logging
 
 """PowerBI Agent to send trade details to PowerBI"""
 class PowerBIAgent(BaseAgent):
     
-        def __init__(self, decider_agent, broker_agent):
+        def __init__(self, decider_agent, broker_agent, caller=None, timeout=5.0):
             super().__init__()
             self.decider_agent = decider_agent
             self.broker_agent = broker_agent
             self.headers = {"Content-Type": "application/json"}
+
+            # Dashboard updates are dropped rather than retried, the next trade brings them up to date
+            self.timeout = timeout
+            self.caller = caller if caller is not None else call_utils.shared_caller()
+            self.caller.endpoint('powerbi', timeout=timeout, retries=0, fallback=False)
     
         """Run on every tick to send data if latest data is available from decider agent"""
         def run(self):
@@ -21,7 +27,7 @@ class PowerBIAgent(BaseAgent):
                 # Check if decider agent has updated data
                 if(self.decider_agent.updated):
                     self.update()
-                    time.sleep(constants.TICK)
+                    self.clock.wait()
                 else:
                     continue
     
@@ -38,17 +44,22 @@ class PowerBIAgent(BaseAgent):
             trade['Stop_Loss'] = trade['Start_Capital']*constants.STOP_LOSS
             trade['Take_Profit'] = trade['Start_Capital']*constants.TAKE_PROFIT
             self.decider_agent.updated = False
-            json_data = [trade]
+            json_data = [trade.to_dict()]
 
             # Send request to PowerBI Here
-            response = requests.request(
-                method="POST",
-                url=powerbi.URL,
-                headers=self.headers,
-                data=json.dumps(json_data))
+            try:
+                response = self.caller.call('powerbi', requests.request,
+                    method="POST",
+                    url=powerbi.URL,
+                    headers=self.headers,
+                    data=json.dumps(json_data, default=json_default),
+                    timeout=self.timeout)
 
-            # Empty PowerBI response on success
-            # Error displayed if failure
-            logging.info(f'PowerBI Response: {response.text}')
-            logging.info('Updated data to PowerBI')
-            self.lock.release() 
\ No newline at end of file
+                # Empty PowerBI response on success
+                # Error displayed if failure
+                logging.info(f'PowerBI Response: {response.text}')
+                logging.info('Updated data to PowerBI')
+            except Exception as e:
+                logging.error(f'PowerBI update failed: {e}')
+            finally:
+                self.lock.release()
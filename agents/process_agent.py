@@ -0,0 +1,150 @@
+import logging
+import importlib
+import multiprocessing
+from queue import Empty
+from config import constants
+from utils.shm_utils import SharedBarWindow
+from .signal_agents.base_signal_agent import BaseSignalAgent
+
+"""Stand-in for the BrokerAgent inside a worker process, serving bars from the shared window"""
+class WindowBroker():
+
+    def __init__(self, window):
+        self.window = window
+
+    def ohlcv_data(self, symbol, timeframe=None):
+        return self.window.to_frame()
+
+    def last_call_fresh(self):
+        return True
+
+"""
+Entry point of an agent worker process
+Creates the wrapped signal agent and computes one signal per task message until told to stop
+Each result carries the id of its task, so the agent can tell late answers from current ones.
+A task only succeeds if the agent produced a new value, agents log and swallow their own errors
+"""
+def _worker(module_name, class_name, window_name, rows, tasks, results):
+    logging.basicConfig(format='%(asctime)s %(processName)s %(message)s', level=logging.INFO)
+    agent_class = getattr(importlib.import_module(module_name), class_name)
+    window = SharedBarWindow(rows, name=window_name) if window_name is not None else None
+    agent = agent_class(WindowBroker(window)) if window is not None else agent_class()
+    while True:
+        task = tasks.get()
+        if(task is None):
+            break
+        try:
+            state_version = agent.state_version
+            agent.signal()
+            if(agent.state_version != state_version):
+                results.put((task, True, agent.latest()))
+            else:
+                results.put((task, False, 'no new signal'))
+        except Exception as e:
+            results.put((task, False, repr(e)))
+    if(window is not None):
+        window.close()
+
+"""
+ProcessAgent to run a CPU-heavy signal agent in a separate process
+The wrapped agent sees bar windows through shared memory and returns signals over a queue,
+so its computation does not hold the GIL of the trading process
+"""
+class ProcessAgent(BaseSignalAgent):
+
+    def __init__(self, agent_class, broker_agent=None):
+        self.agent_name = agent_class.__name__
+        super().__init__()
+        self.broker_agent = broker_agent
+
+        # Bars are only shared with agents that are driven by the broker
+        self.window = SharedBarWindow(constants.LIMIT+1) if broker_agent is not None else None
+        context = multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+
+        # Id of the last task sent and of the task the worker may still be working on
+        self.task = 0
+        self.outstanding = None
+        self.process = context.Process(name=self.agent_name, daemon=True, target=_worker,
+            args=(agent_class.__module__, self.agent_name, None if self.window is None else self.window.name, constants.LIMIT+1, self.tasks, self.results))
+
+    """ Generate signal on every tick """
+    def run(self):
+        while True:
+            self.signal()
+            self.clock.wait()
+
+    """
+    Publish the latest bars to the worker and collect its signal
+    The window is only rewritten once the worker has answered the previous task, as it reads the bars in place.
+    If an earlier task is still running, this tick is skipped and its late answer is discarded when it arrives.
+    """
+    def signal(self):
+        self.lock.acquire()
+        ok, value, fresh = False, None, True
+        try:
+            if(self.outstanding is not None):
+                try:
+                    self._result(self.outstanding, None)
+                except Empty:
+                    logging.warning(f'{self.agent_name} skipped a tick, task {self.outstanding} is still running')
+                    return
+                logging.warning(f'{self.agent_name} discarded the late result of task {self.outstanding}')
+                self.outstanding = None
+            if(self.window is not None):
+                self.window.write(self.broker_agent.ohlcv_data(constants.SYMBOL, constants.TIMEFRAME))
+                fresh = self.broker_agent.last_call_fresh()
+            self.task += 1
+            self.tasks.put(self.task)
+            self.outstanding = self.task
+            ok, value = self._result(self.task, constants.TICK*10)
+            self.outstanding = None
+            if(ok):
+                self.signals.append(value)
+
+                # Signals from the last good bars while Alpaca is unavailable are not new
+                if(fresh):
+                    self.mark_updated()
+        except Empty:
+            value = 'no response'
+        except Exception as e:
+            value = repr(e)
+        finally:
+            self.lock.release()
+        if(ok):
+            logging.info(f'{self.agent_name} Signal: {value}')
+        else:
+            logging.error(f'{self.agent_name} worker failed: {value}')
+
+    """
+    Wait for the result of a task, discarding results of earlier tasks
+    A timeout of None only takes results already in the queue, raises Empty if the task's result isn't there
+    """
+    def _result(self, task, timeout):
+        while True:
+            result_task, ok, value = self.results.get(timeout=timeout) if timeout is not None else self.results.get_nowait()
+            if(result_task == task):
+                return ok, value
+            logging.warning(f'{self.agent_name} discarded the late result of task {result_task}')
+
+    """Start the worker process before the thread feeding it"""
+    def start(self):
+        self.start_worker()
+        super().start()
+
+    """Start only the worker process, for when signals are requested by a tick driver"""
+    def start_worker(self):
+        self.process.start()
+
+    """Stop the worker process and release the shared window"""
+    def stop(self):
+        super().stop()
+        self.tasks.put(None)
+        self.process.join(timeout=constants.TICK)
+        if(self.window is not None):
+            self.window.close()
+
+    """Use the wrapped agent's name so weights and trade records stay the same"""
+    def __str__(self):
+        return self.agent_name
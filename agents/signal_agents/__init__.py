@@ -1,4 +1 @@
-from os.path import dirname, basename, isfile, join
-import glob
-modules = glob.glob(join(dirname(__file__), "*.py"))
-__all__ = [ basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
\ No newline at end of file
+__all__ = ['base_signal_agent', 'bollinger_agent', 'ma_agent', 'rsi_agent', 'sentiment_agent']
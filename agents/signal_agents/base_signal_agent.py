@@ -1,15 +1,42 @@
 from agents.base_agent import BaseAgent
+from utils.cache_utils import BarMemo
+import logging
 
-""" BaseSignalAgent class to facilitate signal agents"""
+"""
+BaseSignalAgent class to facilitate signal agents
+Signals computed from bars are memoized on the last bar, so ticks shorter than the bar timeframe republish the previous signal
+"""
 class BaseSignalAgent(BaseAgent):
 
     def __init__(self):
         super().__init__()
         self.signals = []
+        self.bar_memo = BarMemo()
 
     def signal(self):
         pass
 
+    """
+    Compute a signal from the latest bars of the broker agent, reusing the previous signal while the newest bar is unchanged
+    bar_memo.fresh is False when the broker could only serve its last good bars
+    """
+    def bar_signal(self, symbol, timeframe, params, compute):
+        return self.bar_memo.get(symbol, timeframe, params, lambda: self.broker_agent.ohlcv_data(symbol, timeframe), compute,
+            self.broker_agent.last_call_fresh)
+
+    """Log how often the signal was reused before stopping"""
+    def stop(self):
+        super().stop()
+        if(self.bar_memo.hits + self.bar_memo.misses > 0):
+            logging.info('%s bar memo: %s', self.__str__(), self.bar_memo.stats())
+
+    """ Keep the recent signal history across restarts """
+    def get_state(self):
+        return {'signals': self.signals[-self.checkpoint_history:]}
+
+    def set_state(self, state):
+        self.signals = list(state['signals'])
+
     """ Return the latest value of the signal agent from the self.signals list """
     def latest(self):
         return self.signals[-1] if(len(self.signals) > 0) else 0
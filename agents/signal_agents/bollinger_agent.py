@@ -1,8 +1,7 @@
-import time
 import logging
-import numpy as np
 from .base_signal_agent import BaseSignalAgent
 from config import constants, signals
+from utils import signal_utils
 
 """ BollingerAgent class inherited from BaseSignalAgent """
 class BollingerAgent(BaseSignalAgent):
@@ -15,7 +14,7 @@ class BollingerAgent(BaseSignalAgent):
     def run(self):
         while True:
             self.signal()
-            time.sleep(constants.TICK)
+            self.clock.wait()
     
     """
     Calculated SMA over 20 time periods.
@@ -27,23 +26,18 @@ class BollingerAgent(BaseSignalAgent):
     """
     def signal(self):
         self.lock.acquire()
-        df = self.broker_agent.ohlcv_data(constants.SYMBOL,constants.TIMEFRAME)
-        df['SMA'] = df[constants.PRICE_COL].rolling(signals.BOLLINGER).mean()
-        df['STD'] = df[constants.PRICE_COL].rolling(signals.BOLLINGER).std()
-        df['LOW_Band'] = df['SMA'] - df['STD'] * 2
-        df['HIGH_Band'] = df['SMA'] + df['STD'] * 2
-        df['Sell_Signal'] = np.where(df[constants.PRICE_COL] >= df['HIGH_Band'], 1, 0)
-        df['Sell_Position'] = df['Sell_Signal'].diff()
-        df['Buy_Signal'] = np.where(df[constants.PRICE_COL] <= df['LOW_Band'], 1, 0)
-        df['Buy_Position'] = df['Buy_Signal'].diff()
-        if df.iloc[-1]['Buy_Position']==1:
-            self.signals.append(1.0)
-        elif df.iloc[-1]['Sell_Position']==1:
-            self.signals.append(-1.0)
-        else:
-            self.signals.append(0.0)
-        self.updated = True
-        logging.info(f'Bollinger Signal: {self.signals[-1]}')
-        self.lock.release()
+        try:
+            bollinger_signal = self.bar_signal(constants.SYMBOL, constants.TIMEFRAME, (signals.BOLLINGER,),
+                lambda df: signal_utils.bollinger_touches(df[constants.PRICE_COL].to_numpy(), signals.BOLLINGER)[-1])
+            self.signals.append(bollinger_signal)
+
+            # Signals from the last good bars while Alpaca is unavailable are not new
+            if(self.bar_memo.fresh):
+                self.mark_updated()
+            logging.info('Bollinger Signal: %s', self.signals[-1])
+        except Exception as e:
+            logging.error('Bollinger Signal not updated: %s', e)
+        finally:
+            self.lock.release()
         
     
\ No newline at end of file
@@ -1,8 +1,7 @@
-import time
 import logging
-import numpy as np
 from .base_signal_agent import BaseSignalAgent
 from config import constants, signals
+from utils import signal_utils
 
 """ MAAgent class inherited from BaseSignalAgent """
 class MAAgent(BaseSignalAgent):
@@ -15,7 +14,7 @@ class MAAgent(BaseSignalAgent):
     def run(self):
         while True:
             self.signal()
-            time.sleep(constants.TICK)
+            self.clock.wait()
     
     """
     Calculated SMA over 50 time periods(long) and EMA over 10 periods(short)
@@ -26,13 +25,16 @@ class MAAgent(BaseSignalAgent):
     """
     def signal(self):
         self.lock.acquire()
-        df = self.broker_agent.ohlcv_data(constants.SYMBOL)
-        df['EMA'] = df[constants.PRICE_COL].ewm(span=signals.EMA, adjust = False).mean()
-        df['SMA'] = df[constants.PRICE_COL].rolling(signals.SMA).mean()
-        df[f'MA_Position'] = np.where(df[f'EMA'] > df[f'SMA'], 1.0, 0.0)
-        df[f'MA_Signal'] = df[f'MA_Position'].diff()
-        df.drop([f'MA_Position'], axis=1, inplace=True)
-        self.signals.append(df.iloc[-1][f'MA_Signal'])
-        self.updated = True
-        logging.info(f'MA Signal: {self.signals[-1]}')
-        self.lock.release() 
\ No newline at end of file
+        try:
+            ma_signal = self.bar_signal(constants.SYMBOL, constants.TIMEFRAME, (signals.EMA, signals.SMA),
+                lambda df: signal_utils.ma_crossover(df[constants.PRICE_COL].to_numpy(), signals.EMA, signals.SMA)[-1])
+            self.signals.append(ma_signal)
+
+            # Signals from the last good bars while Alpaca is unavailable are not new
+            if(self.bar_memo.fresh):
+                self.mark_updated()
+            logging.info('MA Signal: %s', self.signals[-1])
+        except Exception as e:
+            logging.error('MA Signal not updated: %s', e)
+        finally:
+            self.lock.release() 
\ No newline at end of file
@@ -1,8 +1,7 @@
-import time
 import logging
-import numpy as np
 from .base_signal_agent import BaseSignalAgent
 from config import constants, signals
+from utils import signal_utils
 
 """ RSIAgent class inherited from BaseSignalAgent """
 class RSIAgent(BaseSignalAgent):
@@ -15,7 +14,7 @@ class RSIAgent(BaseSignalAgent):
     def run(self):
         while True:
             self.signal()
-            time.sleep(constants.TICK)
+            self.clock.wait()
 
     """
     Calculate RSI over the RSI_AVERAGE timeframe based on the average closes on green time periods and red time periods
@@ -27,28 +26,20 @@ class RSIAgent(BaseSignalAgent):
 
     def signal(self):
         self.lock.acquire()
-        df = self.broker_agent.ohlcv_data(constants.SYMBOL,constants.TIMEFRAME)
+        try:
 
-        #Calculate 14 day RSI value, ranges betweeen 0 to 100
-        df['diff'] = df[constants.PRICE_COL].diff(1)
-        df['gain'] = df['diff'].clip(lower=0).round(2)
-        df['loss'] = df['diff'].clip(upper=0).round(2)
-        df['avg_gain'] = df['gain'].rolling(signals.RSI_AVERAGE).mean()
-        df['avg_loss'] = -df['loss'].rolling(signals.RSI_AVERAGE).mean()
-        df['rs'] = df['avg_gain'] / df['avg_loss']
-        df['rsi'] = 100 - (100/(1.0 + df['rs']))
+            #Calculate 14 day RSI value, ranges betweeen 0 to 100, and its threshold crossings
+            params = (signals.RSI_AVERAGE, signals.RSI_OVERBOUGHT, signals.RSI_OVERSOLD)
+            rsi_signal = self.bar_signal(constants.SYMBOL, constants.TIMEFRAME, params,
+                lambda df: signal_utils.rsi_crossings(df[constants.PRICE_COL].to_numpy(), *params)[-1])
+            self.signals.append(rsi_signal)
 
-        df['RSI_Sell_Signal'] = np.where(df['rsi'] >= signals.RSI_OVERBOUGHT, 1, 0)
-        df['RSI_Buy_Signal'] = np.where(df['rsi'] <= signals.RSI_OVERSOLD, 1, 0)
-        df['RSI_Sell_Position'] = df['RSI_Sell_Signal'].diff()
-        df['RSI_Buy_Position'] = df['RSI_Buy_Signal'].diff()
-        if df.iloc[-1]['RSI_Buy_Position']==1:
-            self.signals.append(1.0)
-        elif df.iloc[-1]['RSI_Sell_Position']==1:
-            self.signals.append(-1.0)
-        else:
-            self.signals.append(0.0)
-        self.updated = True
-        logging.info(f'RSI Signal: {self.signals[-1]}')
-        self.lock.release()
+            # Signals from the last good bars while Alpaca is unavailable are not new
+            if(self.bar_memo.fresh):
+                self.mark_updated()
+            logging.info('RSI Signal: %s', self.signals[-1])
+        except Exception as e:
+            logging.error('RSI Signal not updated: %s', e)
+        finally:
+            self.lock.release()
         
\ No newline at end of file
@@ -1,31 +1,43 @@
 import re
-import time
-import tweepy
-from tweepy import OAuthHandler
-from textblob import TextBlob
 from .base_signal_agent import BaseSignalAgent
 from config import twitter, constants
 from datetime import datetime, timedelta, timezone
+from utils.cache_utils import TTLCache
+from utils import call_utils
 import logging
 
 import numpy as np
-from skfuzzy import control as ctrl, trimf as trimf
 
-""" SentimentAgent class inherited from BaseSignalAgent """
+"""
+SentimentAgent class inherited from BaseSignalAgent
+Grades are cached by tweet ID and only tweets newer than the last one seen are searched,
+so each tweet is cleaned, analysed and graded once however many ticks it stays in the timeframe
+"""
 class SentimentAgent(BaseSignalAgent):
     
-    def __init__(self):
+    def __init__(self, cache_size=10000, caller=None):
         super().__init__()
         self.signals = []
         self.api = None
+
+        # Searches are not retried within a tick, new tweets are picked up by the next search
+        self.caller = caller if caller is not None else call_utils.shared_caller()
+        self.caller.endpoint('twitter', timeout=10.0, retries=0, fallback=False)
+
+        # Tweet ID -> (created at, grade), kept a little longer than the timeframe the signal looks back over
+        self.grades = TTLCache(cache_size, 2*constants.TIMEFRAME*60)
+        self.since_id = None
+        self._sentiment_simulation = None
         # Attempt authentication
         try:
+            import tweepy
+            from tweepy import OAuthHandler
             # Create OAuthHandler object
             self.auth = OAuthHandler(twitter.CONSUMER_KEY, twitter.CONSUMER_SECRET)
             # Set access token and secret
             self.auth.set_access_token(twitter.ACCESS_TOKEN, twitter.ACCESS_TOKEN_SECRET)
             # Create tweepy API object to fetch tweets
-            self.api = tweepy.API(self.auth)
+            self.api = tweepy.API(self.auth, timeout=10)
         except:
             logging.error("Error: Authentication Failed")
 
@@ -33,62 +45,61 @@ class SentimentAgent(BaseSignalAgent):
     def run(self):
         while True:
             self.signal()
-            time.sleep(constants.TICK)
+            self.clock.wait()
 
     """
     Colelct tweets and return the average sentiment as a signal
+    The signal is only marked as updated when the search succeeded, one from cached grades alone is not new
     """
     def signal(self):
         self.lock.acquire()
         query = 'Bitcoin'
         hoursAgo = secondsAgo = 0
-        tweets = self._get_tweets(query, twitter.NUM_TWEETS, hoursAgo, constants.TIMEFRAME, secondsAgo)
+        tweets, searched = self._get_tweets(query, twitter.NUM_TWEETS, hoursAgo, constants.TIMEFRAME, secondsAgo)
         if (len(tweets) >  0):
             sentiment = sum([t['sentiment'] for t in tweets])/len(tweets)
             self.signals.append((1.0 if sentiment > 50.0 else -1.0))
         else:
             self.signals.append(0.0)
-        self.updated = True
-        logging.info(f'Sentiment Signal: {self.signals[-1]}')
+        if(searched):
+            self.mark_updated()
+        logging.info('Sentiment Signal: %s', self.signals[-1])
         self.lock.release()
 
-    """Getting the tweets required for the specified timeframe"""
+    """Getting the tweets required for the specified timeframe, and whether the search succeeded"""
     def _get_tweets(self, query, count, hoursAgo, minutesAgo, secondsAgo):
 
+        import tweepy
+
         # Empty list to store parsed tweets
         tweets = []
+        searched = False
         earliest_time = datetime.now(timezone.utc) - timedelta(hours = hoursAgo, minutes = minutesAgo, seconds = secondsAgo)
         try:
-            # Call twitter api to fetch tweets
-            fetched_tweets = tweepy.Cursor(self.api.search_tweets,q = query, lang = "en").items(count)
+            # Call twitter api to fetch only tweets newer than the last one seen
+            cursor = tweepy.Cursor(self.api.search_tweets,q = query, lang = "en", since_id = self.since_id)
+            fetched_tweets = self.caller.call('twitter', lambda: list(cursor.items(count)))
   
-            # Parsing tweets one by one
+            # Grade tweets that are not cached yet
             for tweet in fetched_tweets:
-                # Getting the appropiate timeframe for tweets
-                
-                createdAt = tweet.created_at
-
-                # Only accept tweets that are tweeted after the timeframe
-                if(earliest_time < createdAt):
+                self.since_id = tweet.id if self.since_id is None else max(self.since_id, tweet.id)
+                if(tweet.id not in self.grades):
+                    self.grades.put(tweet.id, (tweet.created_at, self._get_tweet_sentiment(tweet.text)))
+            searched = True
 
-                    # Empty dictionary to store required params of a tweet
-                    parsed_tweet = {}
-                    # Saving text of tweet
-                    parsed_tweet['text'] = tweet.text
-                    # Saving sentiment of tweet
-                    parsed_tweet['sentiment'] = self._get_tweet_sentiment(tweet.text)
-
-                    tweets.append(parsed_tweet)
-  
-            # Return parsed tweets
-            return tweets
-  
-        # Log error if encountered
-        except tweepy.errors.TweepyException as e:
+        # Log error if encountered, cached grades are still used
+        except (tweepy.errors.TweepyException, TimeoutError, call_utils.CircuitOpenError) as e:
             logging.error("Error : " + str(e))
 
+        # Only accept tweets that are tweeted after the timeframe
+        for createdAt, grade in self.grades.values():
+            if(earliest_time < createdAt):
+                tweets.append({'sentiment': grade})
+        return tweets, searched
+
     """Getting the tweet's polarity and subjectivity with TextBlob"""
     def _get_tweet_sentiment(self, tweet):
+        from textblob import TextBlob
 
         # Create TextBlob object of passed tweet text
         analysis = TextBlob(self._clean_up_tweet(tweet))
@@ -121,6 +132,22 @@ class SentimentAgent(BaseSignalAgent):
         curPolarity = tweetData[0]
         curSubjectivity = tweetData[1]
 
+        sentiment = self._sentiment_system()
+        sentiment.input['polarity'] = curPolarity
+        sentiment.input['subjectivity'] = curSubjectivity
+
+        # Crunch the numbers
+        sentiment.compute()
+        sentimentStrength = sentiment.output['strength']
+
+        return sentimentStrength
+
+    """Build the fuzzy control system once and reuse its simulation for every tweet"""
+    def _sentiment_system(self):
+        if(self._sentiment_simulation is not None):
+            return self._sentiment_simulation
+        from skfuzzy import control as ctrl, trimf as trimf
+
         polarity = ctrl.Antecedent(np.arange(-1.0, 1.0, 0.1), 'polarity')
         subjectivity = ctrl.Antecedent(np.arange(0.0, 1.0, 0.1), 'subjectivity')
         strength = ctrl.Consequent(np.arange(0, 101, 1), 'strength')
@@ -146,13 +173,5 @@ class SentimentAgent(BaseSignalAgent):
 
         # Assign the rules
         sentiment_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5])
-        sentiment = ctrl.ControlSystemSimulation(sentiment_ctrl)
-
-        sentiment.input['polarity'] = curPolarity
-        sentiment.input['subjectivity'] = curSubjectivity
-
-        # Crunch the numbers
-        sentiment.compute()
-        sentimentStrength = sentiment.output['strength']
-
-        return sentimentStrength
\ No newline at end of file
+        self._sentiment_simulation = ctrl.ControlSystemSimulation(sentiment_ctrl)
+        return self._sentiment_simulation
\ No newline at end of file
@@ -1,177 +1,344 @@
 import os
-import math
+import logging
 import numpy as np
 import pandas as pd
-from config import constants
-from utils import io_utils
-from sklearn.linear_model import LogisticRegression
+from config import constants, signals
+from utils import io_utils, signal_utils, cbr_utils, cache_utils, ledger_utils, risk_utils
+from utils.ledger_utils import LotLedger
+from utils.risk_utils import RiskTracker
 
 """
 Simulate Agent to run historic backtesting using model
 Agent weights and CBR model are generated
 Tradebook is saved
+
+The history is either loaded fully into memory or, when a chunksize is given, streamed in chunks.
+Portfolio, open trades, agent weights and CBR training data are carried across chunks
+and completed tradebook rows are written to disk as they are produced.
+The CBR model is refitted on every completed trade so far, so its training cases stay in memory even when streaming,
+as one packed row of floats per closed trade (about 120 bytes, 120 MB per million closed trades).
+History can also be read from the local bar store instead of the historical CSV, one day partition per chunk when streaming.
 """
 class SimulateAgent():
 
-    def __init__(self, alpha=0.05):
+    # Files written to the data directory by a simulation run
+    output_files = ['tradebook.csv', 'agent_weights.csv', 'cbr.pkl']
+
+    def __init__(self, alpha=0.05, regenerate_signals=False, chunksize=None, use_cache=True, bar_store=None, bar_series=None):
 
         # Define agent names
         self.signal_agent_names = ['SentimentAgent', 'MAAgent', 'BollingerAgent', 'RSIAgent']
         self.macro_var = ['MACRO_0','MACRO_1','MACRO_2', 'VaR']
+        self.tradebook_columns = ['Action', 'Quantity', 'Price', 'Balance', 'PNL']+sorted(self.signal_agent_names)+self.macro_var
+        self.cbr_columns = cbr_utils.cbr_columns(self.signal_agent_names)
+        self.chunksize = chunksize
+        self.use_cache = use_cache
+
+        # Stored bars carry no technical signals, so they are always generated from prices
+        self.bar_store = bar_store
+        self.bar_series = bar_series
+        self.regenerate_signals = regenerate_signals or bar_store is not None
+
+        # State carried between chunks: last VaR level and recent prices for indicator warm-up
+        self.last_var = None
+        self.price_tail = np.empty(0)
+        self.last_close = None
+        self.var_tail = np.empty(0)
+
+        # Load Historical Data, streamed chunk by chunk in simulate if a chunksize is given
+        self.data = None
+        if(self.chunksize is None):
+            self.data = self._prepare(self._read_history())
 
-        # Load Historical Data
-        self.data = pd.read_csv(os.path.join(constants.DATA_DIR, 'IS5006_Historical.csv'), index_col='datetime', parse_dates=[0], dayfirst=True)
-        self.data['VaR'] = self.data['VaR'].pct_change()
-        self.data['VaR'].fillna(0.0, inplace=True)
-        
         # Initialise weights, CBR and equity portfolio
         self.agent_weights = [1.0/len(self.signal_agent_names)]*len(self.signal_agent_names)
-        self.cbr = LogisticRegression(solver='liblinear')
+        self._cbr = None
         self.crypto = 0.0
         self.quantity = constants.QUANTITY
         self.capital = constants.START_CAPITAL
         self.alpha = alpha # Learning rate
-        self.pnl = []
-        self.tradebook = pd.DataFrame(columns=['Action', 'Quantity', 'Price', 'Balance', 'PNL']+sorted(self.signal_agent_names)+self.macro_var)
+
+        # Equity, drawdown and risk ratios updated on every fill and bar
+        self.risk = RiskTracker(self.capital)
+
+        # Tradebook rows, buys stay in the lot ledger until a sell closes them
+        # Completed trades are kept as CBR features and labels, in CBR column order
+        self.ledger = LotLedger('average')
+        self.tradebook_rows = []
+        self.num_trades = 0
+        self.cbr_cases = cbr_utils.TrainingSet(len(self.cbr_columns))
+        self.cbr_labels = set()
+        self.tradebook_writer = None
+        self.tradebook_schema = None
+
+    """CBR model, created on first use so sklearn is only imported when the simulation needs it"""
+    @property
+    def cbr(self):
+        if(self._cbr is None):
+            from sklearn.linear_model import LogisticRegression
+            self._cbr = LogisticRegression(solver='liblinear')
+        return self._cbr
+
+    """
+    Tradebook of simulated trades, with the open buys
+    When streaming, completed trades are read back from the tradebook file, which is complete once simulate has finished
+    """
+    @property
+    def tradebook(self):
+        open_rows = [lot.data['row'] for lot in self.ledger.lots]
+        path = os.path.join(constants.DATA_DIR, 'tradebook.csv')
+        if(self.chunksize is None or not os.path.exists(path)):
+            return pd.DataFrame(self.tradebook_rows + open_rows, columns=self.tradebook_columns)
+        written = io_utils.csv_to_df(path)
+        return pd.concat([written, pd.DataFrame(open_rows, columns=self.tradebook_columns)], axis=0, ignore_index=True) if len(open_rows) > 0 else written
+
+    """
+    Read the historical CSV, as an iterator of chunks when streaming
+    With the cache enabled the parsed history is memory-mapped from a binary sidecar file
+    """
+    def _read_history(self):
+        if(self.bar_store is not None):
+            if(self.chunksize is None):
+                return self._bar_history(self.bar_store.read(self.bar_series))
+            return (self._bar_history(day) for day in self.bar_store.iter_days(self.bar_series))
+        path = os.path.join(constants.DATA_DIR, 'IS5006_Historical.csv')
+        read_kwargs = {'index_col': 'datetime', 'parse_dates': [0], 'dayfirst': True}
+        if(not self.use_cache):
+            return pd.read_csv(path, chunksize=self.chunksize, **read_kwargs)
+        if(self.chunksize is None):
+            return io_utils.read_cached_csv(path, **read_kwargs)
+        return io_utils.iter_cached_csv(path, self.chunksize, **read_kwargs)
+
+    """
+    Build simulation history from stored bars
+    Sentiment and macroeconomic values are not stored with bars and are left neutral,
+    VaR is computed over a rolling window of LIMIT bars as the live VaR agent does
+    """
+    def _bar_history(self, bars):
+        data = bars.copy()
+        close = pd.Series(np.concatenate([self.var_tail, data['Close'].to_numpy(dtype=np.float64)]))
+        returns = close.pct_change()
+        rolling = returns.rolling(constants.LIMIT, min_periods=2)
+        var = close*(rolling.mean() - rolling.quantile(signals.VAR_ALPHA, interpolation='lower'))
+        data['VaR'] = var.to_numpy()[len(self.var_tail):]
+        self.var_tail = close.to_numpy()[-constants.LIMIT:]
+        for col in ['SentimentAgent'] + self.macro_var[:-1]:
+            data[col] = 0.0
+        return data
+
+    """Iterate over the prepared history, one chunk at a time"""
+    def _chunks(self):
+        if(self.data is not None):
+            yield self.data
+        else:
+            for chunk in self._read_history():
+                yield self._prepare(chunk)
+
+    """
+    Prepare a chunk of history for simulation
+    VaR is converted to percentage change and technical signals are regenerated if requested,
+    continuing from the previous chunk
+    """
+    def _prepare(self, data):
+        var = data['VaR']
+        if(self.last_var is not None):
+            var = pd.concat([pd.Series([self.last_var]), var.reset_index(drop=True)], axis=0).pct_change().iloc[1:]
+            var.index = data.index
+        else:
+            var = var.pct_change()
+        filled = data['VaR'].ffill()
+        if(filled.notna().any()):
+            self.last_var = filled.iloc[-1]
+        data['VaR'] = var.fillna(0.0)
+
+        # Recompute technical signals from prices instead of using the precomputed columns
+        if(self.regenerate_signals):
+            self._add_signals(data)
+        return data
+
+    """
+    Generate technical agent signals for the whole history with the shared signal kernels
+    Uses the same formulas and parameters as the live signal agents
+    """
+    def generate_signals(self):
+        self._add_signals(self.data)
+
+    """Add technical signals to a chunk, warming up the indicators with prices from earlier chunks"""
+    def _add_signals(self, data):
+        close = data['Close'].to_numpy(dtype=np.float64)
+        prices = np.concatenate([self.price_tail, close])
+        technical = signal_utils.technical_signals(prices, signals.EMA, signals.SMA, signals.BOLLINGER,
+            signals.RSI_AVERAGE, signals.RSI_OVERBOUGHT, signals.RSI_OVERSOLD)
+        for agent_name, agent_signals in technical.items():
+            data[agent_name] = np.nan_to_num(agent_signals[len(self.price_tail):])
+
+        # The EMA needs a much longer tail than the rolling windows for its starting value to wear off
+        warmup = max(signals.SMA, signals.BOLLINGER, signals.RSI_AVERAGE+1, 20*signals.EMA)
+        self.price_tail = prices[-warmup:]
+
+    """
+    Inputs that determine the outputs of a simulation, used as the result cache key
+    History is identified by its content, code by the source of the simulation modules and library versions.
+    Chunk size and the CSV cache only change how history is read, not the results, so they are left out.
+    """
+    @staticmethod
+    def result_inputs(alpha=0.05, regenerate_signals=False, bar_store=None, bar_series=None):
+        import sklearn
+        if(bar_store is not None):
+            history = cache_utils.file_digest(bar_store.paths(bar_series))
+        else:
+            history = cache_utils.file_digest([os.path.join(constants.DATA_DIR, 'IS5006_Historical.csv')])
+        modules = [__file__, io_utils.__file__, signal_utils.__file__, cbr_utils.__file__, ledger_utils.__file__, risk_utils.__file__]
+        return {'history': history, 'bars': bar_store is not None, 'alpha': alpha, 'regenerate_signals': regenerate_signals or bar_store is not None,
+            'constants': dict([(name, getattr(constants, name)) for name in ['QUANTITY', 'START_CAPITAL', 'LEARNING_RATE', 'LIMIT']]),
+            'signals': dict([(name, getattr(signals, name)) for name in ['EMA', 'SMA', 'BOLLINGER', 'RSI_AVERAGE', 'RSI_OVERBOUGHT', 'RSI_OVERSOLD', 'VAR_ALPHA']]),
+            'code': cache_utils.file_digest(modules), 'versions': [np.__version__, pd.__version__, sklearn.__version__]}
 
     """
     Run simulation over historic periods
-    Simulate buy/sell action by updating dataframe
+    Simulate buy/sell action for each period
     Train and use CBR and agent weights for each trade
     """
     def simulate(self):
+        if(self.chunksize is not None):
+            self._open_tradebook_writer()
 
-        # Iterate over dataframe rows
-        for index, row in self.data.iterrows():
-            dir = 0
+        for chunk in self._chunks():
+            self._simulate_chunk(chunk)
+
+        risk = self.risk.report()
+        logging.info('Final PnL: %s, Capital: %s, Crypto: %s @ Price %s', risk['realized_pnl'], self.capital, self.crypto, self.last_close)
+        logging.info('Equity: %s, Max Drawdown: %s, Sharpe: %s, Sortino: %s, Mean Exposure: %s', risk['equity'], risk['max_drawdown'], risk['sharpe'], risk['sortino'], risk['mean_exposure'])
+        logging.info('Agent Weights: %s', self.agent_weights)
+        logging.info('# Trades %s', self.num_trades)
+        metrics = dict(risk, capital=self.capital, crypto=self.crypto, last_close=self.last_close,
+            agent_weights=[float(weight) for weight in self.agent_weights], num_trades=self.num_trades)
+
+        # Update final PnL for uncompleted trades (buys with no matching sell)
+        open_rows = [lot.data['row'] for lot in self.ledger.lots]
+        for row in open_rows:
+            row[4] = (self.last_close - row[2])*row[1]
+        self._write_tradebook_rows(open_rows)
+        self.ledger = LotLedger('average')
+        self._save_data()
+        return metrics
+
+    """Simulate trades over one chunk of history using plain arrays instead of row-wise dataframe access"""
+    def _simulate_chunk(self, data):
+        closes = data['Close'].to_numpy(dtype=np.float64)
+        agent_signals = data[self.signal_agent_names].to_numpy(dtype=np.float64)
+        sorted_signals = data[sorted(self.signal_agent_names)].to_numpy(dtype=np.float64)
+        macro_var = data[self.macro_var].to_numpy(dtype=np.float64)
+        if(len(closes) > 0):
+            self.last_close = closes[-1]
+
+        # Iterate over periods
+        for i in range(len(closes)):
+            close = closes[i]
 
             # Generate combined trade signal
-            agent_signals = row[self.signal_agent_names].to_list()
-            agent_signal = np.sum(np.dot(agent_signals, self.agent_weights))
-            
-            prev_rows = self.data[self.data.index < index]
-            temp_capital = self.capital
-            temp_crypto = self.crypto
+            agent_signal = np.sum(np.dot(agent_signals[i], self.agent_weights))
 
             # Simulate trade based on signal
             if(agent_signal > 0):
-                if(self.capital >= self.quantity*row['Close']):
-                    self.data.loc[index, 'Action'] = 'buy'
-                    self.data.loc[index, 'Quantity'] = self.quantity
-                    self.data.loc[index, 'Price'] = row['Close']
-                    temp_capital = self.capital - (self.quantity * row['Close'])
-                    temp_crypto = self.crypto + self.quantity
-                    self.data.loc[index, 'Balance'] = temp_capital
+                if(self.capital >= self.quantity*close):
+                    dir = 0
 
                     # Run CBR if enough trades for learning algorithm
-                    if(len(self.tradebook) > 20):
-                        dir = self._run_cbr(self.data.loc[index])
-
-                    #Reupdate quantity based on CBR
-                    self.data.loc[index, 'Quantity'] = round((1.0-(float(dir)*constants.LEARNING_RATE))*self.quantity, 2)
-                    temp_capital = self.capital - (self.data.loc[index, 'Quantity'] * row['Close'])
-                    temp_crypto = self.crypto + self.data.loc[index, 'Quantity']
-                    self.data.loc[index, 'Balance'] = temp_capital
-
-                    self.capital = temp_capital
-                    self.crypto = temp_crypto
-                    self._update_tradebook(index, self.data.loc[index], prev_rows)
-                else:
-                    pass
+                    if(self.num_trades > 20):
+                        balance = self.capital - (self.quantity * close)
+                        features = ['buy', self.quantity, close, balance] + sorted_signals[i].tolist() + macro_var[i].tolist()
+                        dir = self._run_cbr(dict(zip(self.cbr_columns, features)))
+
+                    # Update quantity based on CBR
+                    quantity = round((1.0-(float(dir)*constants.LEARNING_RATE))*self.quantity, 2)
+                    self.capital = self.capital - (quantity * close)
+                    self.crypto = self.crypto + quantity
+                    row = ['buy', quantity, close, self.capital, np.nan] + sorted_signals[i].tolist() + macro_var[i].tolist()
+                    self.ledger.buy(quantity, close, data={'row': row, 'signals': agent_signals[i]})
+                    self.risk.fill('buy', quantity, close)
+                    self.num_trades += 1
             elif(agent_signal < 0):
                 if(self.crypto > 0):
-                    self.data.loc[index, 'Action'] = 'sell'
-                    self.data.loc[index, 'Quantity'] = self.crypto
-                    self.data.loc[index, 'Price'] = row['Close']
-                    self.capital = self.capital + (self.crypto * row['Close'])
+                    quantity = self.crypto
+                    self.capital = self.capital + (self.crypto * close)
                     self.crypto = 0.0
-                    self.data.loc[index, 'Balance'] = self.capital
-
-                    self._evaluate(self.data.loc[index], prev_rows)
-                    self._update_tradebook(index, self.data.loc[index], prev_rows)
-                else:
-                    pass
-            else:
-                continue
-        print(f'Final PnL: {sum(self.pnl)}, Capital: {self.capital}, Crypto: {self.crypto} @ Price {self.data.iloc[-1]["Close"]}')
-        print(f'Agent Weights: {self.agent_weights}')
-        print(f'# Trades {len(self.tradebook)}')
+                    row = ['sell', quantity, close, self.capital, np.nan] + sorted_signals[i].tolist() + macro_var[i].tolist()
+                    self._evaluate(row, agent_signals[i])
+                    self.num_trades += 1
 
-        # Update final PnL for uncompleted trades (buys with no matching sell)
-        for index, row in self.tradebook.iterrows():
-            if(math.isnan(row['PNL'])):
-                self.tradebook.loc[index:, 'PNL'] = (self.data.iloc[-1]["Close"] - row['Price'])*row['Quantity']
-        self._save_data()
+            # Mark the portfolio to market at the close of every period
+            self.risk.mark(close)
 
     """
-    Evaluate PNL for each trade
-    Update agent weights"""
-    def _evaluate(self, sell_row, prev_rows):
+    Evaluate PNL for the sell against the open buy trades
+    Update agent weights and close the trades in the tradebook
+    """
+    def _evaluate(self, sell_row, sell_signals):
 
-        # Calculate average buy price, buy quantity, sell price, sell quantity
-        buy_rows = prev_rows[prev_rows['Action'] == 'buy'].iloc[-int(round(sell_row['Quantity'])):]
-        buy_quantity = buy_rows['Quantity'].sum()
-        buy_price = (buy_rows['Price']*buy_rows['Quantity']).sum()/buy_quantity
+        # Match the sell against the open buys at their average price
+        buy_quantity = self.ledger.quantity
+        buy_price = self.ledger.average_price()
+        pnl, lots = self.ledger.sell(sell_row[1], sell_row[2])
+        self.risk.fill('sell', sell_row[1], sell_row[2], pnl)
+        logging.info('Capital: %s PnL: %s; selling %s @ %s & buying %s @ %s', self.capital, pnl, sell_row[1], sell_row[2], buy_quantity, buy_price)
 
-        # Calculate and update PNL
-        pnl = (sell_row['Price']*sell_row['Quantity']) - (buy_price*buy_quantity)
-        self.pnl.append(pnl)
-        print(f'Capital: {self.capital} PnL: {pnl}; selling {sell_row["Quantity"]} @ {sell_row["Price"]} & buying {buy_quantity} @ {buy_price}')
-        
         # Update weights depending on whether profit or loss for given trades
+        buy_signals = np.sum([lot.data['signals'] for lot, _ in lots], axis=0)
         if(pnl < 0):
-            sell_signals = sell_row[self.signal_agent_names].to_list()
-            buy_signals = buy_rows[self.signal_agent_names].sum().to_list()
             self.agent_weights = np.add(self.agent_weights, np.subtract(self._scalar_mult(sell_signals), self._scalar_mult(buy_signals)))
         elif(pnl > 0):
-            sell_signals = sell_row[self.signal_agent_names].to_list()
-            buy_signals = buy_rows[self.signal_agent_names].sum().to_list()
             self.agent_weights = np.subtract(self.agent_weights, np.subtract(self._scalar_mult(sell_signals), self._scalar_mult(buy_signals)))
 
+        # Close the buys and the sell with the PnL and keep them as CBR training cases
+        closed = [lot.data['row'] for lot, _ in lots if lot.quantity <= LotLedger.epsilon] + [sell_row]
+        for row in closed:
+            row[4] = pnl
+        label = 1 if pnl > 0 else -1
+        self.cbr_cases.append([cbr_utils.feature_vector(dict(zip(self.tradebook_columns, row)), self.cbr_columns) for row in closed], [label]*len(closed))
+        self.cbr_labels.add(label)
+        self._write_tradebook_rows(closed)
+
     """Function to facilitate scalar multiplication"""
     def _scalar_mult(self, signals):
         return([x*self.alpha for x in signals])
 
-    """Update row in tradebook dataframe with data necessary for CBR"""
-    def _update_tradebook(self, index, row, prev_rows):
+    """Open the tradebook file for incremental writes when streaming"""
+    def _open_tradebook_writer(self):
+        import pyarrow as pa
+        import pyarrow.csv as csv
+        self.tradebook_schema = pa.schema([(col, pa.string() if col == 'Action' else pa.float64()) for col in self.tradebook_columns])
+        self.tradebook_writer = csv.CSVWriter(os.path.join(constants.DATA_DIR, 'tradebook.csv'), self.tradebook_schema)
 
-        # Update data in tradebook along with PnL for closed trades
-        if(row['Action'] == 'buy'):
-            self.tradebook.loc[index] = [row['Action'], row['Quantity'], row['Price'], row['Balance'], np.NaN] + row[self.signal_agent_names].to_list() + row[self.macro_var].to_list()
-        else:
-            buy_rows = prev_rows[prev_rows['Action'] == 'buy'].iloc[-int(round(row['Quantity'])):]
-            buy_quantity = buy_rows['Quantity'].sum()
-            buy_price = (buy_rows['Price']*buy_rows['Quantity']).sum()/buy_quantity
-            pnl = (row['Price']*row['Quantity']) - (buy_price*buy_quantity)
-            for ix in buy_rows.index.to_list():
-                self.tradebook.loc[ix, 'PNL'] = pnl
-
-            # Add columns useful for CBR
-            self.tradebook.loc[index] = [row['Action'], row['Quantity'], row['Price'], row['Balance'], pnl] + row[self.signal_agent_names].to_list() + row[self.macro_var].to_list()
+    """Keep completed tradebook rows in memory, or append them to the tradebook file when streaming"""
+    def _write_tradebook_rows(self, rows):
+        if(self.tradebook_writer is None):
+            self.tradebook_rows.extend(rows)
+        elif(len(rows) > 0):
+            import pyarrow as pa
+            columns = list(zip(*rows))
+            self.tradebook_writer.write_table(pa.table(dict(zip(self.tradebook_columns, columns)), schema=self.tradebook_schema))
 
     """Save weights, tradebook and CBR model to csv"""
     def _save_data(self):
-        io_utils.df_to_csv(self.tradebook, os.path.join(constants.DATA_DIR, 'tradebook.csv'))
+        if(self.tradebook_writer is None):
+            io_utils.df_to_csv(self.tradebook, os.path.join(constants.DATA_DIR, 'tradebook.csv'))
+        else:
+            self.tradebook_writer.close()
+            self.tradebook_writer = None
         io_utils.save_pickle(self.cbr, os.path.join(constants.DATA_DIR, 'cbr.pkl'))
         agent_weights_df = pd.DataFrame(columns=self.signal_agent_names)
         agent_weights_df.loc[0] = self.agent_weights
         io_utils.df_to_csv(agent_weights_df, os.path.join(constants.DATA_DIR, 'agent_weights.csv'))
 
-    """Run CBR model on trades upto current trade to predict direction of PNL"""
-    def _run_cbr(self, row):
+    """Run CBR model on completed trades to predict direction of PNL"""
+    def _run_cbr(self, trade):
 
-        # Get completed trades
-        last_non_nan = self.tradebook['PNL'].last_valid_index()
-        
-        # Form train test split
-        X, y = self.tradebook.loc[:last_non_nan, self.tradebook.columns != 'PNL'].copy(), self.tradebook.loc[:last_non_nan, 'PNL'].copy()
-        X.loc[:, 'Action'] = X['Action'].apply(lambda x: 1 if 'buy' else -1)
-        y = np.where(y > 0, 1, -1)
+        # Both outcomes are needed to fit the model
+        if(len(self.cbr_labels) < 2):
+            return 0
 
         # Fit and Predict
-        self.cbr.fit(X, y)
-        pred_row = pd.DataFrame(row).T
-        pred_row.loc[:, 'Action'] = pred_row['Action'].apply(lambda x: 1 if 'buy' else -1)
-        pred_row.drop(['Open', 'High', 'Low', 'Close', 'Volume'], inplace = True, axis=1)
-        pred_pnl = self.cbr.predict(pred_row)
-        return(pred_pnl[0])
\ No newline at end of file
+        self.cbr.fit(self.cbr_cases.X, self.cbr_cases.y)
+        pred_pnl = self.cbr.predict(cbr_utils.feature_vector(trade, self.cbr_columns).reshape(1, -1))
+        return(pred_pnl[0])
@@ -0,0 +1,76 @@
+from .base_agent import BaseAgent
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import constants
+
+"""
+TickDriverAgent to run signal, VaR and macroeconomic computations on a shared thread pool
+On every tick all computations are submitted at once and collected with a deadline (half a tick by default), then the
+collected signals are handed straight to the Decider Agent. Replaces the per-agent threads and flag polling.
+Macroeconomic data is refreshed once per cycle.
+"""
+class TickDriverAgent(BaseAgent):
+
+    def __init__(self, signal_agents, macroecon_agent, var_agent, decider_agent, max_workers=None, deadline=None):
+        super().__init__()
+        self.signal_agents = signal_agents
+        self.macroecon_agent = macroecon_agent
+        self.var_agent = var_agent
+        self.decider_agent = decider_agent
+        self.deadline = deadline if deadline is not None else 0.5*constants.TICK
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(signal_agents)+2, thread_name_prefix='Tick')
+
+        # Computations still running from an earlier tick are not submitted again
+        self.running = {}
+        self.next_macro = 0.0
+        self.timeouts = dict([(agent.__str__(), 0) for agent in signal_agents+[macroecon_agent, var_agent]])
+        self.last_duration = None
+
+    """Drive one decision per tick"""
+    def run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f'Tick failed: {e}')
+            self.clock.wait()
+
+    """Submit a computation unless the previous one for the agent is still running"""
+    def _submit(self, agent, function):
+        future = self.running.get(agent)
+        if(future is None or future.done()):
+            future = self.executor.submit(function)
+            self.running[agent] = future
+        return future
+
+    """
+    Fan out the computations of the tick, wait for them up to the deadline and decide
+    Signals that miss the deadline are left out, the decider falls back to their previous value
+    """
+    def tick(self):
+        start = time.monotonic()
+        futures = dict([(self._submit(agent, agent.signal), agent) for agent in self.signal_agents])
+        futures[self._submit(self.var_agent, self.var_agent.var)] = self.var_agent
+        if(start >= self.next_macro):
+            futures[self._submit(self.macroecon_agent, self.macroecon_agent.macro_data)] = self.macroecon_agent
+            self.next_macro = start + constants.CYCLE
+
+        done, not_done = wait(futures, timeout=self.deadline)
+        for future in not_done:
+            self.timeouts[futures[future].__str__()] += 1
+            logging.warning('%s missed the tick deadline', futures[future])
+        for future in done:
+            if(future.exception() is not None):
+                logging.error('%s failed: %s', futures[future], future.exception())
+
+        # Hand the signals computed in time straight to the decider
+        signals = dict([(agent.__str__(), agent.latest()) for future, agent in futures.items() if future in done and agent in self.signal_agents and future.exception() is None])
+        self.decider_agent.decide(signals)
+        self.last_duration = time.monotonic() - start
+
+    """Stop the thread pool without waiting for running computations"""
+    def stop(self):
+        super().stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logging.info('%s deadline misses: %s', self.__str__(), self.timeouts)
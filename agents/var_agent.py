@@ -1,8 +1,8 @@
 from agents.base_agent import BaseAgent
-import time
 import logging
 from config import constants, signals
 import numpy as np
+from utils.cache_utils import BarMemo
 
 """VARAgent o calculate Value at Risk (VaR) for trading asset"""
 class VARAgent(BaseAgent):
@@ -15,19 +15,37 @@ class VARAgent(BaseAgent):
         self.alpha = signals.VAR_ALPHA
         self.data = []
 
+        # VaR is recomputed only when a new bar arrives
+        self.bar_memo = BarMemo()
+
 
     """Run on every tick to calculate VaR value"""
     def run(self):
         while True:
             self.var()
-            time.sleep(constants.TICK)
+            self.clock.wait()
 
     """ Calculate non paramteric VaR value using formulae"""
     def var(self):
         self.lock.acquire()
+        try:
+
+            # Get historic OHLCV data and calculate VaR, reusing the last value while the newest bar is unchanged
+            VaR = self.bar_memo.get(constants.SYMBOL, constants.TIMEFRAME, (self.alpha,),
+                lambda: self.broker_agent.ohlcv_data(constants.SYMBOL), self._calculate_var, self.broker_agent.last_call_fresh)
+            self.data.append(VaR)
+
+            # VaR from the last good bars while Alpaca is unavailable is not new
+            if(self.bar_memo.fresh):
+                self.mark_updated()
+            logging.info('VaR Data updated %s', self.data[-1])
+        except Exception as e:
+            logging.error('VaR Data not updated: %s', e)
+        finally:
+            self.lock.release()
 
-        # Get historic OHLCV data
-        df = self.broker_agent.ohlcv_data(constants.SYMBOL)
+    """Calculate VaR from a window of OHLCV bars"""
+    def _calculate_var(self, df):
         price = df[constants.PRICE_COL].iloc[-1]
 
         # Calculate periodic returns
@@ -39,11 +57,20 @@ class VARAgent(BaseAgent):
         mean_return_rate = periodic_ret.mean()
 
         # Calculate VaR
-        VaR = price * (mean_return_rate - xth_smallest_rate)
-        self.data.append(VaR)
-        self.updated = True
-        logging.info(f'VaR Data updated {self.data[-1]}')
-        self.lock.release()
+        return price * (mean_return_rate - xth_smallest_rate)
+
+    """Log how often VaR was reused before stopping"""
+    def stop(self):
+        super().stop()
+        if(self.bar_memo.hits + self.bar_memo.misses > 0):
+            logging.info('%s bar memo: %s', self.__str__(), self.bar_memo.stats())
+
+    """Keep the recent VaR history across restarts so the change is available on the first tick"""
+    def get_state(self):
+        return {'data': self.data[-self.checkpoint_history:]}
+
+    def set_state(self, state):
+        self.data = list(state['data'])
 
     """
     Calculate latest percentage change in VaR
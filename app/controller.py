@@ -1,5 +1,12 @@
 from agents.signal_agents import ma_agent, bollinger_agent, rsi_agent, sentiment_agent
-from agents import broker_agent, decider_agent, dao_agent, backtesting_agent, ceo_agent, macroecon_agent, var_agent, pnl_agent, powerbi_agent
+from agents import broker_agent, decider_agent, dao_agent, backtesting_agent, ceo_agent, macroecon_agent, var_agent, pnl_agent, powerbi_agent, checkpoint_agent, fill_tracker_agent, tick_driver_agent
+from agents.process_agent import ProcessAgent
+from config import constants
+from utils import startup_utils, storage_utils, log_utils, call_utils
+from utils.checkpoint_utils import Checkpoint
+from utils.bar_utils import BarStore
+from utils.risk_utils import RiskTracker
+import os
 import logging
 
 """
@@ -8,47 +15,111 @@ Create all agents
 Start all agents"""
 class Controller():
 
-    def __init__(self):
+    def __init__(self, startup_timer=None, process_agents=(), storage='csv', tick_driver=False):
         self.signal_agents = []
+
+        # Drive signal, VaR and macro computations from one thread pool instead of a thread per agent
+        self.tick_driver = tick_driver
+
+        # Storage backend of the DAO agent, csv or sqlite
+        self.storage = storage
+
+        # Names of signal agents to run in worker processes instead of threads
+        self.process_agents = set(process_agents)
         self.periodic_agents = []
+        self.checkpoint_agent = None
+        self.trade_log = None
+        self.broker = None
+        self.startup_timer = startup_timer if startup_timer is not None else startup_utils.StartupTimer()
 
     """Register all the necessary agents"""
     def register_agents(self):
         logging.info('Registering Agents')
+        timer = self.startup_timer
+
+        # Load third-party libraries for the signal and model agents while the broker connects
+        startup_utils.preload(['sklearn.linear_model', 'tweepy', 'textblob', 'skfuzzy.control', 'fredapi'])
+
+        # Data agents, restored from the last checkpoint if available
+        with timer.phase('data agents'):
+            checkpoint = Checkpoint(os.path.join(constants.DATA_DIR, 'checkpoint'))
+            dao = dao_agent.DAOAgent(checkpoint, storage_utils.create_storage(self.storage, constants.DATA_DIR))
+            broker = broker_agent.BrokerAgent(BarStore(os.path.join(constants.DATA_DIR, 'bars')))
+            self.broker = broker
 
-        # Data agents
-        dao = dao_agent.DAOAgent()
-        broker = broker_agent.BrokerAgent()
+        # Fetch only the bars missing from the local store since the last run
+        with timer.phase('backfill bars'):
+            broker.backfill(constants.SYMBOL)
 
         # Signal agents
-        maAgent = ma_agent.MAAgent(broker)
-        bollingerAgent = bollinger_agent.BollingerAgent(broker)
-        rsiAgent = rsi_agent.RSIAgent(broker)
-        sentimentAgent = sentiment_agent.SentimentAgent()
-        self.signal_agents = [maAgent, bollingerAgent, rsiAgent, sentimentAgent]
+        with timer.phase('signal agents'):
+            maAgent = self._signal_agent(ma_agent.MAAgent, broker)
+            bollingerAgent = self._signal_agent(bollinger_agent.BollingerAgent, broker)
+            rsiAgent = self._signal_agent(rsi_agent.RSIAgent, broker)
+            sentimentAgent = self._signal_agent(sentiment_agent.SentimentAgent)
+            self.signal_agents = [maAgent, bollingerAgent, rsiAgent, sentimentAgent]
 
-        macroecon = macroecon_agent.MacroEconAgent()
-        var = var_agent.VARAgent(broker)
+            macroecon = macroecon_agent.MacroEconAgent()
+            var = var_agent.VARAgent(broker)
 
         # Trade Agents
-        ceo = ceo_agent.CEOAgent(broker, dao)
+        with timer.phase('trade agents'):
+            # Risk tracker starts from the broker balances, so fills are applied to it as soon as they are booked,
+            # marked at the latest close so the first bar's return only reflects its own move
+            risk_tracker = RiskTracker(broker.start_capital, broker.get_balance('cash'), broker.get_balance(constants.SYMBOL),
+                broker.latest_ohlcv(constants.SYMBOL)[constants.PRICE_COL])
+            fill_tracker = fill_tracker_agent.FillTrackerAgent(broker, dao, risk_tracker=risk_tracker)
+            ceo = ceo_agent.CEOAgent(broker, dao, fill_tracker, risk_tracker)
 
-        decider = decider_agent.DeciderAgent(self.signal_agents, broker, macroecon, var, dao, ceo)
-        powerbi = powerbi_agent.PowerBIAgent(decider, broker)
+            self.trade_log = log_utils.TradeLog(os.path.join(constants.DATA_DIR, 'trades.jsonl'))
+            decider = decider_agent.DeciderAgent(self.signal_agents, broker, macroecon, var, dao, ceo, trade_log=self.trade_log)
+            powerbi = powerbi_agent.PowerBIAgent(decider, broker)
 
-        # Cycle agents
-        backtesting = backtesting_agent.BackTestingAgent(self.signal_agents, dao)
-        pnl = pnl_agent.PNLAgent(broker, dao, backtesting, self.stop_agents)
+            # Cycle agents
+            backtesting = backtesting_agent.BackTestingAgent(self.signal_agents, dao)
+            pnl = pnl_agent.PNLAgent(broker, dao, backtesting, self.stop_agents, risk_tracker, fill_tracker)
 
-        self.periodic_agents.extend([macroecon, var, pnl, decider, powerbi])
+        # Restore agent histories and keep checkpointing in-flight state
+        with timer.phase('restore checkpoint'):
+            self.checkpoint_agent = checkpoint_agent.CheckpointAgent(checkpoint, dao, self.signal_agents+[macroecon, var, pnl])
+            self.checkpoint_agent.restore()
+
+        if(self.tick_driver):
+            self.periodic_agents.append(tick_driver_agent.TickDriverAgent(self.signal_agents, macroecon, var, decider))
+        else:
+            self.periodic_agents.extend([macroecon, var, decider])
+        self.periodic_agents.extend([fill_tracker, pnl, backtesting, powerbi, self.checkpoint_agent])
         logging.info('Registered agents')
 
+    """Create a signal agent in this process, or behind a ProcessAgent if it was selected to run in a worker"""
+    def _signal_agent(self, agent_class, broker=None):
+        if(agent_class.__name__ in self.process_agents):
+            logging.info(f'Running {agent_class.__name__} in a worker process')
+            return ProcessAgent(agent_class, broker)
+        return agent_class(broker) if broker is not None else agent_class()
+
     """Function to start all agent threads"""
     def start_agents(self):
-        for agent in self.signal_agents+self.periodic_agents:
+        for agent in self.signal_agents:
+            if(not self.tick_driver):
+                agent.start()
+            elif(isinstance(agent, ProcessAgent)):
+                agent.start_worker()
+        for agent in self.periodic_agents:
             agent.start()
+        self.startup_timer.report()
 
     """Function to stop all agent threads"""
     def stop_agents(self):
         for agent in self.signal_agents+self.periodic_agents:
-            agent.stop()
\ No newline at end of file
+            agent.stop()
+
+        # Persist the final state for the next warm restart
+        if(self.checkpoint_agent is not None):
+            self.checkpoint_agent.save()
+        if(self.trade_log is not None):
+            self.trade_log.close()
+        if(self.broker is not None):
+            logging.info('Alpaca rate limits: %s', self.broker.rate_stats())
+        logging.info('External calls: %s', call_utils.shared_caller().stats())
+        call_utils.shared_caller().shutdown()
\ No newline at end of file
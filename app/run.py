@@ -3,9 +3,9 @@ import time
 from app.controller import Controller
 
 """Run the controller of the MAS until keyboard interrupt"""
-def run():
+def run(startup_timer=None, process_agents=(), storage='csv', tick_driver=False):
     try:
-        controller = Controller()
+        controller = Controller(startup_timer, process_agents, storage, tick_driver)
         controller.register_agents()
         controller.start_agents()
         while True:
@@ -1,12 +1,49 @@
-from agents import simulate_agent
+from utils.startup_utils import StartupTimer, preload
+startup_timer = StartupTimer()
+
+import os
+import sys
+import argparse
 import logging
+with startup_timer.phase('imports'):
+    from agents import simulate_agent
+    from utils.bar_utils import BarStore
+    from utils.cache_utils import ResultCache
+    from config import constants
 
-logging.basicConfig(format='%(asctime)s %(message)s')
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from utils import log_utils
+log_utils.setup_logging()
 
 """Run simulation for historic trade period"""
 if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunksize', type=int, default=None, help='Stream the history in chunks of this many rows')
+    parser.add_argument('--regenerate-signals', action='store_true', help='Recompute technical signals from prices')
+    parser.add_argument('--no-cache', action='store_true', help='Parse the historical CSV instead of using the binary cache')
+    parser.add_argument('--bars', action='store_true', help='Simulate on bars from the local bar store instead of the historical CSV')
+    parser.add_argument('--no-result-cache', action='store_true', help='Always run the simulation instead of reusing the results of an identical run')
+    parser.add_argument('--result-cache-mb', type=int, default=512, help='Size limit of the result cache in megabytes')
+    args = parser.parse_args()
     logging.info(f'Starting app')
-    sim = simulate_agent.SimulateAgent()
-    sim.simulate()
\ No newline at end of file
+
+    # Identical data, constants and code give identical results, so reuse those of an earlier run
+    bar_store = BarStore(os.path.join(constants.DATA_DIR, 'bars')) if args.bars else None
+    bar_series = BarStore.series(constants.SYMBOL, constants.TIMEFRAME)
+    result_cache = None
+    if(not args.no_result_cache):
+        result_cache = ResultCache(os.path.join(constants.DATA_DIR, '.cache', 'results'), args.result_cache_mb*1024*1024)
+        result_key = ResultCache.key(simulate_agent.SimulateAgent.result_inputs(regenerate_signals=args.regenerate_signals, bar_store=bar_store, bar_series=bar_series))
+        metrics = result_cache.restore(result_key, constants.DATA_DIR)
+        if(metrics is not None):
+            logging.info('Reused cached results %s: %s', result_key, metrics)
+            sys.exit(0)
+
+    # Load sklearn for the CBR model while the historical data is parsed
+    preload(['sklearn.linear_model'])
+    with startup_timer.phase('load data'):
+        sim = simulate_agent.SimulateAgent(regenerate_signals=args.regenerate_signals, chunksize=args.chunksize, use_cache=not args.no_cache,
+            bar_store=bar_store, bar_series=bar_series)
+    startup_timer.report()
+    metrics = sim.simulate()
+    if(result_cache is not None):
+        result_cache.put(result_key, [os.path.join(constants.DATA_DIR, name) for name in sim.output_files], metrics)
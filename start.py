@@ -1,11 +1,20 @@
-from app import run
+from utils.startup_utils import StartupTimer
+startup_timer = StartupTimer()
+
+import argparse
 import logging
+with startup_timer.phase('imports'):
+    from app import run
 
-logging.basicConfig(format='%(asctime)s %(message)s')
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from utils import log_utils
+log_utils.setup_logging()
 
 """Start real time algo-trading model"""
 if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--process-agents', default='', help='Comma separated signal agents to run in worker processes, e.g. SentimentAgent')
+    parser.add_argument('--storage', default='csv', choices=['csv', 'sqlite'], help='Storage backend for trades, weights and model versions')
+    parser.add_argument('--tick-driver', action='store_true', help='Compute signals on a shared thread pool driven once per tick')
+    args = parser.parse_args()
     logging.info(f'Starting app')
-    run.run()
\ No newline at end of file
+    run.run(startup_timer, [name for name in args.process_agents.split(',') if name], args.storage, args.tick_driver)
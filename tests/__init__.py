@@ -0,0 +1,30 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import importlib.util
+
+"""
+Test settings used in place of the config package, which holds credentials and is not part of the repository
+The package is written to a temporary directory on the module path, so worker processes spawned by the tests find it too
+"""
+test_config = {
+    'constants': {'DATA_DIR': '', 'SYMBOL': 'BTCUSD', 'COIN': 'BTC', 'TIMEFRAME': 1, 'LIMIT': 100, 'PRICE_COL': 'Close',
+        'QUANTITY': 1, 'START_CAPITAL': 1000.0, 'LEARNING_RATE': 0.05, 'TICK': 1, 'CYCLE': 5, 'TRADE_THRESHOLD': 0.1,
+        'STOP_LOSS': 0.9, 'TAKE_PROFIT': 1.1},
+    'signals': {'EMA': 10, 'SMA': 50, 'BOLLINGER': 20, 'RSI_AVERAGE': 14, 'RSI_OVERBOUGHT': 70, 'RSI_OVERSOLD': 30, 'VAR_ALPHA': 0.05},
+}
+
+def _install_test_config():
+    directory = tempfile.mkdtemp(prefix='test-config-')
+    atexit.register(shutil.rmtree, directory, True)
+    os.makedirs(os.path.join(directory, 'config'))
+    open(os.path.join(directory, 'config', '__init__.py'), 'w').close()
+    for module, values in test_config.items():
+        with open(os.path.join(directory, 'config', f'{module}.py'), 'w') as f:
+            f.writelines(f'{name} = {value!r}\n' for name, value in values.items())
+    sys.path.append(directory)
+
+if(importlib.util.find_spec('config') is None):
+    _install_test_config()
@@ -0,0 +1,35 @@
+import unittest
+import pandas as pd
+
+from utils import datetime_utils
+from utils.cache_utils import BarMemo
+
+class BarMemoTest(unittest.TestCase):
+
+    """Bar window ending on the newest completed bar, converted to local time like the Broker Agent does on every fetch"""
+    def fetch(self):
+        self.fetches += 1
+        end = pd.Timestamp.now(tz='UTC').floor('1min') - pd.Timedelta(minutes=1)
+        index = datetime_utils.convert_gmt_to_local(pd.date_range(end=end, periods=10, freq='1min'))
+        return pd.DataFrame({'Close': range(10)}, index=index)
+
+    def compute(self, df):
+        self.computes += 1
+        return float(df['Close'].iloc[-1])
+
+    def test_same_bar_window_is_not_recomputed(self):
+        self.fetches = self.computes = 0
+        memo = BarMemo()
+        for _ in range(2):
+            self.assertEqual(memo.get('BTCUSD', 1, (), self.fetch, self.compute), 9.0)
+
+        # The second call is served from the memo, without a fetch unless a new minute started in between
+        self.assertEqual((memo.misses, memo.hits, self.computes), (1, 1, 1))
+
+    def test_local_conversion_is_stable(self):
+        t = pd.Timestamp('2026-01-01 12:00', tz='UTC')
+        self.assertEqual(datetime_utils.convert_gmt_to_local(t), datetime_utils.convert_gmt_to_local(t))
+        self.assertEqual(datetime_utils.convert_gmt_to_local(t).second, 0)
+
+if __name__ == '__main__':
+    unittest.main()
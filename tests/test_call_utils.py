@@ -0,0 +1,169 @@
+import unittest
+from threading import Event
+
+from utils.call_utils import ResilientCaller, CircuitOpenError
+from utils.rate_utils import PriorityRateLimiter
+
+"""Manually advanced clock for the circuit reset timeout"""
+class FakeClock():
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+"""Fault injecting stub of an external service: hangs, raises or answers as scripted"""
+class FlakyService():
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self.release = Event()
+
+    def __call__(self, symbol):
+        self.calls += 1
+        action = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if(action == 'hang'):
+            self.release.wait(5)
+            return 'late'
+        if(isinstance(action, Exception)):
+            raise action
+        return f'{action}:{symbol}'
+
+class ResilientCallerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sleeps = []
+        self.caller = ResilientCaller(max_workers=4)
+
+    def tearDown(self):
+        self.caller.shutdown()
+
+    def endpoint(self, **policy):
+        policy = dict(dict(timeout=1.0, retries=0, failure_threshold=2, reset_timeout=30.0,
+            clock=self.clock, sleep=self.sleeps.append), **policy)
+        return self.caller.endpoint('stub', **policy)
+
+    def test_timeout_is_retried(self):
+        endpoint = self.endpoint(timeout=0.05, retries=1)
+        service = FlakyService('hang', 'ok')
+        try:
+            self.assertEqual(self.caller.call('stub', service, 'SPY'), 'ok:SPY')
+        finally:
+            service.release.set()
+        self.assertEqual(service.calls, 2)
+        self.assertEqual(len(self.sleeps), 1)
+        stats = endpoint.stats()
+        self.assertEqual((stats['timeouts'], stats['retries'], stats['state']), (1, 1, 'closed'))
+
+    def test_timeout_raises_after_retries(self):
+        self.endpoint(timeout=0.05, retries=1, failure_threshold=5)
+        service = FlakyService('hang')
+        try:
+            with self.assertRaises(TimeoutError):
+                self.caller.call('stub', service, 'SPY')
+        finally:
+            service.release.set()
+        self.assertEqual(service.calls, 2)
+
+    def test_open_circuit_serves_last_good_value(self):
+        endpoint = self.endpoint()
+        service = FlakyService('ok', ConnectionError('down'))
+        self.assertEqual(self.caller.call('stub', service, 'SPY'), 'ok:SPY')
+        self.assertTrue(self.caller.last_call_fresh())
+        with self.assertRaises(ConnectionError):
+            self.caller.call('stub', service, 'SPY')
+
+        # Second consecutive failure opens the circuit and falls back to the last good value
+        self.assertEqual(self.caller.call('stub', service, 'SPY'), 'ok:SPY')
+        self.assertFalse(self.caller.last_call_fresh())
+        self.assertEqual(endpoint.state, 'open')
+
+        # Open circuit fails fast without calling the service
+        calls = service.calls
+        self.assertEqual(self.caller.call('stub', service, 'SPY'), 'ok:SPY')
+        self.assertEqual(service.calls, calls)
+        self.assertEqual(endpoint.stats()['fallbacks'], 2)
+
+    def test_open_circuit_without_value_raises(self):
+        self.endpoint()
+        service = FlakyService(ConnectionError('down'))
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.caller.call('stub', service, 'SPY')
+        with self.assertRaises(CircuitOpenError):
+            self.caller.call('stub', service, 'QQQ')
+        self.assertEqual(service.calls, 2)
+
+    def test_no_fallback_raises_when_open(self):
+        self.endpoint(fallback=False)
+        service = FlakyService('ok', ConnectionError('down'), ConnectionError('down'))
+        self.caller.call('stub', service, 'SPY')
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.caller.call('stub', service, 'SPY')
+        with self.assertRaises(CircuitOpenError):
+            self.caller.call('stub', service, 'SPY')
+
+    def test_half_open_trial_closes_circuit(self):
+        endpoint = self.endpoint()
+        service = FlakyService(ConnectionError('down'), ConnectionError('down'), 'ok')
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.caller.call('stub', service, 'SPY')
+        self.assertEqual(endpoint.state, 'open')
+
+        # Before the reset timeout calls are refused, after it one trial call goes out
+        self.clock.advance(29.0)
+        with self.assertRaises(CircuitOpenError):
+            self.caller.call('stub', service, 'SPY')
+        self.clock.advance(1.0)
+        self.assertEqual(self.caller.call('stub', service, 'SPY'), 'ok:SPY')
+        self.assertEqual(endpoint.state, 'closed')
+        self.assertEqual(service.calls, 3)
+
+    def test_failed_half_open_trial_reopens_circuit(self):
+        endpoint = self.endpoint(failure_threshold=3)
+        service = FlakyService(ConnectionError('down'))
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                self.caller.call('stub', service, 'SPY')
+        self.clock.advance(30.0)
+
+        # A single failure in half open reopens the circuit for another reset timeout
+        with self.assertRaises(ConnectionError):
+            self.caller.call('stub', service, 'SPY')
+        self.assertEqual(endpoint.state, 'open')
+        self.assertEqual(endpoint.opened_at, 30.0)
+        with self.assertRaises(CircuitOpenError):
+            self.caller.call('stub', service, 'SPY')
+        self.assertEqual(service.calls, 4)
+
+    def test_passthrough_errors_count_as_success(self):
+        endpoint = self.endpoint(retries=2, passthrough=(KeyError,))
+        service = FlakyService(KeyError('unknown symbol'))
+        for _ in range(3):
+            with self.assertRaises(KeyError):
+                self.caller.call('stub', service, 'XYZ')
+        self.assertEqual(service.calls, 3)
+        self.assertEqual((endpoint.state, endpoint.stats()['failures']), ('closed', 0))
+
+    def test_attempt_without_token_is_not_sent(self):
+        endpoint = self.endpoint(timeout=0.05)
+        limiter = PriorityRateLimiter(rate=0.01, burst=1)
+        limiter.acquire()
+        service = FlakyService('ok')
+        with self.assertRaises(TimeoutError):
+            self.caller.call('stub', service, 'SPY', before=lambda timeout: limiter.acquire(0, timeout))
+        self.assertEqual(service.calls, 0)
+        self.assertEqual(limiter.stats()['queue_depth'], 0)
+        self.assertEqual(limiter.stats()['timed_out'], {0: 1})
+        self.assertEqual(endpoint.stats()['timeouts'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
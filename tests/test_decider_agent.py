@@ -0,0 +1,22 @@
+import unittest
+from types import SimpleNamespace
+
+from agents.decider_agent import DeciderAgent
+
+"""Broker stub whose calls time out, like an Alpaca endpoint without a last good value"""
+class TimingOutBroker():
+
+    def get_balance(self, symbol):
+        raise TimeoutError('alpaca.account timed out')
+
+class DeciderAgentTest(unittest.TestCase):
+
+    def test_failed_decision_releases_lock(self):
+        macroecon = SimpleNamespace(data={'MACRO_0': 0.0})
+        decider = DeciderAgent([], TimingOutBroker(), macroecon, None, SimpleNamespace(snapshot=None), None)
+        with self.assertRaises(TimeoutError):
+            decider.decide()
+        self.assertFalse(decider.lock.locked())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from threading import RLock
+import pandas as pd
+
+from config import constants
+from agents.fill_tracker_agent import FillTrackerAgent
+from agents.pnl_agent import PNLAgent
+from utils.risk_utils import RiskTracker
+
+"""Order as returned by the Alpaca API, with its fields in _raw"""
+class MockOrder():
+
+    def __init__(self, client_order_id, status, side='buy', qty='1', price=None):
+        self._raw = {'id': f'id-{client_order_id}', 'client_order_id': client_order_id, 'status': status, 'side': side,
+            'qty': qty, 'filled_qty': qty if status == 'filled' else '0', 'filled_avg_price': price,
+            'updated_at': '2026-01-01T00:00:00Z'}
+
+"""Broker stub serving a scripted order listing and recording cancellations"""
+class MockBroker():
+
+    def __init__(self, orders=()):
+        self.listing = list(orders)
+        self.cancelled = []
+        self.start_capital = 1000.0
+
+    def orders(self, status='all'):
+        return self.listing
+
+    def cancel_order(self, order_id):
+        self.cancelled.append(order_id)
+
+    def latest_ohlcv(self, symbol):
+        return {constants.PRICE_COL: 100.0, 'Timestamp': '2026-01-01T00:00:00Z'}
+
+    def get_balance(self, symbol):
+        return self.start_capital if symbol == 'cash' else 0.0
+
+"""DAO stub holding an account book"""
+class MockDAO():
+
+    def __init__(self, order_ids):
+        self.lock = RLock()
+        self.account_book = pd.DataFrame({'Client_order_id': list(order_ids), 'Status': 'accepted', 'Updated_at': None, 'Price': None, 'PNL': None})
+        self.updates = {}
+
+    def update_order(self, client_order_id, fields):
+        self.updates[client_order_id] = fields
+        return True
+
+    def add_full_df(self, data, type):
+        self.account_book = data
+
+    def trades_since(self, timestamp):
+        return None
+
+class FillTrackerAgentTest(unittest.TestCase):
+
+    def test_poll_delivers_fills(self):
+        broker = MockBroker([MockOrder('a', 'filled', 'buy', '2', '100'), MockOrder('b', 'accepted')])
+        dao = MockDAO(['a', 'b'])
+        risk_tracker = RiskTracker(1000.0, cash=1000.0)
+        tracker = FillTrackerAgent(broker, dao, risk_tracker=risk_tracker)
+        tracker.register('a', 'accepted')
+        tracker.register('b', 'accepted')
+        tracker.poll()
+
+        # The filled order is booked and applied once, the accepted one is still followed
+        self.assertEqual(dao.updates['a']['Status'], 'filled')
+        self.assertEqual((dao.updates['a']['Price'], dao.updates['a']['Quantity']), (100.0, 2.0))
+        self.assertNotIn('b', dao.updates)
+        self.assertFalse(tracker.is_tracking('a'))
+        self.assertTrue(tracker.is_tracking('b'))
+        self.assertEqual((risk_tracker.cash, risk_tracker.position), (800.0, 2.0))
+        self.assertFalse(risk_tracker.fill('buy', 2.0, 100.0, order_id='a'))
+
+class PNLAgentTest(unittest.TestCase):
+
+    def test_tracked_orders_are_not_cancelled(self):
+        broker = MockBroker([MockOrder('tracked', 'accepted'), MockOrder('stale', 'accepted')])
+        dao = MockDAO(['tracked', 'stale'])
+        tracker = FillTrackerAgent(broker, dao)
+        tracker.register('tracked', 'accepted')
+        pnl = PNLAgent(broker, dao, None, lambda: None, fill_tracker=tracker)
+        pnl.calculate()
+
+        self.assertEqual(broker.cancelled, ['id-stale'])
+        statuses = dict(zip(dao.account_book['Client_order_id'], dao.account_book['Status']))
+        self.assertEqual(statuses, {'tracked': 'accepted', 'stale': 'cancelled'})
+
+    def test_untracked_orders_are_cancelled_without_tracker(self):
+        broker = MockBroker([MockOrder('a', 'accepted')])
+        pnl = PNLAgent(broker, MockDAO(['a']), None, lambda: None)
+        pnl.calculate()
+        self.assertEqual(broker.cancelled, ['id-a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import logging
+import unittest
+import numpy as np
+import pandas as pd
+
+from config import constants
+from agents.process_agent import ProcessAgent
+from agents.signal_agents.base_signal_agent import BaseSignalAgent
+
+"""Signal agent run in the worker process, publishing the last close of the bar window like the bar driven agents"""
+class LastCloseAgent(BaseSignalAgent):
+
+    def __init__(self, broker_agent):
+        super().__init__()
+        self.broker_agent = broker_agent
+
+    def run(self):
+        pass
+
+    def signal(self):
+        self.lock.acquire()
+        try:
+            self.signals.append(self.bar_signal(constants.SYMBOL, constants.TIMEFRAME, (), lambda df: float(df['Close'].iloc[-1])))
+            if(self.bar_memo.fresh):
+                self.mark_updated()
+        except Exception as e:
+            logging.error('Last close not updated: %s', e)
+        finally:
+            self.lock.release()
+
+"""Broker stub serving a timezone-aware bar window like the BrokerAgent"""
+class MockBroker():
+
+    def __init__(self):
+        self.bars = 0
+
+    def ohlcv_data(self, symbol, timeframe=None):
+        self.bars += 1
+        rows = constants.LIMIT + 1
+        index = pd.date_range(end=pd.Timestamp('2026-01-01', tz='UTC') + pd.Timedelta(minutes=self.bars), periods=rows, freq='1min', name='Timestamp')
+        close = np.arange(rows, dtype=np.float64) + self.bars
+        return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1.0}, index=index)
+
+    def last_call_fresh(self):
+        return True
+
+class ProcessAgentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = ProcessAgent(LastCloseAgent, MockBroker())
+        self.agent.start_worker()
+
+    def tearDown(self):
+        self.agent.stop()
+
+    def test_every_tick_publishes_a_new_signal(self):
+        self.agent.signal()
+        self.agent.signal()
+
+        # The second window ends on a newer bar, so the worker's bar memo compares timezone-aware timestamps
+        self.assertEqual(self.agent.signals, [float(constants.LIMIT + 1), float(constants.LIMIT + 2)])
+        self.assertEqual(self.agent.state_version, 2)
+
+if __name__ == '__main__':
+    unittest.main()
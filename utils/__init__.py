@@ -1,4 +1 @@
-from os.path import dirname, basename, isfile, join
-import glob
-modules = glob.glob(join(dirname(__file__), "*.py"))
-__all__ = [ basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
\ No newline at end of file
+__all__ = ['bar_utils', 'cache_utils', 'call_utils', 'cbr_utils', 'checkpoint_utils', 'clock_utils', 'datetime_utils', 'io_utils', 'ledger_utils', 'log_utils', 'rate_utils', 'risk_utils', 'shm_utils', 'signal_utils', 'snapshot_utils', 'startup_utils', 'storage_utils', 'trade_utils']
@@ -0,0 +1,162 @@
+import os
+import glob
+import tempfile
+from threading import Lock
+import numpy as np
+import pandas as pd
+
+"""
+Day-partitioned OHLCV bar store
+Bars of each series (symbol and timeframe) are kept in one Arrow IPC file per UTC day under <directory>/<series>/.
+Files are memory-mapped on read, so windows and full histories are served at disk speed.
+Appending rewrites only the partitions of the days it touches, deduplicating bars by timestamp.
+Appends to a series are serialised by a lock per series, and the latest stored timestamp of each series is kept in memory.
+"""
+class BarStore():
+
+    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = Lock()
+        self.series_locks = {}
+        self.last_timestamps = {}
+
+    """Name of the series directory of a symbol and timeframe in minutes"""
+    @staticmethod
+    def series(symbol, timeframe):
+        return f'{symbol.replace("/", "")}_{timeframe}m'
+
+    """Lock guarding appends to a series"""
+    def _series_lock(self, series):
+        with self.lock:
+            if(series not in self.series_locks):
+                self.series_locks[series] = Lock()
+            return self.series_locks[series]
+
+    def _series_dir(self, series):
+        return os.path.join(self.directory, series)
+
+    def _partition_path(self, series, day):
+        return os.path.join(self._series_dir(series), f'{day}.arrow')
+
+    """Stored days of a series in order, as YYYY-MM-DD strings"""
+    def days(self, series):
+        paths = glob.glob(os.path.join(glob.escape(self._series_dir(series)), '*.arrow'))
+        return sorted(os.path.basename(path)[:-len('.arrow')] for path in paths)
+
+    """Partition files of a series in day order"""
+    def paths(self, series):
+        return [self._partition_path(series, day) for day in self.days(series)]
+
+    """Read one day partition as a dataframe indexed by UTC timestamp"""
+    def read_day(self, series, day):
+        import pyarrow.feather as feather
+        path = self._partition_path(series, day)
+        if(not os.path.exists(path)):
+            return None
+        df = feather.read_table(path, memory_map=True).to_pandas()
+        return df.set_index('Timestamp')
+
+    """Write the bars of one day, replacing the partition atomically"""
+    def _write_day(self, series, day, df):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        path = self._partition_path(series, day)
+        table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+        fd, tmp_path = tempfile.mkstemp(dir=self._series_dir(series), prefix=f'.{day}-', suffix='.tmp')
+        os.close(fd)
+        try:
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    """
+    Persist bars indexed by timestamp
+    Naive timestamps are taken as UTC, bars already stored are replaced by the new values
+    """
+    def append(self, series, bars):
+        if(bars is None or len(bars) == 0):
+            return
+        bars = bars[self.columns].astype(np.float64)
+        index = pd.DatetimeIndex(bars.index)
+        bars.index = (index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')).rename('Timestamp')
+        os.makedirs(self._series_dir(series), exist_ok=True)
+        with self._series_lock(series):
+            last = self.last_timestamp(series)
+            for day, day_bars in bars.groupby(bars.index.strftime('%Y-%m-%d')):
+                old = self.read_day(series, day)
+                if(old is not None):
+                    day_bars = pd.concat([old, day_bars], axis=0)
+                day_bars = day_bars[~day_bars.index.duplicated(keep='last')].sort_index()
+                self._write_day(series, day, day_bars)
+            self.last_timestamps[series] = bars.index.max() if last is None else max(last, bars.index.max())
+
+    """Read bars between two timestamps (inclusive), either end can be left open"""
+    def read(self, series, start=None, end=None):
+        start = None if start is None else _utc(start)
+        end = None if end is None else _utc(end)
+        frames = []
+        for day in self.days(series):
+            if((start is not None and day < start.strftime('%Y-%m-%d')) or (end is not None and day > end.strftime('%Y-%m-%d'))):
+                continue
+            frames.append(self.read_day(series, day))
+        if(len(frames) == 0):
+            return pd.DataFrame(columns=self.columns, index=pd.DatetimeIndex([], tz='UTC', name='Timestamp'), dtype=np.float64)
+        df = pd.concat(frames, axis=0) if len(frames) > 1 else frames[0]
+        return df.loc[start:end]
+
+    """Iterate over the stored bars of a series one day at a time"""
+    def iter_days(self, series):
+        for day in self.days(series):
+            yield self.read_day(series, day)
+
+    """Get the last rows bars up to and including a timestamp (latest stored bars if end is None)"""
+    def window(self, series, rows, end=None):
+        end = None if end is None else _utc(end)
+        frames = []
+        count = 0
+        for day in reversed(self.days(series)):
+            if(end is not None and day > end.strftime('%Y-%m-%d')):
+                continue
+            df = self.read_day(series, day)
+            if(end is not None):
+                df = df.loc[:end]
+            frames.append(df)
+            count += len(df)
+            if(count >= rows):
+                break
+        if(len(frames) == 0):
+            return self.read(series).iloc[0:0]
+        return pd.concat(frames[::-1], axis=0).iloc[-rows:]
+
+    """Timestamp of the latest stored bar, None if the series is empty, read from disk once per series"""
+    def last_timestamp(self, series):
+        if(series not in self.last_timestamps):
+            days = self.days(series)
+            self.last_timestamps[series] = None if len(days) == 0 else self.read_day(series, days[-1]).index[-1]
+        return self.last_timestamps[series]
+
+    """
+    Find missing bars between two timestamps for a timeframe in minutes
+    Returns a list of (start, end) ranges of missing bar timestamps
+    """
+    def gaps(self, series, start, end, timeframe):
+        freq = pd.Timedelta(minutes=timeframe)
+        expected = pd.date_range(_utc(start).ceil(freq), _utc(end).floor(freq), freq=freq)
+        missing = expected.difference(self.read(series, start, end).index)
+        if(len(missing) == 0):
+            return []
+
+        # Split missing timestamps into runs of consecutive bars
+        breaks = np.flatnonzero(np.diff(missing.asi8) != freq.value) + 1
+        runs = np.split(np.arange(len(missing)), breaks)
+        return [(missing[run[0]], missing[run[-1]]) for run in runs]
+
+"""Convert a timestamp to UTC, naive timestamps are taken as UTC"""
+def _utc(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+from collections import OrderedDict
+from utils import datetime_utils
+
+"""
+Least recently used cache with a time to live
+Entries expire ttl seconds after they were stored, and the least recently used entry is evicted
+once more than maxsize entries are held. Not thread safe, callers hold their own lock.
+"""
+class TTLCache():
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    """Get a value, default if it is missing or expired"""
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if(entry is None or entry[0] <= self.clock()):
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    """Store a value, evicting the least recently used entries if full"""
+    def put(self, key, value):
+        self.entries[key] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while(len(self.entries) > self.maxsize):
+            self.entries.popitem(last=False)
+
+    """Remove expired entries"""
+    def expire(self):
+        now = self.clock()
+        for key in [key for key, (expires, _) in self.entries.items() if expires <= now]:
+            del self.entries[key]
+
+    """Get the values of all live entries"""
+    def values(self):
+        self.expire()
+        return [value for _, value in self.entries.values()]
+
+"""
+Memo of the last value computed from a bar window, keyed on (symbol, last bar timestamp, parameters)
+The window is not fetched again while the last bar seen is still the newest completed bar,
+and the value is not recomputed when a fetched window ends on the same bar.
+fresh tells whether the last value is based on newly fetched bars, rather than a window the broker served from its last good value.
+"""
+class BarMemo():
+
+    def __init__(self):
+        self.key = None
+        self.value = None
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fresh = True
+
+    """
+    Get the value for the latest bars, fetching the window and computing only when needed
+    is_fresh is asked after a fetch whether the window was new
+    """
+    def get(self, symbol, timeframe, params, fetch, compute, is_fresh=None):
+        key = self.key
+        if(key is not None and key[0] == symbol and key[2] == params and key[1] >= datetime_utils.get_newest_bar_start(timeframe)):
+            self.hits += 1
+            self.fresh = True
+            return self.value
+        df = fetch()
+        self.fetches += 1
+        self.fresh = is_fresh() if is_fresh is not None else True
+        key = (symbol, df.index[-1], params)
+        if(key == self.key):
+            self.hits += 1
+            return self.value
+        self.misses += 1
+        self.value = compute(df)
+        self.key = key
+        return self.value
+
+    """Share of calls served without recomputing"""
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits/calls if calls > 0 else 0.0
+
+    """Hit, miss and fetch counts with the hit rate"""
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'fetches': self.fetches, 'hit_rate': self.hit_rate()}
+
+"""Content hash of files, in the order given"""
+def file_digest(paths):
+    import hashlib
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+"""
+Content-addressed cache of run outputs on disk
+Each entry is a directory named by the hash of everything the run depends on, holding copies of its
+output files and a metrics.json. Entries are written to a temporary directory and renamed into place,
+and the least recently used entries are evicted once the cache holds more than max_bytes.
+"""
+class ResultCache():
+
+    metrics_file = 'metrics.json'
+
+    def __init__(self, directory, max_bytes=512*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    """Key of a run from its inputs, which must be JSON serialisable"""
+    @staticmethod
+    def key(inputs):
+        import hashlib
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    """Get the metrics of a cached run, None if it is not cached"""
+    def get(self, key):
+        path = os.path.join(self._entry_dir(key), self.metrics_file)
+        if(not os.path.exists(path)):
+            return None
+        with open(path) as f:
+            metrics = json.load(f)
+
+        # Mark the entry as recently used for eviction
+        os.utime(path)
+        return metrics
+
+    """Copy the output files of a cached run into a directory and get its metrics, None if it is not cached"""
+    def restore(self, key, directory):
+        metrics = self.get(key)
+        if(metrics is None):
+            return None
+        entry_dir = self._entry_dir(key)
+        for name in os.listdir(entry_dir):
+            if(name != self.metrics_file):
+                shutil.copyfile(os.path.join(entry_dir, name), os.path.join(directory, name))
+        return metrics
+
+    """Store the output files and metrics of a run"""
+    def put(self, key, paths, metrics):
+        entry_dir = self._entry_dir(key)
+        if(os.path.exists(entry_dir)):
+            return
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            for path in paths:
+                shutil.copyfile(path, os.path.join(tmp_dir, os.path.basename(path)))
+            with open(os.path.join(tmp_dir, self.metrics_file), 'w') as f:
+                json.dump(metrics, f, default=str)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if(not os.path.exists(entry_dir)):
+                raise
+        self.evict()
+
+    """Entries as (last used, size in bytes, key), least recently used first"""
+    def entries(self):
+        entries = []
+        for key in os.listdir(self.directory):
+            metrics_path = os.path.join(self._entry_dir(key), self.metrics_file)
+            if(key.startswith('.') or not os.path.exists(metrics_path)):
+                continue
+            entry_dir = self._entry_dir(key)
+            size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(metrics_path), size, key))
+        return sorted(entries)
+
+    """Remove the least recently used entries until the cache fits in max_bytes"""
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if(total <= self.max_bytes):
+                break
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
@@ -0,0 +1,201 @@
+import time
+import random
+import logging
+from threading import Lock, local
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+"""Raised when a call is refused because the circuit of its endpoint is open and no last good value is available"""
+class CircuitOpenError(Exception):
+    pass
+
+"""
+Call policy, circuit breaker and statistics of one external endpoint
+Calls that take longer than timeout seconds are abandoned and retried up to retries times with full jitter backoff,
+so a call never blocks for more than about (retries+1)*timeout plus max_backoff per retry.
+After failure_threshold consecutive failed calls the circuit opens and calls fail fast, serving the last good value
+for the same arguments if there is one (for the last max_keys argument sets). After reset_timeout seconds one trial call is let through to close it again.
+Exceptions in passthrough are expected answers of the endpoint (e.g. not found) and count as successful calls.
+"""
+class Endpoint():
+
+    def __init__(self, name, timeout=10.0, retries=2, backoff=0.5, max_backoff=5.0, failure_threshold=5, reset_timeout=30.0,
+        passthrough=(), fallback=True, max_keys=128, clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.passthrough = passthrough
+        self.fallback = fallback
+        self.max_keys = max_keys
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = Lock()
+
+        # Circuit state: closed, open or half_open while a trial call is running
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_good = OrderedDict()
+
+        # Statistics
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.short_circuits = 0
+        self.fallbacks = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_error = None
+
+    """Check whether a call may go out, moving an open circuit to half open once the reset timeout has passed"""
+    def _allow(self):
+        with self.lock:
+            if(self.state == 'closed'):
+                return True
+            if(self.state == 'open' and self.clock() - self.opened_at >= self.reset_timeout):
+                self.state = 'half_open'
+                return True
+            return False
+
+    def _record(self, ok, latency, error=None):
+        with self.lock:
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if(ok):
+                self.consecutive_failures = 0
+                self.state = 'closed'
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = repr(error)
+            if(self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold):
+                if(self.state != 'open'):
+                    logging.warning('Circuit of %s opened after %s failures: %s', self.name, self.consecutive_failures, self.last_error)
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    """Keep the last good value of a key, forgetting the least recently stored keys"""
+    def _keep(self, key, value):
+        with self.lock:
+            self.last_good[key] = value
+            self.last_good.move_to_end(key)
+            while(len(self.last_good) > self.max_keys):
+                self.last_good.popitem(last=False)
+
+    """Serve the last good value of a key while the circuit is open"""
+    def _serve_last_good(self, key):
+        with self.lock:
+            self.short_circuits += 1
+            if(self.fallback and key in self.last_good):
+                self.fallbacks += 1
+                return self.last_good[key]
+        raise CircuitOpenError(f'Circuit of {self.name} is open')
+
+    """Get call, failure, circuit and latency statistics"""
+    def stats(self):
+        with self.lock:
+            return {'state': self.state, 'calls': self.calls, 'failures': self.failures, 'timeouts': self.timeouts,
+                'retries': self.retried, 'short_circuits': self.short_circuits, 'fallbacks': self.fallbacks,
+                'mean_latency': self.total_latency/self.calls if self.calls > 0 else 0.0, 'max_latency': self.max_latency,
+                'last_error': self.last_error}
+
+"""
+Runs calls to external services on a shared thread pool with per-endpoint timeouts, retries and circuit breakers
+A call that times out keeps its pool thread until the socket gives up, so the pool is sized for a few hung calls per endpoint
+"""
+class ResilientCaller():
+
+    def __init__(self, max_workers=16):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Call')
+        self.endpoints = {}
+        self.lock = Lock()
+
+        # Whether the last call of each thread was answered by its endpoint
+        self.local = local()
+
+    """Get an endpoint, creating it with the given policy the first time it is used"""
+    def endpoint(self, name, **policy):
+        with self.lock:
+            if(name not in self.endpoints):
+                self.endpoints[name] = Endpoint(name, **policy)
+            return self.endpoints[name]
+
+    """
+    Call a function through an endpoint
+    The last good value is kept per key, the function name and representation of the call arguments unless a key is given
+    before is called on the calling thread ahead of every attempt with the attempt's timeout, e.g. to wait for a rate limit token.
+    Its wait counts towards the timeout, and an attempt it fails with TimeoutError is never dispatched
+    """
+    def call(self, name, function, *args, key=None, before=None, **kwargs):
+        endpoint = self.endpoint(name)
+        key = key if key is not None else repr((getattr(function, '__qualname__', None), args, sorted(kwargs.items())))
+        self.local.fresh = False
+        if(not endpoint._allow()):
+            return endpoint._serve_last_good(key)
+
+        for attempt in range(endpoint.retries+1):
+            start = endpoint.clock()
+            future = None
+            try:
+                if(before is not None):
+                    before(endpoint.timeout)
+                future = self.executor.submit(function, *args, **kwargs)
+                value = future.result(timeout=max(endpoint.timeout - (endpoint.clock() - start), 0.0))
+            except endpoint.passthrough:
+                endpoint._record(True, endpoint.clock() - start)
+                raise
+            except TimeoutError as e:
+                if(future is not None):
+                    future.cancel()
+                with endpoint.lock:
+                    endpoint.timeouts += 1
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                endpoint._record(True, endpoint.clock() - start)
+                if(endpoint.fallback):
+                    endpoint._keep(key, value)
+                self.local.fresh = True
+                return value
+
+            # Stop retrying once the circuit opens
+            endpoint._record(False, endpoint.clock() - start, error)
+            if(attempt == endpoint.retries or endpoint.state == 'open'):
+                break
+            with endpoint.lock:
+                endpoint.retried += 1
+            endpoint.sleep(random.uniform(0, min(endpoint.max_backoff, endpoint.backoff*2**attempt)))
+
+        if(endpoint.state == 'open' and endpoint.fallback and key in endpoint.last_good):
+            return endpoint._serve_last_good(key)
+        raise error
+
+    """Check whether the last call of the calling thread returned a new value rather than a last good value"""
+    def last_call_fresh(self):
+        return getattr(self.local, 'fresh', False)
+
+    """Statistics of all endpoints"""
+    def stats(self):
+        return dict([(name, endpoint.stats()) for name, endpoint in list(self.endpoints.items())])
+
+    """Stop the pool without waiting for hung calls"""
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+_shared_caller = None
+_shared_lock = Lock()
+
+"""Caller shared by all agents of the process"""
+def shared_caller():
+    global _shared_caller
+    with _shared_lock:
+        if(_shared_caller is None):
+            _shared_caller = ResilientCaller()
+        return _shared_caller
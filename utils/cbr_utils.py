@@ -0,0 +1,83 @@
+import numpy as np
+
+"""Feature order used to train and query the CBR model"""
+def cbr_columns(agent_names):
+    return ['Action', 'Quantity', 'Price', 'Balance']+sorted(agent_names)+['MACRO_0', 'MACRO_1', 'MACRO_2', 'VaR']
+
+"""Encode trade action into the numeric value used as the CBR Action feature"""
+def encode_action(action):
+    return 1.0 if action == 'buy' else (-1.0 if action == 'sell' else 0.0)
+
+"""Build the CBR feature vector from a trade in a fixed column order"""
+def feature_vector(trade, columns):
+    return np.fromiter((encode_action(trade[col]) if col == 'Action' else trade[col] for col in columns), dtype=np.float64, count=len(columns))
+
+"""Build the CBR feature matrix from a dataframe of trades in a fixed column order"""
+def feature_matrix(trades, columns):
+    X = np.empty((len(trades), len(columns)), dtype=np.float64)
+    for i, col in enumerate(columns):
+        if(col == 'Action'):
+            action = trades[col].to_numpy()
+            X[:, i] = np.where(action == 'buy', 1.0, np.where(action == 'sell', -1.0, 0.0))
+        else:
+            X[:, i] = trades[col].to_numpy(dtype=np.float64)
+    return X
+
+"""Label trades as profitable (1) or not (-1) from their PNL"""
+def pnl_labels(pnl):
+    return np.where(np.asarray(pnl, dtype=np.float64) > 0, 1, -1)
+
+"""
+Append-only CBR training set
+Features and labels live in preallocated arrays that grow by doubling, so appending new trades is amortised O(rows added)
+"""
+class TrainingSet():
+
+    def __init__(self, num_features, capacity=1024):
+        self.size = 0
+        self._X = np.empty((capacity, num_features), dtype=np.float64)
+        self._y = np.empty(capacity, dtype=np.int64)
+
+    """Append feature rows and labels"""
+    def append(self, X, y):
+        n = len(X)
+        if(self.size + n > len(self._X)):
+            capacity = max(2*len(self._X), self.size + n)
+            self._X = np.resize(self._X, (capacity, self._X.shape[1]))
+            self._y = np.resize(self._y, capacity)
+        self._X[self.size:self.size+n] = X
+        self._y[self.size:self.size+n] = y
+        self.size += n
+
+    """Features of all appended trades"""
+    @property
+    def X(self):
+        return self._X[:self.size]
+
+    """Labels of all appended trades"""
+    @property
+    def y(self):
+        return self._y[:self.size]
+
+"""
+Precompiled inference path for the logistic regression CBR model
+Coefficients are copied out of the fitted model once so that a prediction is a single dot product and sign
+"""
+class CompiledCBR():
+
+    def __init__(self, model):
+        self.model = model
+        coef = np.asarray(model.coef_, dtype=np.float64)
+
+        # Only the binary case reduces to a single hyperplane, otherwise defer to the model
+        self.binary = coef.shape[0] == 1
+        self.coef = coef[0].copy()
+        self.intercept = float(np.ravel(model.intercept_)[0])
+        self.classes = model.classes_
+
+    """Predict the PnL direction class for a feature vector ordered like the training columns"""
+    def predict(self, features):
+        if(not self.binary):
+            return self.model.predict(features.reshape(1, -1))[0]
+        score = float(np.dot(self.coef, features)) + self.intercept
+        return self.classes[1] if score > 0 else self.classes[0]
@@ -0,0 +1,92 @@
+import os
+import pickle
+import logging
+
+"""
+Checkpoint store for warm restarts
+Tables are written as Arrow IPC files and memory-mapped on load, small state objects are pickled.
+Every write goes to a temporary file that is atomically renamed, so a crash never leaves a torn checkpoint.
+Writes are skipped when the caller's version token for an entry has not changed since the last write.
+"""
+class Checkpoint():
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tokens = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    """Get the file path of a checkpoint entry"""
+    def path(self, name, ext):
+        return os.path.join(self.directory, f'{name}.{ext}')
+
+    """Check whether the entry with this token was already written"""
+    def is_current(self, name, token):
+        return token is not None and self.tokens.get(name) == token
+
+    """Atomically replace a checkpoint file using a writer callback"""
+    def _atomic_write(self, path, write):
+        tmp_path = f'{path}.tmp'
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    """
+    Save a dataframe as an Arrow IPC table, falling back to pickle for columns Arrow cannot type
+    The file in the other format is removed, so load_table never reads an older version of the table
+    """
+    def save_table(self, name, df, token=None):
+        if(self.is_current(name, token)):
+            return False
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self._atomic_write(self.path(name, 'arrow'), lambda p: feather.write_feather(table, p, compression='uncompressed'))
+            stale_path = self.path(name, 'pkl')
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logging.warning(f'Checkpoint {name} not Arrow compatible, pickling instead: {e}')
+            self.save_state(name, df)
+            stale_path = self.path(name, 'arrow')
+        if(os.path.exists(stale_path)):
+            os.remove(stale_path)
+        self.tokens[name] = token
+        return True
+
+    """Load a table saved with save_table, memory-mapping Arrow files"""
+    def load_table(self, name):
+        path = self.path(name, 'arrow')
+        if(os.path.exists(path)):
+            import pyarrow.feather as feather
+            return feather.read_table(path, memory_map=True).to_pandas()
+        return self.load_state(name)
+
+    """Save a picklable state object"""
+    def save_state(self, name, obj, token=None):
+        if(self.is_current(name, token)):
+            return False
+        def write(path):
+            with open(path, 'wb') as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._atomic_write(self.path(name, 'pkl'), write)
+        self.tokens[name] = token
+        return True
+
+    """Load a state object, None if it was never saved"""
+    def load_state(self, name):
+        path = self.path(name, 'pkl')
+        if(not os.path.exists(path)):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    """Get the modification time of an entry, None if it does not exist"""
+    def modified_time(self, name):
+        for ext in ('pkl', 'arrow'):
+            if(os.path.exists(self.path(name, ext))):
+                return os.path.getmtime(self.path(name, ext))
+        return None
+
+    """Remove all checkpoint entries"""
+    def clear(self):
+        for f in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, f))
+        self.tokens = {}
@@ -0,0 +1,60 @@
+import time
+import math
+
+# Offset from the monotonic clock to wall time, fixed at import so all clocks share the same boundaries
+_WALL_OFFSET = time.time() - time.monotonic()
+
+"""
+Drift-free tick clock
+Ticks fall on absolute multiples of the period in wall time (e.g. on the minute for a 60 second tick),
+so every agent with the same period wakes on the same boundaries however long its work takes.
+If work overruns one or more boundaries, the missed ticks are counted and skipped instead of run back to back.
+Lateness is the time between a tick boundary and the moment the agent actually ran.
+"""
+class TickClock():
+
+    def __init__(self, period, monotonic=time.monotonic, sleep=time.sleep):
+        self.period = period
+        self.monotonic = monotonic
+        self.sleep = sleep
+        self.next_tick = None
+        self.ticks = 0
+        self.missed = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    """Get the first tick boundary at or after a monotonic time"""
+    def boundary_after(self, now):
+        return math.ceil((now + _WALL_OFFSET)/self.period)*self.period - _WALL_OFFSET
+
+    """
+    Wait for the next tick boundary
+    Returns the number of ticks missed since the previous call
+    """
+    def wait(self):
+        now = self.monotonic()
+        if(self.next_tick is None):
+            self.next_tick = self.boundary_after(now)
+        missed = 0
+        if(now < self.next_tick):
+            self.sleep(self.next_tick - now)
+            now = self.monotonic()
+        elif(now >= self.next_tick + self.period):
+            # Skip to the latest boundary that has passed
+            missed = int((now - self.next_tick)//self.period)
+            self.next_tick += missed*self.period
+
+        lateness = max(now - self.next_tick, 0.0)
+        self.ticks += 1
+        self.missed += missed
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+        self.next_tick += self.period
+        return missed
+
+    """Tick, missed tick and lateness statistics"""
+    def stats(self):
+        return {'ticks': self.ticks, 'missed': self.missed, 'last_lateness': self.last_lateness, 'max_lateness': self.max_lateness,
+            'mean_lateness': self.total_lateness/self.ticks if self.ticks > 0 else 0.0}
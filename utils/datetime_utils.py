@@ -10,4 +10,21 @@ def get_n_deltas_before_str(n):
 
 """Function to convert GMT time to local time"""
 def convert_gmt_to_local(t):
-    return t + (datetime.now() - datetime.utcnow())
\ No newline at end of file
+    return t + get_utc_offset()
+
+"""
+Function to get the offset of local time from UTC
+Rounded to whole minutes, so converting the same bar twice gives the same timestamp
+"""
+def get_utc_offset():
+    offset = datetime.now() - datetime.utcnow()
+    return timedelta(minutes=round(offset.total_seconds()/60))
+
+"""
+Function to get the start of the newest completed bar of a timeframe in minutes
+Shifted to local time like the bars returned by the Broker Agent
+"""
+def get_newest_bar_start(timeframe):
+    import pandas as pd
+    freq = pd.Timedelta(minutes=timeframe)
+    return convert_gmt_to_local(pd.Timestamp.now(tz='UTC')).floor(freq) - freq
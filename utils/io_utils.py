@@ -1,6 +1,5 @@
+import os
 import pickle
-import pyarrow as pa
-import pyarrow.csv as csv
 from enum import Enum
 
 """Enumerated Data Type to represent agent weights and account book"""
@@ -10,6 +9,8 @@ class Type(Enum):
 
 """Save pandas df to CSV using PyArrow"""
 def df_to_csv(df, filename):
+    import pyarrow as pa
+    import pyarrow.csv as csv
     if("Created_at" in df.columns):
         df['Created_at'] = df['Created_at'].astype('datetime64[ns]')
     if("Updated_at" in df.columns):
@@ -19,6 +20,7 @@ def df_to_csv(df, filename):
 
 """Load CSV to df using PyArrow"""
 def csv_to_df(filename):
+    import pyarrow.csv as csv
     df_pa_table = csv.read_csv(filename)
     df = df_pa_table.to_pandas()
     return df
@@ -31,4 +33,91 @@ def load_pickle(filename):
 """Save object to pickle file"""
 def save_pickle(obj, filename):
     with open(filename, 'wb') as f:
-        pickle.dump(obj, f)
\ No newline at end of file
+        pickle.dump(obj, f)
+
+"""
+Get the binary cache path for a source file parsed with the given read_csv arguments
+The key combines the source size and modification time, or its content hash if verify is set,
+with a hash of the read arguments, so differently parsed tables of one source don't share a cache
+"""
+def _cache_path(filename, verify=False, **read_kwargs):
+    import hashlib
+    stat = os.stat(filename)
+    if(verify):
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        key = digest.hexdigest()[:16]
+    else:
+        key = f'{stat.st_size}-{stat.st_mtime_ns}'
+    options = hashlib.sha1(repr(sorted(read_kwargs.items())).encode()).hexdigest()[:8]
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.cache')
+    return os.path.join(cache_dir, f'{os.path.basename(filename)}.{key}.{options}.arrow')
+
+"""
+Convert a CSV into a typed Arrow IPC cache file
+The CSV is parsed with pandas in chunks so memory stays bounded, integer columns are stored as float64
+so every chunk shares one schema. Stale caches of the same source and read arguments are removed.
+Each build writes its own temporary file, so concurrent builds of one cache don't interleave.
+Returns whether the cache was written, a CSV that yields no chunk is not cached.
+"""
+def _build_csv_cache(filename, cache_path, chunksize=100000, **read_kwargs):
+    import glob
+    import tempfile
+    import pyarrow as pa
+    import pandas as pd
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    options = os.path.basename(cache_path).rsplit('.', 2)[1]
+    for old_path in glob.glob(os.path.join(cache_dir, f'{glob.escape(os.path.basename(filename))}.*.{options}.arrow')):
+        if(old_path != cache_path):
+            os.remove(old_path)
+
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f'.{os.path.basename(filename)}-', suffix='.tmp')
+    os.close(fd)
+    writer = None
+    try:
+        try:
+            for chunk in pd.read_csv(filename, chunksize=chunksize, **read_kwargs):
+                int_cols = chunk.select_dtypes(include='integer').columns
+                chunk[int_cols] = chunk[int_cols].astype('float64')
+                table = pa.Table.from_pandas(chunk, preserve_index=True)
+                if(writer is None):
+                    schema = table.schema
+                    writer = pa.ipc.new_file(tmp_path, schema)
+                writer.write_table(table.cast(schema))
+        finally:
+            if(writer is not None):
+                writer.close()
+        if(writer is None):
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, cache_path)
+        return True
+    except BaseException:
+        if(os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+        raise
+
+"""Memory-map the Arrow cache of a CSV, building it on first use, or parse the CSV if it could not be cached"""
+def _cached_table(filename, verify=False, **read_kwargs):
+    import pyarrow as pa
+    cache_path = _cache_path(filename, verify, **read_kwargs)
+    if(not os.path.exists(cache_path) and not _build_csv_cache(filename, cache_path, **read_kwargs)):
+        import pandas as pd
+        return pa.Table.from_pandas(pd.read_csv(filename, **read_kwargs), preserve_index=True)
+    return pa.ipc.open_file(pa.memory_map(cache_path, 'r')).read_all()
+
+"""
+Load CSV to df through a binary sidecar cache
+Takes the same arguments as pandas read_csv; later calls memory-map the cache instead of parsing text
+"""
+def read_cached_csv(filename, verify=False, **read_kwargs):
+    return _cached_table(filename, verify, **read_kwargs).to_pandas()
+
+"""Iterate over a cached CSV in dataframes of at most chunksize rows"""
+def iter_cached_csv(filename, chunksize, verify=False, **read_kwargs):
+    table = _cached_table(filename, verify, **read_kwargs)
+    for batch in table.to_batches(max_chunksize=chunksize):
+        yield batch.to_pandas()
@@ -0,0 +1,87 @@
+from collections import deque
+
+"""Open position bought in one trade, with any data the caller wants back when it is closed"""
+class Lot():
+
+    __slots__ = ('key', 'quantity', 'price', 'data')
+
+    def __init__(self, key, quantity, price, data=None):
+        self.key = key
+        self.quantity = quantity
+        self.price = price
+        self.data = data
+
+"""
+Lot ledger to match sells against open buys
+Lots are kept in a deque and closed oldest first, so buys and sells cost O(1) amortised per lot.
+The cost basis of a sell is either the matched lots' own prices (fifo) or the average price of all open lots (average).
+"""
+class LotLedger():
+
+    # Remaining quantities below this are treated as closed
+    epsilon = 1e-12
+
+    def __init__(self, policy='fifo'):
+        if(policy not in ('fifo', 'average')):
+            raise ValueError(f'Unknown cost basis policy {policy}')
+        self.policy = policy
+        self.lots = deque()
+        self.quantity = 0.0
+        self.cost = 0.0
+
+    def __len__(self):
+        return len(self.lots)
+
+    """Add a bought lot"""
+    def buy(self, quantity, price, key=None, data=None):
+        self.lots.append(Lot(key, quantity, price, data))
+        self.quantity += quantity
+        self.cost += quantity*price
+
+    """Average price of the open lots"""
+    def average_price(self):
+        return self.cost/self.quantity if self.quantity > self.epsilon else 0.0
+
+    """
+    Sell a quantity, closing lots oldest first
+    Returns the PnL of the matched quantity and a list of (lot, matched quantity) for the lots that were touched
+    """
+    def sell(self, quantity, price):
+        matched = min(quantity, self.quantity)
+        if(self.policy == 'average'):
+            cost = self.average_price()*matched
+        else:
+            cost = 0.0
+        closed = []
+        remaining = matched
+        while(remaining > self.epsilon and len(self.lots) > 0):
+            lot = self.lots[0]
+            take = min(lot.quantity, remaining)
+            if(self.policy == 'fifo'):
+                cost += take*lot.price
+            closed.append((lot, take))
+            remaining -= take
+            lot.quantity -= take
+            if(lot.quantity <= self.epsilon):
+                self.lots.popleft()
+
+        # Reset exactly when flat so rounding errors don't accumulate
+        if(len(self.lots) == 0):
+            self.quantity = 0.0
+            self.cost = 0.0
+        else:
+            self.quantity -= matched
+            self.cost -= cost
+        return matched*price - cost, closed
+
+    """Get the open lots as (key, quantity, price) tuples, e.g. for checkpoints"""
+    def get_state(self):
+        return {'policy': self.policy, 'lots': [(lot.key, lot.quantity, lot.price) for lot in self.lots]}
+
+    """Rebuild a ledger from get_state"""
+    @classmethod
+    def from_state(cls, state):
+        ledger = cls(state['policy'])
+        for key, quantity, price in state['lots']:
+            ledger.buy(quantity, price, key)
+        return ledger
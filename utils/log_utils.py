@@ -0,0 +1,81 @@
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from threading import Thread
+from utils.trade_utils import json_default
+
+"""
+Queue handler that hands records to the listener without formatting them
+Messages and their arguments are only formatted on the listener thread, so logging from inside
+an agent lock costs no more than creating the record.
+"""
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record):
+        return record
+
+_listener = None
+
+"""
+Route all logging through a queue to a listener thread which formats and writes the records
+Replaces the handlers of the root logger, returns the listener
+"""
+def setup_logging(format='%(asctime)s %(message)s', level=logging.INFO):
+    global _listener
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(format))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+"""Write out all queued records and stop the listener thread"""
+def stop_logging():
+    global _listener
+    if(_listener is not None):
+        _listener.stop()
+        _listener = None
+
+"""
+Structured trade log
+Trade records are queued as shallow copies and written as JSON lines by a background thread,
+so the decision and order path never serialises or touches the file.
+"""
+class TradeLog():
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.thread = Thread(name='TradeLog', target=self._write, daemon=True)
+        self.thread.start()
+
+    """Queue a trade record for writing"""
+    def record(self, trade):
+        self.queue.put(dict(trade))
+
+    """Write queued records until closed, flushing whenever the queue runs empty"""
+    def _write(self):
+        with open(self.path, 'a') as f:
+            while True:
+                trade = self.queue.get()
+                if(trade is None):
+                    break
+                f.write(json.dumps(trade, default=json_default) + '\n')
+                if(self.queue.empty()):
+                    f.flush()
+
+    """Write all queued records and stop the writer thread"""
+    def close(self):
+        if(self.thread.is_alive()):
+            self.queue.put(None)
+            self.thread.join()
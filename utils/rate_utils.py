@@ -0,0 +1,132 @@
+import time
+import heapq
+import itertools
+from threading import Condition, Lock
+from concurrent.futures import Future
+
+"""
+Token bucket rate limiter with priority classes
+Tokens refill at rate per second up to burst. Waiting callers are served strictly by priority (lower first),
+then in arrival order, so a queued order submission always gets the next token before queued data requests.
+"""
+class PriorityRateLimiter():
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.condition = Condition()
+        self.tokens = float(burst)
+        self.updated_at = clock()
+        self.waiters = []
+        self.sequence = itertools.count()
+
+        # Queue depth and throttle wait statistics, per priority
+        self.max_depth = 0
+        self.acquired = {}
+        self.timed_out = {}
+        self.throttled = {}
+        self.total_wait = {}
+        self.max_wait = {}
+
+    def _refill(self, now):
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at)*self.rate)
+        self.updated_at = now
+
+    """
+    Wait for a token, returns the seconds spent waiting
+    With a timeout, gives up its place in the queue and raises TimeoutError once timeout seconds have passed without a token
+    """
+    def acquire(self, priority=0, timeout=None):
+        with self.condition:
+            start = self.clock()
+            entry = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, entry)
+            self.max_depth = max(self.max_depth, len(self.waiters))
+            throttled = False
+            while True:
+                now = self.clock()
+                self._refill(now)
+                if(self.waiters[0] == entry and self.tokens >= 1.0):
+                    break
+                if(timeout is not None and now - start >= timeout):
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                    self.timed_out[priority] = self.timed_out.get(priority, 0) + 1
+                    self.condition.notify_all()
+                    raise TimeoutError(f'No rate limit token within {timeout} seconds')
+
+                # Only the head of the queue waits on the refill, the others until the head is served
+                throttled = True
+                wait = (1.0 - self.tokens)/self.rate if self.waiters[0] == entry else None
+                if(timeout is not None):
+                    remaining = timeout - (now - start)
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+            heapq.heappop(self.waiters)
+            self.tokens -= 1.0
+            self.condition.notify_all()
+
+            wait = self.clock() - start
+            self.acquired[priority] = self.acquired.get(priority, 0) + 1
+            self.total_wait[priority] = self.total_wait.get(priority, 0.0) + wait
+            self.max_wait[priority] = max(self.max_wait.get(priority, 0.0), wait)
+            if(throttled):
+                self.throttled[priority] = self.throttled.get(priority, 0) + 1
+            return wait
+
+    """Number of callers waiting for a token"""
+    def queue_depth(self):
+        with self.condition:
+            return len(self.waiters)
+
+    """Queue depth and wait statistics per priority"""
+    def stats(self):
+        with self.condition:
+            return {'queue_depth': len(self.waiters), 'max_depth': self.max_depth, 'tokens': self.tokens,
+                'timed_out': dict(self.timed_out),
+                'priorities': dict([(priority, {'acquired': count, 'throttled': self.throttled.get(priority, 0),
+                    'mean_wait': self.total_wait[priority]/count, 'max_wait': self.max_wait[priority]}) for priority, count in sorted(self.acquired.items())])}
+
+"""
+Coalescer of identical in-flight requests
+While a request for a key is running, concurrent callers with the same key wait for it and share its result or error
+instead of sending their own.
+"""
+class Coalescer():
+
+    def __init__(self):
+        self.lock = Lock()
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    """Run function for a key, or wait for the identical request already in flight"""
+    def call(self, key, function):
+        with self.lock:
+            self.calls += 1
+            future = self.in_flight.get(key)
+            leader = future is None
+            if(leader):
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if(not leader):
+            return future.result()
+
+        try:
+            value = function()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    """Requests and how many of them shared an in-flight response"""
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self.in_flight)}
@@ -0,0 +1,184 @@
+import math
+import numpy as np
+from threading import Lock
+from collections import OrderedDict
+
+"""Fixed size ring buffer over a NumPy array"""
+class RingBuffer():
+
+    def __init__(self, capacity):
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.start = 0
+        self.size = 0
+
+    """Append a value, returning the value it overwrote (None if the buffer was not full)"""
+    def append(self, value):
+        capacity = len(self.values)
+        end = (self.start + self.size) % capacity
+        dropped = None
+        if(self.size == capacity):
+            dropped = self.values[end]
+            self.start = (self.start + 1) % capacity
+        else:
+            self.size += 1
+        self.values[end] = value
+        return dropped
+
+    """Get the values in insertion order"""
+    def to_array(self):
+        return np.roll(self.values, -self.start)[:self.size]
+
+"""
+Incremental equity and risk metrics tracker
+Cash and position are updated on every fill and the position is marked to market on every new bar.
+Equity curve, running max drawdown, rolling Sharpe and Sortino ratios and exposure are maintained in O(1) per update,
+with returns kept in a rolling window and the equity curve in a bounded buffer.
+Fills of an order can be reported by everyone who sees them, only the first report of an order id moves cash and position.
+"""
+class RiskTracker():
+
+    def __init__(self, start_capital, cash=None, position=0.0, price=0.0, window=100, capacity=10000, annualization=1.0):
+        self.lock = Lock()
+        self.start_capital = start_capital
+        self.cash = start_capital if cash is None else cash
+        self.position = position
+        self.price = price
+        self.realized_pnl = 0.0
+        self.fills = 0
+        self.synced = cash is not None
+
+        # Ids of the most recently applied orders, with whether their realised PnL was added
+        self.applied_orders = OrderedDict()
+        self.max_orders = 1000
+        self.annualization = annualization
+
+        # Equity curve and rolling windows of per-bar returns and exposures with their running sums
+        self.curve = RingBuffer(capacity)
+        self.returns = RingBuffer(window)
+        self.exposures = RingBuffer(window)
+        self.sum_return = 0.0
+        self.sum_return_sq = 0.0
+        self.sum_downside_sq = 0.0
+        self.sum_exposure = 0.0
+        self.last_bar = None
+        self.last_equity = self._equity()
+        self.peak = self.last_equity
+        self.max_drawdown = 0.0
+
+    def _equity(self):
+        return self.cash + self.position*self.price
+
+    """
+    Apply a fill, with the realised PnL of the trade if known
+    A fill of an order id that was already applied only adds its realised PnL if it wasn't known yet, returns whether the fill was applied
+    """
+    def fill(self, side, quantity, price, pnl=None, order_id=None):
+        with self.lock:
+            if(order_id is not None):
+                if(order_id in self.applied_orders):
+                    if(pnl is not None and not self.applied_orders[order_id]):
+                        self.realized_pnl += pnl
+                        self.applied_orders[order_id] = True
+                    return False
+                self.applied_orders[order_id] = pnl is not None
+                while(len(self.applied_orders) > self.max_orders):
+                    self.applied_orders.popitem(last=False)
+            sign = 1.0 if side == 'buy' else -1.0
+            self.cash -= sign*quantity*price
+            self.position += sign*quantity
+            self.price = price
+            self.fills += 1
+            if(pnl is not None):
+                self.realized_pnl += pnl
+            return True
+
+    """Set cash and position from the broker, e.g. once fills from before the tracker was created are settled"""
+    def sync(self, cash, position):
+        with self.lock:
+            self.cash = cash
+            self.position = position
+            self.synced = True
+
+    """
+    Mark the position to market
+    A new bar (a bar key different from the last one, or no key) adds a point to the equity curve,
+    marks within the same bar only update the current equity
+    """
+    def mark(self, price, bar=None):
+        with self.lock:
+            self.price = price
+            if(bar is not None and bar == self.last_bar):
+                return
+            self.last_bar = bar
+            equity = self._equity()
+            self.curve.append(equity)
+
+            # Rolling return statistics
+            ret = equity/self.last_equity - 1.0 if self.last_equity != 0 else 0.0
+            dropped = self.returns.append(ret)
+            self.sum_return += ret
+            self.sum_return_sq += ret*ret
+            self.sum_downside_sq += min(ret, 0.0)**2
+            if(dropped is not None):
+                self.sum_return -= dropped
+                self.sum_return_sq -= dropped*dropped
+                self.sum_downside_sq -= min(dropped, 0.0)**2
+
+            # Rolling exposure
+            exposure = self.position*price/equity if equity != 0 else 0.0
+            dropped = self.exposures.append(exposure)
+            self.sum_exposure += exposure - (dropped if dropped is not None else 0.0)
+
+            # Drawdown from the running peak
+            self.peak = max(self.peak, equity)
+            if(self.peak > 0):
+                self.max_drawdown = max(self.max_drawdown, 1.0 - equity/self.peak)
+            self.last_equity = equity
+
+    """Current mark-to-market equity"""
+    def equity(self):
+        with self.lock:
+            return self._equity()
+
+    """Current drawdown from the peak equity"""
+    def drawdown(self):
+        with self.lock:
+            return max(1.0 - self._equity()/self.peak, 0.0) if self.peak > 0 else 0.0
+
+    """Rolling Sharpe ratio of per-bar returns"""
+    def sharpe(self):
+        n = self.returns.size
+        if(n < 2):
+            return 0.0
+        mean = self.sum_return/n
+        var = max(self.sum_return_sq/n - mean*mean, 0.0)*n/(n-1)
+        return mean/math.sqrt(var)*math.sqrt(self.annualization) if var > 0 else 0.0
+
+    """Rolling Sortino ratio of per-bar returns"""
+    def sortino(self):
+        n = self.returns.size
+        if(n < 2):
+            return 0.0
+        downside = math.sqrt(max(self.sum_downside_sq, 0.0)/n)
+        return (self.sum_return/n)/downside*math.sqrt(self.annualization) if downside > 0 else 0.0
+
+    """Current exposure (position value over equity)"""
+    def exposure(self):
+        with self.lock:
+            equity = self._equity()
+            return self.position*self.price/equity if equity != 0 else 0.0
+
+    """Mean exposure over the rolling window"""
+    def mean_exposure(self):
+        return self.sum_exposure/self.exposures.size if self.exposures.size > 0 else 0.0
+
+    """Equity curve kept in the buffer, oldest first"""
+    def equity_curve(self):
+        with self.lock:
+            return self.curve.to_array()
+
+    """Summary of the tracked metrics"""
+    def report(self):
+        return {'equity': self.equity(), 'pnl': self.equity() - self.start_capital, 'realized_pnl': self.realized_pnl,
+            'max_drawdown': self.max_drawdown, 'drawdown': self.drawdown(), 'sharpe': self.sharpe(), 'sortino': self.sortino(),
+            'exposure': self.exposure(), 'mean_exposure': self.mean_exposure(), 'fills': self.fills}
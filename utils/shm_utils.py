@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+"""
+OHLCV bar window in shared memory, written by the main process and read by agent worker processes
+Layout: int64 header [sequence, number of rows, UTC flag], int64 timestamps (ns), float64 Open/High/Low/Close/Volume rows.
+The sequence is odd while a write is in progress. Timestamps of a timezone-aware index are stored as UTC ns and read back in UTC.
+"""
+class SharedBarWindow():
+
+    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+    def __init__(self, rows, name=None):
+        self.rows = rows
+        size = 8*3 + 8*rows + 8*rows*len(self.columns)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.owner = name is None
+        self.header = np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf, offset=0)
+        self.timestamps = np.ndarray((rows,), dtype=np.int64, buffer=self.shm.buf, offset=24)
+        self.values = np.ndarray((rows, len(self.columns)), dtype=np.float64, buffer=self.shm.buf, offset=24 + 8*rows)
+        if(self.owner):
+            self.header[:] = 0
+
+    """Name used by worker processes to attach to the window"""
+    @property
+    def name(self):
+        return self.shm.name
+
+    """Copy the latest bars of an OHLCV dataframe into the window"""
+    def write(self, df):
+        df = df.iloc[-self.rows:]
+        n = len(df)
+        self.header[0] += 1
+        self.timestamps[:n] = df.index.asi8
+        self.values[:n] = df[self.columns].to_numpy(dtype=np.float64)
+        self.header[1] = n
+        self.header[2] = 1 if df.index.tz is not None else 0
+        self.header[0] += 1
+
+    """Sequence number of the last completed write"""
+    def sequence(self):
+        return int(self.header[0])
+
+    """
+    Get the window as an OHLCV dataframe backed by the shared memory without copying the values
+    The frame is only valid until the next write, so writers must wait for readers to finish
+    """
+    def to_frame(self):
+        if(self.header[0] % 2 == 1):
+            raise BlockingIOError('Bar window is being written')
+        n = int(self.header[1])
+        index = pd.DatetimeIndex(self.timestamps[:n].view('datetime64[ns]'), name='Timestamp')
+        if(self.header[2] == 1):
+            index = index.tz_localize('UTC')
+        return pd.DataFrame(self.values[:n], index=index, columns=self.columns, copy=False)
+
+    """Detach from the shared memory, removing it if this process created it"""
+    def close(self):
+        del self.header, self.timestamps, self.values
+        self.shm.close()
+        if(self.owner):
+            self.shm.unlink()
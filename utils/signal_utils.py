@@ -0,0 +1,151 @@
+import numpy as np
+
+"""
+Vectorised indicator kernels shared by the live signal agents and the simulator
+All functions work along the last axis, so a 1-D array is a single price series and
+a 2-D array holds one series per row (many symbols, or one symbol under many parameter sets).
+Window and threshold parameters may be scalars or one value per row.
+"""
+
+"""Promote prices to 2-D and broadcast a single series across the parameter rows"""
+def _as_rows(prices, *params):
+    x = np.asarray(prices, dtype=np.float64)
+    squeeze = x.ndim == 1
+    x = np.atleast_2d(x)
+    params = [np.asarray(p).reshape(-1, 1) for p in params]
+    rows = max([x.shape[0]] + [p.shape[0] for p in params])
+    if(x.shape[0] != rows):
+        x = np.broadcast_to(x, (rows, x.shape[1]))
+        squeeze = False
+    params = [np.broadcast_to(p, (rows, 1)) for p in params]
+    return x, params, squeeze
+
+"""Undo the 2-D promotion for single series inputs"""
+def _restore(arr, squeeze):
+    return arr[0] if squeeze else arr
+
+"""Row-wise first difference with a leading NaN (pandas Series.diff)"""
+def _diff(x):
+    out = np.empty_like(x, dtype=np.float64)
+    out[:, 0] = np.nan
+    out[:, 1:] = x[:, 1:] - x[:, :-1]
+    return out
+
+"""
+Rolling mean (and optionally sample standard deviation) over per-row windows
+Matches pandas rolling(window) with min_periods=window: any NaN inside the window gives NaN
+Series are shifted by their mean before the cumulative sums to keep the variance numerically stable
+"""
+def _rolling(x, windows, with_std=False):
+    n, length = x.shape
+    w = windows.astype(np.int64)
+    nan = np.isnan(x)
+    count = np.maximum((~nan).sum(axis=1, keepdims=True), 1)
+    shift = np.where(nan, 0.0, x).sum(axis=1, keepdims=True)/count
+    xs = np.where(nan, 0.0, x - shift)
+
+    # Cumulative sums with a leading zero column so window sums become differences
+    zeros = np.zeros((n, 1))
+    cs = np.concatenate([zeros, np.cumsum(xs, axis=1)], axis=1)
+    cn = np.concatenate([zeros, np.cumsum(nan, axis=1)], axis=1)
+    hi = np.broadcast_to(np.arange(1, length+1), (n, length))
+    lo = hi - w
+    valid = lo >= 0
+    lo = np.where(valid, lo, 0)
+
+    def window_sum(c):
+        return np.take_along_axis(c, hi, axis=1) - np.take_along_axis(c, lo, axis=1)
+
+    valid &= window_sum(cn) == 0
+    s = window_sum(cs)
+    mean = np.where(valid, s/w + shift, np.nan)
+    if(not with_std):
+        return mean
+
+    cs2 = np.concatenate([zeros, np.cumsum(xs*xs, axis=1)], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (window_sum(cs2) - (s*s)/w)/(w - 1)
+    std = np.where(valid & (w > 1), np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return mean, std
+
+"""Convert 0/1 state series into 1 on a fresh buy state, -1 on a fresh sell state, else 0"""
+def _entries(buy_state, sell_state):
+    buy_position = _diff(buy_state.astype(np.float64))
+    sell_position = _diff(sell_state.astype(np.float64))
+    return np.where(buy_position == 1, 1.0, np.where(sell_position == 1, -1.0, 0.0))
+
+"""Exponential moving average with adjust=False (pandas ewm(span).mean())"""
+def ema(prices, span):
+    x, (span,), squeeze = _as_rows(prices, span)
+    alpha = 2.0/(span.astype(np.float64) + 1.0)
+    out = np.empty_like(x)
+    out[:, 0] = x[:, 0]
+    for t in range(1, x.shape[1]):
+        out[:, t] = alpha[:, 0]*x[:, t] + (1.0 - alpha[:, 0])*out[:, t-1]
+    return _restore(out, squeeze)
+
+"""Simple moving average, NaN until the window is full"""
+def sma(prices, window):
+    x, (window,), squeeze = _as_rows(prices, window)
+    return _restore(_rolling(x, window), squeeze)
+
+"""Rolling sample standard deviation, NaN until the window is full"""
+def rolling_std(prices, window):
+    x, (window,), squeeze = _as_rows(prices, window)
+    return _restore(_rolling(x, window, with_std=True)[1], squeeze)
+
+"""
+EMA/SMA crossover signal as used by MAAgent
+1.0 when the short EMA crosses above the long SMA, -1.0 when it crosses below, else 0.0
+The first element is NaN as there is no previous position
+"""
+def ma_crossover(prices, ema_span, sma_window):
+    x, (ema_span, sma_window), squeeze = _as_rows(prices, ema_span, sma_window)
+    fast = ema(x, ema_span[:, 0])
+    slow = _rolling(x, sma_window)
+    position = np.where(fast > slow, 1.0, 0.0)
+    return _restore(_diff(position), squeeze)
+
+"""
+Bollinger band touches as used by BollingerAgent
+1.0 when price first touches the lower band, -1.0 when it first touches the upper band, else 0.0
+"""
+def bollinger_touches(prices, window, num_std=2.0):
+    x, (window, num_std), squeeze = _as_rows(prices, window, num_std)
+    mid, std = _rolling(x, window, with_std=True)
+    high_band = mid + std*num_std
+    low_band = mid - std*num_std
+    return _restore(_entries(x <= low_band, x >= high_band), squeeze)
+
+"""Relative strength index over a simple moving average of rounded gains and losses"""
+def rsi(prices, window):
+    x, (window,), squeeze = _as_rows(prices, window)
+    diff = _diff(x)
+    gain = np.round(np.clip(diff, 0, None), 2)
+    loss = np.round(np.clip(diff, None, 0), 2)
+    avg_gain = _rolling(gain, window)
+    avg_loss = -_rolling(loss, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rs = avg_gain/avg_loss
+        out = 100 - (100/(1.0 + rs))
+    return _restore(out, squeeze)
+
+"""
+RSI threshold crossings as used by RSIAgent
+1.0 when RSI first drops to the oversold level, -1.0 when it first rises to the overbought level, else 0.0
+"""
+def rsi_crossings(prices, window, overbought, oversold):
+    x, (window, overbought, oversold), squeeze = _as_rows(prices, window, overbought, oversold)
+    values = rsi(x, window[:, 0])
+    return _restore(_entries(values <= oversold, values >= overbought), squeeze)
+
+"""
+Compute all technical agent signals for whole price histories in one call
+Returns a dictionary keyed by signal agent name
+"""
+def technical_signals(prices, ema_span, sma_window, bollinger_window, rsi_window, rsi_overbought, rsi_oversold):
+    return {
+        'MAAgent': ma_crossover(prices, ema_span, sma_window),
+        'BollingerAgent': bollinger_touches(prices, bollinger_window),
+        'RSIAgent': rsi_crossings(prices, rsi_window, rsi_overbought, rsi_oversold)
+    }
@@ -0,0 +1,34 @@
+from collections import namedtuple
+import numpy as np
+from utils.cbr_utils import CompiledCBR, cbr_columns
+
+"""
+Immutable, versioned set of parameters read on the decision path
+Agent weights are held as a read-only vector aligned with agent_names, next to the CBR model,
+its compiled coefficients and the CBR feature order.
+Snapshots are never modified; publishing replaces the reference, so readers need no lock.
+"""
+class ModelSnapshot(namedtuple('ModelSnapshot', ['version', 'agent_names', 'weights', 'cbr_model', 'compiled_cbr', 'feature_order'])):
+    __slots__ = ()
+
+    """
+    Build a snapshot from a weights dictionary and a CBR model
+    Only a fitted model is compiled, compiled_cbr is None for a missing or unfitted one
+    """
+    @classmethod
+    def build(cls, version, weights, cbr_model):
+        agent_names = tuple(weights.keys())
+        vector = np.array([weights[name] for name in agent_names], dtype=np.float64)
+        vector.setflags(write=False)
+        compiled_cbr = CompiledCBR(cbr_model) if hasattr(cbr_model, 'coef_') else None
+        return cls(version, agent_names, vector, cbr_model, compiled_cbr, tuple(cbr_columns(agent_names)))
+
+    """Derive the next version, keeping any component that is not replaced"""
+    def evolve(self, weights=None, cbr_model=None):
+        return ModelSnapshot.build(self.version + 1,
+            self.weights_dict() if weights is None else weights,
+            self.cbr_model if cbr_model is None else cbr_model)
+
+    """Get agent weights as a dictionary keyed by agent name"""
+    def weights_dict(self):
+        return dict(zip(self.agent_names, self.weights.tolist()))
@@ -0,0 +1,48 @@
+import sys
+import time
+import logging
+import importlib
+from threading import Thread
+from contextlib import contextmanager
+
+"""
+Startup timer to report how long each phase of a cold start takes
+Tracks wall time and the number of modules imported per phase
+"""
+class StartupTimer():
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.start_modules = len(sys.modules)
+        self.phases = []
+
+    """Time a named startup phase"""
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        modules = len(sys.modules)
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start, len(sys.modules) - modules))
+
+    """Log the duration of each phase and the total startup time"""
+    def report(self):
+        for name, duration, modules in self.phases:
+            logging.info(f'Startup {name}: {duration*1000:.1f} ms, {modules} modules imported')
+        logging.info(f'Startup total: {(time.perf_counter() - self.start)*1000:.1f} ms, {len(sys.modules) - self.start_modules} modules imported')
+
+"""
+Import modules in a background thread
+Used to overlap slow third-party imports with network setup on the main thread
+"""
+def preload(module_names):
+    def load():
+        for name in module_names:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logging.warning(f'Could not preload {name}: {e}')
+    thread = Thread(name='Preload', target=load, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,265 @@
+import os
+import json
+import sqlite3
+import threading
+import pandas as pd
+from abc import ABC, abstractmethod
+from utils import io_utils
+from utils.io_utils import Type
+
+"""
+Storage backend interface for the DAO Agent
+Completed trades, agent weights and published model versions are persisted through a backend,
+so callers can query what they need instead of loading the whole history.
+"""
+class StorageBackend(ABC):
+
+    """Append (or update, by Client_order_id) a dataframe of trades"""
+    @abstractmethod
+    def save_trades(self, trades):
+        pass
+
+    """Get all stored trades, None if there are none"""
+    @abstractmethod
+    def load_trades(self):
+        pass
+
+    """Get stored trades that have no PNL yet"""
+    @abstractmethod
+    def open_trades(self):
+        pass
+
+    """Get trades updated at or after a timestamp"""
+    @abstractmethod
+    def trades_since(self, timestamp):
+        pass
+
+    """Get the most recently stored trade as a series, None if there are none"""
+    def last_trade(self):
+        trades = self.load_trades()
+        return trades.iloc[-1] if trades is not None and len(trades) > 0 else None
+
+    """Append rows of agent weights"""
+    @abstractmethod
+    def save_weights(self, weights):
+        pass
+
+    """Get all stored agent weights, None if there are none"""
+    @abstractmethod
+    def load_weights(self):
+        pass
+
+    """Get the latest agent weights as a one row dataframe, None if there are none"""
+    def latest_weights(self):
+        weights = self.load_weights()
+        return weights.tail(1) if weights is not None and len(weights) > 0 else None
+
+    """Record a published model version and its agent weights"""
+    @abstractmethod
+    def save_model_version(self, version, weights):
+        pass
+
+    """Get all recorded model versions, None if there are none"""
+    @abstractmethod
+    def model_versions(self):
+        pass
+
+    """Release any resources held by the backend"""
+    def close(self):
+        pass
+
+"""Normalise a timestamp to a sortable UTC string"""
+def _timestamp(value):
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+    return ts.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+"""
+CSV storage backend
+Every table is a whole-file CSV in the data directory, the original storage format of the model
+"""
+class CSVStorage(StorageBackend):
+
+    model_versions_file = 'model_versions.csv'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _load(self, filename):
+        path = self._path(filename)
+        return io_utils.csv_to_df(path) if os.path.exists(path) else None
+
+    def _append(self, filename, df):
+        old_df = self._load(filename)
+        updated_df = df if old_df is None else pd.concat([old_df, df], axis=0, copy=False)
+        io_utils.df_to_csv(updated_df, self._path(filename))
+
+    def save_trades(self, trades):
+        self._append(Type.ACCOUNT_BOOK.value, trades)
+
+    def load_trades(self):
+        return self._load(Type.ACCOUNT_BOOK.value)
+
+    def open_trades(self):
+        trades = self.load_trades()
+        return None if trades is None else trades[trades['PNL'].isnull()]
+
+    def trades_since(self, timestamp):
+        trades = self.load_trades()
+        if(trades is None):
+            return None
+        updated_at = pd.to_datetime(trades['Updated_at'], utc=True)
+        return trades[updated_at >= pd.Timestamp(_timestamp(timestamp), tz='UTC')]
+
+    def save_weights(self, weights):
+        self._append(Type.AGENT_WEIGHTS.value, weights)
+
+    def load_weights(self):
+        return self._load(Type.AGENT_WEIGHTS.value)
+
+    def save_model_version(self, version, weights):
+        self._append(self.model_versions_file, pd.DataFrame({'Version': version, 'Created_at': _timestamp(pd.Timestamp.now(tz='UTC')), **weights}, index=[0]))
+
+    def model_versions(self):
+        return self._load(self.model_versions_file)
+
+"""
+SQLite storage backend in WAL mode
+Trades, weights and model versions are tables indexed on the columns they are queried by,
+so readers on other threads don't block the writer and lookups don't scan the full history.
+Trade columns that are not part of the fixed schema (agent signals, OHLCV, ...) are added as they appear.
+"""
+class SQLiteStorage(StorageBackend):
+
+    trade_columns = {'Client_order_id': 'TEXT PRIMARY KEY', 'Status': 'TEXT', 'Created_at': 'TEXT', 'Updated_at': 'TEXT', 'PNL': 'REAL'}
+    timestamp_columns = ['Created_at', 'Updated_at']
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        db = self._connection()
+        db.execute('PRAGMA journal_mode=WAL')
+        with db:
+            db.execute(f'CREATE TABLE IF NOT EXISTS trades ({", ".join(f"{_quote(c)} {t}" for c, t in self.trade_columns.items())})')
+            db.execute('CREATE INDEX IF NOT EXISTS trades_status ON trades (Status)')
+            db.execute('CREATE INDEX IF NOT EXISTS trades_created_at ON trades (Created_at)')
+            db.execute('CREATE INDEX IF NOT EXISTS trades_updated_at ON trades (Updated_at)')
+            db.execute('CREATE TABLE IF NOT EXISTS weights (row_id INTEGER NOT NULL, created_at TEXT NOT NULL, agent TEXT NOT NULL, weight REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS weights_row_id ON weights (row_id)')
+            db.execute('CREATE INDEX IF NOT EXISTS weights_created_at ON weights (created_at)')
+            db.execute('CREATE TABLE IF NOT EXISTS model_versions (version INTEGER PRIMARY KEY, created_at TEXT NOT NULL, weights TEXT NOT NULL)')
+        self.columns = [row[1] for row in db.execute('PRAGMA table_info(trades)')]
+
+    """Get the connection of the calling thread, SQLite connections can't be shared between threads"""
+    def _connection(self):
+        db = getattr(self.local, 'db', None)
+        if(db is None):
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def _query(self, sql, params=()):
+        df = pd.read_sql_query(sql, self._connection(), params=params)
+        return df if len(df) > 0 else None
+
+    """Add trade columns that are not in the table yet"""
+    def _add_columns(self, db, trades):
+        for col in trades.columns:
+            if(col not in self.columns):
+                col_type = 'REAL' if pd.api.types.is_numeric_dtype(trades[col]) and col not in self.timestamp_columns else 'TEXT'
+                db.execute(f'ALTER TABLE trades ADD COLUMN {_quote(col)} {col_type}')
+                self.columns.append(col)
+
+    def save_trades(self, trades):
+        if(trades is None or len(trades) == 0):
+            return
+        trades = trades.copy()
+        for col in self.timestamp_columns:
+            if(col in trades.columns):
+                trades[col] = [None if pd.isnull(x) else _timestamp(x) for x in trades[col]]
+        trades = trades.astype(object).where(trades.notnull(), None)
+        columns = list(trades.columns)
+        sql = f'INSERT OR REPLACE INTO trades ({", ".join(_quote(c) for c in columns)}) VALUES ({", ".join("?"*len(columns))})'
+        with self.write_lock:
+            db = self._connection()
+            with db:
+                self._add_columns(db, trades)
+                db.executemany(sql, trades.itertuples(index=False, name=None))
+
+    def load_trades(self):
+        return self._query('SELECT * FROM trades ORDER BY rowid')
+
+    def open_trades(self):
+        return self._query('SELECT * FROM trades WHERE PNL IS NULL ORDER BY rowid')
+
+    def trades_since(self, timestamp):
+        return self._query('SELECT * FROM trades WHERE Updated_at >= ? ORDER BY Updated_at', (_timestamp(timestamp),))
+
+    def last_trade(self):
+        trades = self._query('SELECT * FROM trades ORDER BY rowid DESC LIMIT 1')
+        return None if trades is None else trades.iloc[0]
+
+    def save_weights(self, weights):
+        if(weights is None or len(weights) == 0):
+            return
+        created_at = _timestamp(pd.Timestamp.now(tz='UTC'))
+        with self.write_lock:
+            db = self._connection()
+            with db:
+                row_id = db.execute('SELECT COALESCE(MAX(row_id), 0) FROM weights').fetchone()[0]
+                rows = []
+                for i, (_, row) in enumerate(weights.iterrows(), start=row_id+1):
+                    rows.extend((i, created_at, agent, float(weight)) for agent, weight in row.items())
+                db.executemany('INSERT INTO weights (row_id, created_at, agent, weight) VALUES (?, ?, ?, ?)', rows)
+
+    """Pivot long-format weight rows back to one column per agent"""
+    def _pivot_weights(self, df):
+        if(df is None):
+            return None
+        agents = list(dict.fromkeys(df['agent']))
+        weights = df.pivot(index='row_id', columns='agent', values='weight')[agents]
+        weights.columns.name = None
+        return weights.reset_index(drop=True)
+
+    def load_weights(self):
+        return self._pivot_weights(self._query('SELECT row_id, agent, weight FROM weights ORDER BY row_id, rowid'))
+
+    def latest_weights(self):
+        return self._pivot_weights(self._query('SELECT row_id, agent, weight FROM weights WHERE row_id = (SELECT MAX(row_id) FROM weights) ORDER BY rowid'))
+
+    def save_model_version(self, version, weights):
+        with self.write_lock:
+            db = self._connection()
+            with db:
+                db.execute('INSERT OR REPLACE INTO model_versions (version, created_at, weights) VALUES (?, ?, ?)',
+                    (int(version), _timestamp(pd.Timestamp.now(tz='UTC')), json.dumps(weights)))
+
+    def model_versions(self):
+        df = self._query('SELECT version, created_at, weights FROM model_versions ORDER BY version')
+        if(df is None):
+            return None
+        weights = pd.DataFrame([json.loads(w) for w in df['weights']])
+        return pd.concat([df[['version', 'created_at']].rename(columns={'version': 'Version', 'created_at': 'Created_at'}), weights], axis=1)
+
+    def close(self):
+        db = getattr(self.local, 'db', None)
+        if(db is not None):
+            db.close()
+            self.local.db = None
+
+"""Quote an identifier for use in SQL"""
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+"""Create a storage backend by name"""
+def create_storage(name, directory):
+    if(name == 'csv'):
+        return CSVStorage(directory)
+    if(name == 'sqlite'):
+        return SQLiteStorage(os.path.join(directory, 'trading.db'))
+    raise ValueError(f'Unknown storage backend {name}')
@@ -0,0 +1,83 @@
+import json
+
+"""Convert numpy scalars and other values json can't serialise"""
+def json_default(value):
+    if(hasattr(value, 'item')):
+        return value.item()
+    return str(value)
+
+"""
+Trade record passed along the decision path (Decider -> CEO -> DAO -> PowerBI)
+Fixed schema: agent signals and macroeconomic values keyed by name, then VaR, order, candle and summary fields.
+Fields live in slots instead of a per-trade dict, and item access is kept so records can be used like the old trade dicts.
+"""
+class TradeRecord():
+
+    # Fields stored in the account book, in column order after the signals and macroeconomic values
+    account_fields = ('VaR', 'Action', 'Price', 'Type', 'Quantity', 'Balance', 'Model_version',
+        'Open', 'High', 'Low', 'Close', 'Volume',
+        'Client_order_id', 'Status', 'Created_at', 'Updated_at', 'Symbol')
+
+    # Fields filled in after the order is booked, for reporting only
+    summary_fields = ('Timestamp', 'Total_Balance', 'Crypto', 'Start_Capital', 'Stop_Loss', 'Take_Profit')
+    fields = account_fields + summary_fields
+    candle_fields = ('Open', 'High', 'Low', 'Close', 'Volume')
+    _field_set = frozenset(fields)
+
+    __slots__ = ('signals', 'macro') + fields
+
+    def __init__(self, signals, macro):
+        self.signals = signals
+        self.macro = macro
+        for field in self.fields:
+            setattr(self, field, None)
+
+    def __getitem__(self, key):
+        if(key in self._field_set):
+            return getattr(self, key)
+        if(key in self.signals):
+            return self.signals[key]
+        if(key in self.macro):
+            return self.macro[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if(key in self._field_set):
+            setattr(self, key, value)
+        elif(key in self.signals):
+            self.signals[key] = value
+        elif(key in self.macro):
+            self.macro[key] = value
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._field_set or key in self.signals or key in self.macro
+
+    """Names of all fields, signals and macroeconomic values first"""
+    def keys(self):
+        return list(self.signals) + list(self.macro) + list(self.fields)
+
+    """Copy OHLCV values from the latest candlestick"""
+    def set_candle(self, candle):
+        for field in self.candle_fields:
+            setattr(self, field, candle[field])
+
+    """Account book column names of this record"""
+    def columns(self):
+        return tuple(self.signals) + tuple(self.macro) + self.account_fields
+
+    """Account book row of this record, in the order of columns()"""
+    def row(self):
+        return tuple(self.signals.values()) + tuple(self.macro.values()) + tuple(getattr(self, field) for field in self.account_fields)
+
+    """Get the record as a plain dictionary"""
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    """Serialise the record as JSON for dashboards"""
+    def to_json(self):
+        return json.dumps(self.to_dict(), default=json_default)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()})'